@@ -1,79 +1,297 @@
 import argparse
-from collections import defaultdict
-from typing import Dict, List
+import os
+import pickle
+from collections import defaultdict, Counter
+from typing import Dict, List, Set, Optional
 import mmh3
+import numpy as np
 
-def create_sum_map(path: str, sum_path: str, map_path: str, dataset: str) -> None:
-    outgoing_properties: Dict[str, str] = defaultdict(set)
-    incoming_properties: Dict[str, str] = defaultdict(set)
+from graphs.ntParser import COMPRESSED, encode_graph_nt, find_nt, is_type_predicate, read_lines, split_count, write_count
 
-    with open(path, 'r') as file:
-        triples = file.read().splitlines()
-        for triple in triples:
-            triple_list = triple[:-2].split(" ", maxsplit=2)
-            if triple_list != ['']:
-                s, p, o = triple_list[0].lower(), triple_list[1].lower(), triple_list[2].lower()
-                if p != '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>':
-                    outgoing_properties[s].add(p)
-                    if o.startswith("\""):
-                        incoming_properties['http://example.org/literal'].add(p)
-                    else:
-                        incoming_properties[o].add(p)
-
-        outgoing_properties_hashed: Dict[str, int] = dict()
-        for s1, p1 in outgoing_properties.items():
-            property_hash1 = mmh3.hash128(','.join(sorted(list(p1))).encode('utf8'))
-            outgoing_properties_hashed[s1] = property_hash1
-
-        incoming_properties_hashed: Dict[str, int] = dict()
-        for s2, p2 in incoming_properties.items():
-            property_hash2 = mmh3.hash128(','.join(sorted(list(p2))).encode('utf8'))
-            incoming_properties_hashed[s2] = property_hash2
-  
-        incoming_and_outgoing_properties_hashed: Dict[str, int] = dict()
-        for entity in set(incoming_properties.keys()).union(set(outgoing_properties.keys())):
-            incoming = incoming_properties_hashed[entity] if entity in incoming_properties_hashed else 0
-            outgoing = outgoing_properties_hashed[entity] if entity in outgoing_properties_hashed else 0
-            combined_hash = incoming + outgoing
-            incoming_and_outgoing_properties_hashed[entity] = combined_hash
-
-        write_sum_map_files(outgoing_properties_hashed, triples, f'{sum_path}{dataset}_sum_out.nt', f'{map_path}{dataset}_map_out.nt')
-        write_sum_map_files(incoming_properties_hashed, triples, f'{sum_path}{dataset}_sum_in.nt', f'{map_path}{dataset}_map_in.nt')
-        write_sum_map_files(incoming_and_outgoing_properties_hashed, triples, f'{sum_path}{dataset}_sum_in_out.nt', f'{map_path}{dataset}_map_in_out.nt')
-
-def write_sum_map_files(property_hashes: Dict[str, int], triples: List[str], sum_path: str, map_path: str) -> None:
-
-    property_keys = property_hashes.keys()
-    mapping: Dict[int, str] = dict()
-
-    # create sum file
+"""This file creates the incoming (in), outgoing (out) and incoming/outgoing (in_out) attribute summaries of a graph.
+The per-entity property counts and hashes can be persisted in a state file. With the state file, triples appended to
+(or removed from) the graph can be processed incrementally: only the summary nodes of the affected entities are rehashed
+and only the summary triples and map lines of entities whose summary node changed are updated.
+Every distinct summary triple is written once with its multiplicity (see graphs/ntParser.py).
+"""
+
+LITERAL = 'http://example.org/literal'
+SUMMARIES = ['out', 'in', 'in_out']
+
+def split_triple(triple: str) -> Optional[List[str]]:
+    triple_list = triple[:-2].split(" ", maxsplit=2)
+    if triple_list == ['']:
+        return None
+    return [triple_list[0].lower(), triple_list[1].lower(), triple_list[2].lower()]
+
+def property_key(node: str) -> str:
+    # all literals share one summary node
+    return LITERAL if node.startswith("\"") else node
+
+def summary_node(node: str, property_hashes: Dict[str, int]) -> str:
+    return property_hashes.get(property_key(node), '0')
+
+def new_state() -> dict:
+    return {'outgoing': defaultdict(Counter), 'incoming': defaultdict(Counter), 'degree': Counter(),
+            'hashes': {summary: dict() for summary in SUMMARIES}}
+
+def count_triple(state: dict, s: str, p: str, o: str, n: int=1) -> None:
+    """add (n > 0) or remove (n < 0) the properties of a triple to/from the state"""
+    state['degree'][s] += n
+    state['degree'][o] += n
+    if not is_type_predicate(p):
+        for properties, entity in [(state['outgoing'], s), (state['incoming'], property_key(o))]:
+            properties[entity][p] += n
+            if properties[entity][p] <= 0:
+                del properties[entity][p]
+            if not properties[entity]:
+                del properties[entity]
+
+def count_triples(state: dict, terms: List[str], triples: np.ndarray) -> None:
+    """add the properties of all (encoded, lowercased) triples to the state, like count_triple for every triple"""
+    degree = np.bincount(triples[:, [0, 2]].reshape(-1), minlength=len(terms))
+    for node in np.flatnonzero(degree).tolist():
+        state['degree'][terms[node]] += int(degree[node])
+    type_ids = [i for i, term in enumerate(terms) if is_type_predicate(term)]
+    properties = triples[~np.isin(triples[:, 1], type_ids)]
+    # all literals share one entity (see property_key), with the id len(terms)
+    keys = terms + [LITERAL]
+    literal = np.array([term.startswith("\"") for term in terms], dtype=bool)
+    entity_of = np.where(literal, len(terms), np.arange(len(terms)))
+    for counts, entities in [(state['outgoing'], properties[:, 0]), (state['incoming'], entity_of[properties[:, 2]])]:
+        pairs, n = np.unique(np.stack([entities, properties[:, 1]], axis=1), axis=0, return_counts=True)
+        for (entity, p), count in zip(pairs.tolist(), n.tolist()):
+            counts[keys[entity]][terms[p]] += count
+
+def hash_properties(properties: Counter) -> int:
+    return mmh3.hash128(','.join(sorted(list(properties))).encode('utf8'))
+
+def update_hashes(state: dict, entities: Set[str]) -> None:
+    out_hashes, in_hashes, in_out_hashes = [state['hashes'][summary] for summary in SUMMARIES]
+    for entity in entities:
+        for properties, hashes in [(state['outgoing'], out_hashes), (state['incoming'], in_hashes)]:
+            if entity in properties:
+                hashes[entity] = hash_properties(properties[entity])
+            else:
+                hashes.pop(entity, None)
+        if entity in out_hashes or entity in in_hashes:
+            in_out_hashes[entity] = in_hashes.get(entity, 0) + out_hashes.get(entity, 0)
+        else:
+            in_out_hashes.pop(entity, None)
+
+def save_state(state: dict, state_path: str) -> None:
+    with open(state_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def update_files(path: str, sum_path: str, map_path: str, dataset: str) -> List[str]:
+    '''the files that are rewritten by an update, without the state file'''
+    return [path] + [f'{sum_path}{dataset}_sum_{summary}.nt' for summary in SUMMARIES] + [f'{map_path}{dataset}_map_{summary}.nt' for summary in SUMMARIES]
+
+def finish_update(files: List[str], state_path: str) -> None:
+    """Roll forward or discard an interrupted update (see update_sum_map).
+    A complete .tmp state file is written after all other .tmp files, so all .tmp files of the update are complete and
+    replace their files (the state last). Otherwise no file was replaced yet and the .tmp files are removed.
+    """
+    leftover = [f for f in files + [state_path] if os.path.isfile(f'{f}.tmp')]
+    if not leftover:
+        return
+    complete = False
+    if os.path.isfile(f'{state_path}.tmp'):
+        try:
+            with open(f'{state_path}.tmp', 'rb') as f:
+                pickle.load(f)
+            complete = True
+        except (EOFError, pickle.UnpicklingError):
+            pass
+    for f in leftover:
+        if complete:
+            os.replace(f'{f}.tmp', f)
+        else:
+            os.remove(f'{f}.tmp')
+    print(f'{"completed" if complete else "discarded"} an interrupted summary update ({len(leftover)} files)')
+
+def create_sum_map(path: str, sum_path: str, map_path: str, dataset: str, state_path: Optional[str]=None) -> None:
+    if state_path is not None:
+        finish_update(update_files(path, sum_path, map_path, dataset), state_path)
+    state = new_state()
+
+    # the graph is parsed into (lowercased) integer triples by a process pool (see graphs/ntParser.py)
+    terms, triples = encode_graph_nt(path)
+    count_triples(state, terms, triples)
+
+    update_hashes(state, set(state['outgoing'].keys()).union(set(state['incoming'].keys())))
+
+    for summary in SUMMARIES:
+        write_sum_map_files(state['hashes'][summary], terms, triples, f'{sum_path}{dataset}_sum_{summary}.nt', f'{map_path}{dataset}_map_{summary}.nt')
+
+    if state_path is not None:
+        save_state(state, state_path)
+
+def sum_triple(s: str, p: str, o: str, property_hashes: Dict[str, int]) -> str:
+    return f'<{summary_node(s, property_hashes)}> {p} <{summary_node(o, property_hashes)}> .'
+
+def read_sum_counts(sum_path: str) -> Counter:
+    '''multiplicity of every summary triple of a sum file (files with duplicate lines are counted as well)'''
+    counts: Counter = Counter()
+    for line in read_lines(sum_path):
+        triple, count = split_count(line)
+        if split_triple(triple) is not None:
+            counts[triple] += count
+    return counts
+
+def write_sum_counts(counts: Counter, sum_path: str) -> None:
     with open(sum_path, "w") as f:
-        for triple in triples:
-            triple_list = triple[:-2].split(" ", maxsplit=2)
-            if triple_list != ['']:
-                s, p, o = triple_list[0].lower(), triple_list[1].lower(), triple_list[2].lower()
-                if o.startswith("\"") and 'http://example.org/literal' in property_keys:
-                    obj = property_hashes['http://example.org/literal']
-                else:
-                    obj = property_hashes[o] if o in property_keys else '0'
-                sub = property_hashes[s] if s in property_keys else '0'
-                mapping[s] = sub
-                mapping[o] = obj
-                f.write(f'<{sub}> {p} <{obj}> .\n')
+        f.writelines(write_count(triple, count) for triple, count in counts.items() if count > 0)
+
+def write_sum_map_files(property_hashes: Dict[str, int], terms: List[str], triples: np.ndarray, sum_path: str, map_path: str) -> None:
+    # the summary node of every term
+    sum_ids: Dict[str, int] = dict()
+    sum_node = np.fromiter((sum_ids.setdefault(summary_node(term, property_hashes), len(sum_ids)) for term in terms), dtype=np.int64, count=len(terms))
+    sum_nodes = list(sum_ids.keys())
+
+    # create sum file, the summary triples are written in the order of their first occurrence
+    sum_triples, first, n = np.unique(np.stack([sum_node[triples[:, 0]], triples[:, 1], sum_node[triples[:, 2]]], axis=1), axis=0,
+                                      return_index=True, return_counts=True)
+    order = np.argsort(first)
+    counts = Counter({f'<{sum_nodes[s]}> {terms[p]} <{sum_nodes[o]}> .': count for (s, p, o), count in zip(sum_triples[order].tolist(), n[order].tolist())})
+    write_sum_counts(counts, sum_path)
 
     # create map file
+    nodes = np.unique(triples[:, [0, 2]])
     with open(map_path, "w") as m:
-        for o_node, s_node in mapping.items():
-            m.write(f'<{s_node}> <isSummaryOf> {str(o_node)} .\n')
+        m.writelines(f'<{sum_nodes[sum_node[node]]}> <isSummaryOf> {terms[node]} .\n' for node in nodes.tolist())
+
+def read_delta(path: Optional[str]) -> List[str]:
+    if path is None:
+        return []
+    with open(path, 'r') as file:
+        return [triple for triple in file.read().splitlines() if split_triple(triple) is not None]
+
+def update_sum_map(path: str, sum_path: str, map_path: str, dataset: str, state_path: str, add_path: Optional[str]=None, remove_path: Optional[str]=None) -> None:
+    """Apply a delta of added and removed triples to the graph, its attribute summaries and the state file.
+    Removed triples are matched line by line against the graph file, triples that are not in the graph are ignored.
+    The graph file is rewritten, so it can not be compressed.
+    All files are written to .tmp files first, the state last, then they replace the files, the state last. An update that is
+    interrupted (e.g. the process is killed, not a power loss: the files are not synced) is rolled forward or discarded by the next run.
+    """
+    assert not path.endswith(COMPRESSED), f'incremental updates require an uncompressed graph file, {path} is compressed'
+    files = update_files(path, sum_path, map_path, dataset)
+    finish_update(files, state_path)
+    with open(state_path, 'rb') as f:
+        state = pickle.load(f)
+
+    added = read_delta(add_path)
+    removed = Counter(read_delta(remove_path))
+
+    # only remove triples that are present in the graph
+    to_remove: Counter = Counter()
+    if removed:
+        with open(path, 'r') as file:
+            for line in file:
+                triple = line.rstrip('\r\n')
+                if removed[triple] > to_remove[triple]:
+                    to_remove[triple] += 1
+
+    delta = [(triple, -n) for triple, n in to_remove.items()] + [(triple, 1) for triple in added]
+    delta_nodes: Dict[str, int] = dict()
+    affected: Set[str] = set()
+    for triple, n in delta:
+        s, p, o = split_triple(triple)
+        for node in [s, o]:
+            delta_nodes.setdefault(node, state['degree'][node])
+        count_triple(state, s, p, o, n)
+        affected.update([s, property_key(o)])
+
+    old_hashes = {summary: {entity: state['hashes'][summary].get(entity) for entity in affected} for summary in SUMMARIES}
+    update_hashes(state, affected)
+    changed = {entity for entity in affected if any(old_hashes[summary][entity] != state['hashes'][summary].get(entity) for summary in SUMMARIES)}
+
+    new_nodes = [node for node, degree in delta_nodes.items() if degree <= 0 and state['degree'][node] > 0]
+    vanished = {node for node in delta_nodes if state['degree'][node] <= 0}
+    for node in vanished:
+        del state['degree'][node]
+    print(f'{sum(to_remove.values())} triples removed, {len(added)} triples added, {len(changed)} summary nodes changed')
+
+    sum_files = [f'{sum_path}{dataset}_sum_{summary}.nt' for summary in SUMMARIES]
+    map_files = [f'{map_path}{dataset}_map_{summary}.nt' for summary in SUMMARIES]
+
+    def old_summary_node(node: str, summary: str) -> str:
+        # only the hashes of the affected entities changed, their previous hashes are in old_hashes
+        entity = property_key(node)
+        if entity in affected:
+            old_hash = old_hashes[summary][entity]
+            return old_hash if old_hash is not None else '0'
+        return summary_node(node, state['hashes'][summary])
+
+    # removed triples (and triples of entities whose summary node changed) move their multiplicity from their old
+    # to their new summary triple, the summary triples of all other triples keep their counts
+    sum_counts = [read_sum_counts(f) for f in sum_files]
+    pending = Counter(to_remove)
+
+    def move(s: str, p: str, o: str, n_old: int, n_new: int) -> None:
+        for summary, counts in zip(SUMMARIES, sum_counts):
+            if n_old:
+                old_triple = f'<{old_summary_node(s, summary)}> {p} <{old_summary_node(o, summary)}> .'
+                counts[old_triple] -= n_old
+                if counts[old_triple] <= 0:
+                    del counts[old_triple]
+            if n_new:
+                counts[sum_triple(s, p, o, state['hashes'][summary])] += n_new
+
+    with open(path, 'r') as org, open(f'{path}.tmp', 'w') as new_org:
+        for line in org:
+            triple = line.rstrip('\r\n')
+            triple_list = split_triple(triple)
+            if pending[triple] > 0:
+                pending[triple] -= 1
+                if triple_list is not None:
+                    move(*triple_list, 1, 0)
+                continue
+            new_org.write(f'{triple}\n')
+            if triple_list is not None and (property_key(triple_list[0]) in changed or property_key(triple_list[2]) in changed):
+                move(*triple_list, 1, 1)
+        for triple in added:
+            new_org.write(f'{triple}\n')
+            move(*split_triple(triple), 0, 1)
+
+    for f, counts in zip(sum_files, sum_counts):
+        write_sum_counts(counts, f'{f}.tmp')
+
+    for summary, map_file in zip(SUMMARIES, map_files):
+        hashes = state['hashes'][summary]
+        with open(map_file, 'r') as old_map, open(f'{map_file}.tmp', 'w') as new_map:
+            for line in old_map:
+                node = line.rstrip('\r\n')[:-2].split(" ", maxsplit=2)[2]
+                if node in vanished:
+                    continue
+                if property_key(node) in changed:
+                    new_map.write(f'<{summary_node(node, hashes)}> <isSummaryOf> {node} .\n')
+                else:
+                    new_map.write(line)
+            for node in new_nodes:
+                new_map.write(f'<{summary_node(node, hashes)}> <isSummaryOf> {node} .\n')
+
+    # the complete .tmp state marks a complete update (see finish_update)
+    save_state(state, f'{state_path}.tmp')
+    for f in files + [state_path]:
+        os.replace(f'{f}.tmp', f)
 
 
 if __name__=='__main__':
     parser = argparse.ArgumentParser(description='experiment arguments')
-    parser.add_argument('-dataset', type=str, choices=['AIFB', 'AM', 'BGS', 'MUTAG'], help='inidcate dataset name')
-    dataset = vars(parser.parse_args())['dataset']
+    parser.add_argument('-dataset', type=str, choices=['AIFB', 'AM', 'BGS', 'MUTAG', 'TEST'], help='inidcate dataset name')
+    parser.add_argument('-add', type=str, default=None, help='.nt file with triples to add to the graph (incremental mode)')
+    parser.add_argument('-remove', type=str, default=None, help='.nt file with triples to remove from the graph (incremental mode)')
+    args = vars(parser.parse_args())
+    dataset = args['dataset']
 
-    path = f'./graphs/{dataset}/{dataset}_complete.nt'
+    path = find_nt(f'./graphs/{dataset}/{dataset}_complete.nt')
     sum_path = f'./graphs/{dataset}/attr/sum/'
     map_path = f'./graphs/{dataset}/attr/map/'
+    state_path = f'./graphs/{dataset}/attr/{dataset}_attr_state.pkl'
 
-    create_sum_map(path, sum_path, map_path, dataset)
+    if args['add'] is not None or args['remove'] is not None:
+        assert os.path.isfile(state_path), f'no summary state found at {state_path}, create the summaries without -add/-remove first'
+        update_sum_map(path, sum_path, map_path, dataset, state_path, args['add'], args['remove'])
+    else:
+        create_sum_map(path, sum_path, map_path, dataset, state_path)
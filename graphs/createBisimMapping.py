@@ -1,37 +1,40 @@
 import argparse
-import csv
+import multiprocessing
+import os
 
 from collections import defaultdict
 from os import listdir
-from typing import Dict, List
-import click
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import numpy as np
 
-"""Run this file from './graphdata/' .
-This file creates a mapping of the (k)bisimualition output created with the 
+from graphs.ntParser import encode_graph_nt, find_nt
+from helpers.threadTuner import set_parse_workers, stage_settings
+
+"""Run this file from the root directory: python -m graphs.createBisimMapping -dataset AIFB
+This file creates a mapping of the (k)bisimualition output created with the
 BiSimulation pipeline of Till Blume: https://github.com/t-blume/fluid-spark.
 For each folder in <dataset>/bisim/bisimOutput, triples like 'sumNode isSummaryOf orgNode'
 are stored in a .nt file in <dataset>/bisim/map/ .
+The k levels are converted by parallel worker processes. Only the (small) summary node mapping is kept in memory,
+the original node CSV is streamed. The mapped nodes are checked against the nodes of the original graph,
+which are indexed once and shared with the workers. The check only reports mapped nodes that are not in the original graph.
 """
 
-def compare_nodes(orgHash_to_orgNode: dict):
-    org_nodes = set()
-    with open(f'{dataset}/{dataset}_complete.nt', 'r') as file:
-        triples = file.read().splitlines()
-        for triple in triples:
-            triple_list = triple[:-2].split(" ", maxsplit=2)
-            if triple_list != ['']:
-                s, p, o = triple_list[0].lower(), triple_list[1].lower(), triple_list[2].lower()
-                for i in [s, o]:
-                    org_nodes.add(i)
-    count = 0
-    for _, orgNodes in orgHash_to_orgNode.items():
-            for node in orgNodes:
-                if node not in org_nodes:
-                    count+=1
-    if click.confirm(f'{count} mapped (probably literal) nodes do not match with original nodes. If {count} is < 1% of {len(org_nodes)} it probably wont harm performance. Do you want to continue?', default=True):
-        return
-
-def reformat(node: str) -> str:
+WRITE_BUFFER = 1 << 20
+
+# set before the worker pool is forked, so the workers share it without pickling
+ORG_NODES: Optional[Set[str]] = None
+
+def org_node_index(path: str) -> Optional[Set[str]]:
+    '''the (lower case) nodes of the original graph, None if there is no original graph'''
+    path = find_nt(path)
+    if not os.path.isfile(path):
+        print(f'{path} not found, mapped nodes are not checked')
+        return None
+    terms, triples = encode_graph_nt(path)
+    return set(terms[i] for i in np.unique(triples[:, [0, 2]]).tolist())
+
+def reformat(node: str, dataset: str) -> str:
     if dataset != 'AM' and dataset != 'BGS':
         if 'xmlschema' in node:
             split = node.rsplit('^^', 1)
@@ -61,53 +64,73 @@ def reformat(node: str) -> str:
     if dataset == 'BGS':
         pass
 
+def read_csv(path: str) -> Iterator[List[str]]:
+    '''stream the (value, hash) rows of a FLUID csv file, values can contain commas, the hash is the last column'''
+    with open(path, 'rt') as f:
+        next(f)
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line:
+                yield line.rsplit(',', 1)
 
-def csv_to_mapping(path: str, org: bool = True) -> Dict[str, List[str]]:
+def hash_to_sum_nodes(path: str) -> Dict[str, List[str]]:
     mapping: Dict[str, List[str]] = defaultdict(list)
-    with open(path, 'rt') as f:
-        lines = csv.reader(f, skipinitialspace=False, quotechar=None)
-        next(lines)
-        for line in lines:
-            line = ','.join(line)
-            line = line.rsplit(',', 1)
-            if org:
-                node = reformat(line[0])
-                mapping[line[1]].append(node)
-            else:
-                mapping[line[0]].append(line[1])
+    for sumNode, orgHash in read_csv(path):
+        mapping[orgHash].append(sumNode)
     return mapping
 
-def write_to_nt(orgHash_to_orgNode: defaultdict(list), sumNode_to_orgHash: defaultdict(list), map_path: str, k: str) -> None:
-    with open(f'{map_path}{k}.nt', 'w') as m:
-            for sumNode, orgHashes in sumNode_to_orgHash.items():
-                for orgHash in orgHashes:
-                    nodes = orgHash_to_orgNode[orgHash]
-                    for node in nodes:
-                        m.write(f'<{sumNode}> <isSummaryOf> {node} .\n')
-    print('Mapping saved')
-
-def create_bisim_map_nt(path: str, map_path: str) -> None:
-    dirs = sorted([x for x in listdir(path) if not x.startswith('.')])
-    for dir in dirs:
-        files = sorted([s for s in listdir(f'{path}/{dir}/') if not s.startswith('.')])
-        for file in files:
-            if file.startswith('orgNode'):
-                orgHash_to_orgNode = csv_to_mapping(f'{path}/{dir}/{file}')
-            else:
-                sumNode_to_orgHash = csv_to_mapping(f'{path}/{dir}/{file}', org=False)
-        
-        # compare node from map file with original file
-        compare_nodes(orgHash_to_orgNode)
+def convert_level(task: Tuple[str, str, str, str]) -> Tuple[str, int, int, int]:
+    '''write the map file of one k level, returns the map file, the number of mapping triples, mapped nodes and mapped nodes that are not in the original graph'''
+    org_file, sum_file, map_file, dataset = task
+    sum_nodes = hash_to_sum_nodes(sum_file)
+    triples, mapped, missing = 0, 0, 0
+    with open(map_file, 'w', buffering=WRITE_BUFFER) as m:
+        for node, orgHash in read_csv(org_file):
+            if orgHash not in sum_nodes:
+                continue
+            node = reformat(node, dataset)
+            mapped += 1
+            if ORG_NODES is not None and node.lower() not in ORG_NODES:
+                missing += 1
+            m.writelines(f'<{sumNode}> <isSummaryOf> {node} .\n' for sumNode in sum_nodes[orgHash])
+            triples += len(sum_nodes[orgHash])
+    return map_file, triples, mapped, missing
 
+def create_bisim_map_nt(path: str, map_path: str, dataset: str, org_path: str, workers: Optional[int]=None) -> None:
+    global ORG_NODES
+    tasks = []
+    for dir in sorted([x for x in listdir(path) if not x.startswith('.') and os.path.isdir(f'{path}/{x}')]):
+        files = sorted([s for s in listdir(f'{path}/{dir}/') if not s.startswith('.')])
+        org_file = [f'{path}/{dir}/{file}' for file in files if file.startswith('orgNode')][0]
+        sum_file = [f'{path}/{dir}/{file}' for file in files if not file.startswith('orgNode')][0]
         k = dir.split('_')[-1]
-        write_to_nt(orgHash_to_orgNode, sumNode_to_orgHash, map_path, k)
+        tasks.append((org_file, sum_file, f'{map_path}{k}.nt', dataset))
+
+    # the original nodes are indexed once for all k levels
+    ORG_NODES = org_node_index(org_path)
+
+    workers = min(len(tasks), workers if workers is not None else os.cpu_count())
+    if workers <= 1:
+        results = [convert_level(task) for task in tasks]
+    else:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            results = pool.map(convert_level, tasks)
+
+    for map_file, triples, mapped, missing in results:
+        print(f'{map_file}: {triples} mapping triples saved')
+        if ORG_NODES is not None and missing > 0:
+            # mostly literals that are formatted differently, less than 1% probably wont harm performance
+            print(f'    {missing} of {mapped} mapped (probably literal) nodes ({missing / mapped * 100:.2f}%) do not match with the {len(ORG_NODES)} original nodes')
 
 if __name__=='__main__':
     parser = argparse.ArgumentParser(description='experiment arguments')
     parser.add_argument('-dataset', type=str, choices=['AIFB', 'AM', 'MUTAG', 'TEST'], help='inidcate dataset name')
-    dataset = vars(parser.parse_args())['dataset']
+    parser.add_argument('-workers', type=int, default=None, help='number of k levels converted in parallel (default: all)')
+    args = vars(parser.parse_args())
+    dataset = args['dataset']
 
+    set_parse_workers(stage_settings(dataset).get('parse'))
     path = f'./graphs/{dataset}/bisim/bisimOutput'
     map_path = f'./graphs/{dataset}/bisim/map/{dataset}_bisim_map_'
 
-    create_bisim_map_nt(path, map_path)
+    create_bisim_map_nt(path, map_path, dataset, f'./graphs/{dataset}/{dataset}_complete.nt', args['workers'])
@@ -1,26 +1,37 @@
 from copy import deepcopy
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Optional
 from os import listdir
 from os.path import isfile, join
-from sklearn.model_selection import train_test_split
 import torch
 
 from helpers import timing
-from graphs.graphProcessing import parse_graph_nt, nodes2type_mapping, get_node_mappings_dict, encode_org_node_labels, encode_sum_node_labels, remove_eval_data, get_idx_labels, get_classes
+from graphs.graphProcessing import nodes2type_mapping, get_node_mappings_dict, encode_org_node_labels, encode_sum_node_labels, remove_eval_data, get_idx_labels, get_classes, get_relation_buckets
 from graphs.graph import Graph
+from graphs.ntParser import encode_graph_nt, encode_nt
+from graphs.summaryProfiler import profile_summaries, select_summaries
 
 
 class Dataset:
-    def __init__(self, org_path: str, sum_path: str, map_path: str) -> None:
+    def __init__(self, org_path: str, sum_path: str, map_path: str, rel_min: int=0, rel_topk: Optional[int]=None,
+                 sum_select: Optional[Dict[str, float]]=None) -> None:
         self.org_path: str = org_path
         self.sum_path: str = sum_path
         self.map_path: str = map_path
+        self.rel_min: int = rel_min
+        self.rel_topk: Optional[int] = rel_topk
+        # selection policy (top_k, min_score, max_ratio, budget) of the summary graphs, None loads all summary graphs
+        self.sum_select: Optional[Dict[str, float]] = sum_select
+        self.relation_map: Dict[str, str] = None
+        self.sum_files: List[str] = None
+        self.sum_profiles: Dict[str, Dict[str, float]] = None
         self.sumGraphs: List[Graph] = []
         self.orgGraph: Graph = None
         self.enum_classes: Dict[str, int] = None
         self.num_classes: int = None
 
-    def make_trainig_data(self) -> None:
+    def make_trainig_data(self) -> Dict[str, List[str]]:
+        # sklearn (and scipy) are imported on first use
+        from sklearn.model_selection import train_test_split
         self.orgGraph.org2type  = encode_org_node_labels(self.orgGraph.org2type_dict, self.enum_classes, self.num_classes)
 
         g_idx, g_labels = get_idx_labels(self.orgGraph, self.orgGraph.org2type)
@@ -44,8 +55,9 @@ class Dataset:
 
         # romeve evaluation data from org2type: we use org2type to create weighted labels for summary graph training
         to_remove = X_test + X_val
-        org2type_pruned = remove_eval_data(to_remove, self.orgGraph)
+        return remove_eval_data(to_remove, self.orgGraph)
 
+    def make_sum_training_data(self, org2type_pruned: Dict[str, List[str]]) -> None:
         for sumGraph in self.sumGraphs:
             sumGraph.sum2type  = encode_sum_node_labels(sumGraph.sumNode2orgNode_dict, org2type_pruned, self.enum_classes, self.num_classes)
 
@@ -68,31 +80,53 @@ class Dataset:
         assert len(sum_files) == len(map_files), f'for every summary file there needs to be a map file.{sum_files} and {map_files}'
         return sorted(sum_files), sorted(map_files)
 
+    def select_files(self, sum_files: List[str], map_files: List[str], org2type_pruned: Dict[str, List[str]]) -> Tuple[List[str], List[str]]:
+        '''profile the summary graphs (with the training labels only) and keep the summary graphs selected by the policy'''
+        relations = set(self.orgGraph.relations.keys())
+        self.sum_profiles = profile_summaries(self.sum_path, self.map_path, sum_files, map_files, org2type_pruned, relations,
+                                              self.relation_map, self.orgGraph.num_nodes, self.orgGraph.num_edges)
+        selected = set(select_summaries(self.sum_profiles, **self.sum_select))
+        for sum_file, profile in self.sum_profiles.items():
+            print(f"{'selected' if sum_file in selected else 'skipped '} {sum_file}: " + ', '.join(f'{k} = {v:.3f}' for k, v in profile.items()))
+        timing.log('SUMMARY GRAPHS PROFILED')
+        pairs = [(s, m) for s, m in zip(sum_files, map_files) if s in selected]
+        return [s for s, _ in pairs], [m for _, m in pairs]
+
     def init_dataset(self) -> None:
-        org_graph_triples = parse_graph_nt(self.org_path)
+        # the files are parsed into integer triples by a process pool (see graphs/ntParser.py)
+        org_terms, org_triples, _ = encode_nt(self.org_path)
 
-        classes = get_classes(org_graph_triples)
+        classes = get_classes(org_terms, org_triples)
         enum_classes = {lab: i for i, lab in enumerate(classes)}
         self.enum_classes, self.num_classes = enum_classes, len(classes)
         
-        org2type_dict = nodes2type_mapping(org_graph_triples, classes)
+        org2type_dict = nodes2type_mapping(org_terms, org_triples, classes)
+
+        # the relation mapping of the original graph is applied to every summary graph as well
+        self.relation_map = get_relation_buckets(org_terms, org_triples, self.rel_min, self.rel_topk)
 
         file_name = self.org_path.split('/')[-1]
         self.orgGraph = Graph(file_name, deepcopy(org2type_dict))
-        self.orgGraph.init_graph(org_graph_triples)
+        self.orgGraph.init_graph(org_terms, org_triples, relation_map=self.relation_map)
+        del org_terms, org_triples
+        org2type_pruned = self.make_trainig_data()
 
         # init summary graph data
         sum_files, map_files = self.get_file_names()
+        if self.sum_select is not None:
+            sum_files, map_files = self.select_files(sum_files, map_files, org2type_pruned)
+        self.sum_files = sum_files
         for i, _ in enumerate(sum_files):
             sum_path = f'{self.sum_path}/{sum_files[i]}'
             map_path = f'{self.map_path}/{map_files[i]}'
-            sum_graph_triples = parse_graph_nt(sum_path)
-            map_graph_triples = parse_graph_nt(map_path)
+            sum_terms, sum_triples, sum_counts = encode_nt(sum_path)
+            map_terms, map_triples = encode_graph_nt(map_path)
             file_name = sum_path.split('/')[-1]
             sGraph = Graph(file_name, deepcopy(org2type_dict))
-            sGraph.init_graph(sum_graph_triples)
-            sGraph.orgNode2sumNode_dict, sGraph.sumNode2orgNode_dict = get_node_mappings_dict(map_graph_triples)
+            # summary graphs are trained on their distinct edges, weighted by multiplicity
+            sGraph.init_graph(sum_terms, sum_triples, sum_counts, self.relation_map, weighted=True)
+            sGraph.orgNode2sumNode_dict, sGraph.sumNode2orgNode_dict = get_node_mappings_dict(map_terms, map_triples)
             self.sumGraphs.append(sGraph)
 
-        self.make_trainig_data()
+        self.make_sum_training_data(org2type_pruned)
     
\ No newline at end of file
@@ -1,9 +1,19 @@
+import numpy as np
 import torch
 
-from typing import List, Dict
+from typing import List, Dict, Optional
 from torch_geometric.data import Data
 from torch import Tensor
 
+from graphs.ntParser import is_type_predicate
+
+
+def edge_norm(edge_index: Tensor, edge_type: Tensor, edge_weight: Tensor) -> Tensor:
+    '''edge_weight divided by the summed weight of the edges with the same target node and edge type'''
+    _, group = torch.unique(torch.stack([edge_index[1], edge_type]), dim=1, return_inverse=True)
+    total = torch.zeros_like(edge_weight).index_add_(0, group, edge_weight)
+    return edge_weight / total[group]
+
 
 class Graph:
     def __init__(self, name: str, org2type_dict: Dict[str, List[str]]) -> None:
@@ -21,49 +31,91 @@ class Graph:
         self.training_data: Data = None
         self.embedding: Tensor = None
 
-    def init_graph(self, graph_triples: List[str]) -> None:
-        subjects = set()
-        predicates = set()
-        objects = set()
-        n_edges = set()
-        
-        for triple in graph_triples:
-            n_edges.add(triple)
-            triple_list = triple[:-2].split(" ", maxsplit=2)
-            if triple_list != ['']:
-                s, p, o = triple_list[0].lower(), triple_list[1].lower(), triple_list[2].lower()
-                subjects.add(s)
-                predicates.add(p)
-                objects.add(o)
+    def init_graph(self, terms: List[str], triples: np.ndarray, counts: Optional[np.ndarray]=None, relation_map: Dict[str, str]=None,
+                   weighted: bool=False) -> None:
+        '''Initialize the graph from encoded triples: lowercased terms, integer triples and their multiplicities (see encode_nt in graphs/ntParser.py).
+        With weighted=True (summary graphs) every distinct edge is added once with its multiplicity (the number of lines
+        and their counts). training_data.edge_norm holds the multiplicities normalized over the
+        incoming edges of a node per edge type, the weighted mean aggregation with edge_norm equals the mean over all duplicate edges.
+        Otherwise every triple is added as an edge.
+        '''
+        # relation_map maps predicates to (shared) relations, unmapped predicates keep their own relation
+        if relation_map is None:
+            relation_map = dict()
+        if counts is None:
+            counts = np.ones(len(triples), dtype=np.int64)
+        self.num_edges = len(np.unique(triples, axis=0))
 
-        self.num_edges = len(n_edges)
-        # remove type edges from predicates
-        edges = ['<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>', '<type>']
-        for edge in edges:
-            if edge in predicates:
-                predicates.remove(edge)
+        # node to integer idx, the nodes are sorted by their term
+        node_ids = np.unique(triples[:, [0, 2]])
+        names = np.array([terms[i] for i in node_ids.tolist()], dtype=object)
+        order = np.argsort(names, kind='stable')
+        self.nodes = names[order].tolist()
+        self.num_nodes = len(self.nodes)
+        self.node_to_enum = {node: i for i, node in enumerate(self.nodes)}
+        node_index = np.full(len(terms), -1, dtype=np.int64)
+        node_index[node_ids[order]] = np.arange(self.num_nodes)
 
-        nodes = list(subjects.union(objects))
-        self.nodes = sorted(nodes)
-        self.num_nodes = len(nodes)
+        # relation to integer idx, without type edges
+        predicates = {p: relation_map.get(terms[p], terms[p]) for p in np.unique(triples[:, 1]).tolist()}
+        relations = {rel for rel in predicates.values() if not is_type_predicate(rel)}
+        self.relations = {rel: i for i, rel in enumerate(sorted(relations))}
+        relation_index = np.full(len(terms), -1, dtype=np.int64)
+        for p, rel in predicates.items():
+            relation_index[p] = self.relations.get(rel, -1)
 
-        # relation to integer idx
-        self.relations = {str(rel): i for i, rel in enumerate(list(predicates))}
-        # node to integer idx
-        self.node_to_enum = {str(node): i for i, node in enumerate(self.nodes)}
-    
+        src, rel, dst = node_index[triples[:, 0]], relation_index[triples[:, 1]], node_index[triples[:, 2]]
+        keep = rel >= 0
+        src, rel, dst, counts = src[keep], rel[keep], dst[keep], counts[keep]
+        if weighted:
+            edges, inverse = np.unique(np.stack([src, dst, rel], axis=1), axis=0, return_inverse=True)
+            edge_count = np.bincount(inverse.reshape(-1), weights=counts, minlength=len(edges))
+            src, dst, rel = edges[:, 0], edges[:, 1], edges[:, 2]
+        # every edge is added in both directions, with an even (forward) and odd (inverse) edge type
+        edge = np.stack([np.stack([src, dst, 2 * rel], axis=1), np.stack([dst, src, 2 * rel + 1], axis=1)], axis=1).reshape(-1, 3)
+        edge = torch.from_numpy(np.ascontiguousarray(edge.T))
+        edge_index, edge_type = edge[:2], edge[2]
+        
+        self.training_data = Data(edge_index=edge_index)
+        self.training_data.edge_type = edge_type
+        if weighted:
+            edge_weight = torch.tensor(edge_count, dtype=torch.float32).repeat_interleave(2)
+            self.training_data.edge_norm = edge_norm(edge_index, edge_type, edge_weight)
+
+    def add_nodes(self, graph_triples: List[str], relation_map: Dict[str, str]=None) -> List[str]:
+        '''Add the unseen nodes and the edges of graph_triples to an initialized graph.
+        The indices of the existing nodes and relations are kept, new nodes are appended.
+        Edges with an unknown relation are skipped. Returns the new nodes.
+        '''
+        if relation_map is None:
+            relation_map = dict()
+        new_nodes = []
+        n_edges = set()
         edge_list = []
         for triple in graph_triples:
             triple_list = triple[:-2].split(" ", maxsplit=2)
             if triple_list != ['']:
+                n_edges.add(triple)
                 s_, p_, o_ = triple_list[0].lower(), triple_list[1].lower(), triple_list[2].lower()
-                if self.node_to_enum.get(s_) is not None and  self.relations.get(p_) is not None and self.node_to_enum.get(o_) is not None:
+                for node in [s_, o_]:
+                    if node not in self.node_to_enum:
+                        self.node_to_enum[node] = len(self.nodes)
+                        self.nodes.append(node)
+                        new_nodes.append(node)
+                p_ = relation_map.get(p_, p_)
+                if self.relations.get(p_) is not None:
                     src, dst, rel = self.node_to_enum[s_], self.node_to_enum[o_], self.relations[p_]
                     edge_list.append([src, dst, 2 * rel])
                     edge_list.append([dst, src, 2 * rel + 1])
-       
-        edge = torch.tensor(edge_list, dtype=torch.long).t()
-        edge_index, edge_type = edge[:2], edge[2]
-        
-        self.training_data = Data(edge_index=edge_index)
-        self.training_data.edge_type = edge_type
+
+        self.num_nodes = len(self.nodes)
+        self.num_edges += len(n_edges)
+        if edge_list:
+            edge = torch.tensor(edge_list, dtype=torch.long, device=self.training_data.edge_index.device).t()
+            self.training_data.edge_index = torch.cat([self.training_data.edge_index, edge[:2]], dim=1)
+            self.training_data.edge_type = torch.cat([self.training_data.edge_type, edge[2]])
+            if getattr(self.training_data, 'edge_norm', None) is not None:
+                # the original graph (with edge-wise aggregation) is unweighted
+                weight = torch.ones(self.training_data.edge_type.size(0), device=edge.device)
+                self.training_data.edge_norm = edge_norm(self.training_data.edge_index, self.training_data.edge_type, weight)
+        return new_nodes
@@ -1,23 +1,48 @@
 from collections import defaultdict
-from copy import deepcopy
-from typing import List, Dict, Tuple
+from copy import copy, deepcopy
+from math import log2
+from typing import List, Dict, Set, Tuple, Optional
 from graphs.graph import Graph
+from graphs.ntParser import is_type_predicate, read_lines
+import numpy as np
+import torch
+from torch_geometric.data import Data
+from graphs.createAttributeSum import SUMMARIES, new_state, split_triple, count_triple, update_hashes, summary_node
 
 
 def parse_graph_nt(path: str) -> List[str]:
-    with open(path, 'r') as file:
-        triples = file.read().splitlines()
-    return triples
+    # .nt, .nt.gz, .nt.bz2 or .nt.zst
+    return list(read_lines(path))
 
-def get_classes(graph_triples: List[str]) -> List[str]:
-    rel = '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>'
-    class_count: dict = defaultdict(int)
-    for triple in graph_triples:
-        triple_list = triple[:-2].split(" ", maxsplit=2)
-        if triple_list != ['']:
-            s, p, o = triple_list[0].lower(), triple_list[1].lower(), triple_list[2].lower()
-            if str(p) == rel.lower() and str(s).split('#')[0] != 'http://swrc.ontoware.org/ontology':
-               class_count[str(o)] += 1
+def typed_triples(terms: List[str], triples: np.ndarray) -> np.ndarray:
+    '''the type triples (see is_type_predicate), without the types of the swrc ontology'''
+    type_ids = [i for i, term in enumerate(terms) if is_type_predicate(term)]
+    typed = triples[np.isin(triples[:, 1], type_ids)]
+    keep = [terms[s].split('#')[0] != 'http://swrc.ontoware.org/ontology' for s in typed[:, 0].tolist()]
+    return typed[np.array(keep, dtype=bool)] if len(typed) else typed
+
+def get_relation_buckets(terms: List[str], triples: np.ndarray, min_count: int=0, top_k: Optional[int]=None) -> Dict[str, str]:
+    '''Map every predicate of the graph (lowercased terms and integer triples) to the relation it is trained as.
+    Predicates that are among the top_k most frequent ones and occur at least min_count times keep their own relation. 
+    The remaining (rare) predicates are merged into shared buckets of predicates with a similar 
+    frequency (same power of two). With the defaults every predicate keeps its own relation.
+    '''
+    predicates, counts = np.unique(triples[:, 1], return_counts=True)
+    rel_count = {terms[p]: n for p, n in zip(predicates.tolist(), counts.tolist()) if not is_type_predicate(terms[p])}
+
+    ranked = sorted(rel_count.keys(), key=lambda rel: (-rel_count[rel], rel))
+    keep = set(ranked[:top_k]) if top_k is not None else set(ranked)
+    relation_map: Dict[str, str] = dict()
+    for rel in ranked:
+        if rel in keep and rel_count[rel] >= min_count:
+            relation_map[rel] = rel
+        else:
+            relation_map[rel] = f'<rare_relations_{int(log2(rel_count[rel]))}>'
+    return relation_map
+
+def get_classes(terms: List[str], triples: np.ndarray) -> List[str]:
+    objects, counts = np.unique(typed_triples(terms, triples)[:, 2], return_counts=True)
+    class_count = {terms[o]: n for o, n in zip(objects.tolist(), counts.tolist())}
 
     # print class occurence dict
     print(class_count)
@@ -27,30 +52,54 @@ def get_classes(graph_triples: List[str]) -> List[str]:
     c_d = dict((k, v) for k, v in class_count.items() if v >= threshold)
     return sorted(list(c_d.keys()))
 
-def nodes2type_mapping(graph_triples: List[str], classes: List[str]) -> Tuple[List, Dict[str, List]]:
-    rel = '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>'
+def nodes2type_mapping(terms: List[str], triples: np.ndarray, classes: List[str]) -> Dict[str, Set[str]]:
+    classes = set(classes)
     node2types_dict = defaultdict(set)
-    for triple in graph_triples:
-        triple_list = triple[:-2].split(" ", maxsplit=2)
-        if triple_list != ['']:
-            s, p, o = triple_list[0].lower(), triple_list[1].lower(), triple_list[2].lower()
-            if str(p) == rel.lower() and str(s).split('#')[0] != 'http://swrc.ontoware.org/ontology' and str(o) in classes:
-                node2types_dict[s].add(o)
+    for s, o in typed_triples(terms, triples)[:, [0, 2]].tolist():
+        if terms[o] in classes:
+            node2types_dict[terms[s]].add(terms[o])
     return node2types_dict 
 
-def get_node_mappings_dict(graph_triples: List[str]) -> Tuple[Dict[str, str], Dict[str, List]]:
+def get_node_mappings_dict(terms: List[str], triples: np.ndarray) -> Tuple[Dict[str, str], Dict[str, List]]:
     sumNode2orgNode_dict = defaultdict(list)
     orgNode2sumNode_dict = defaultdict()
-    for triple in graph_triples:
-        triple_list = triple[:-2].split(" ", maxsplit=2)
-        if triple_list != ['']:
-            s, _, o = triple_list[0].lower(), triple_list[1].lower(), triple_list[2].lower()
-            sumNode2orgNode_dict[s].append(o)
-            orgNode2sumNode_dict[o] = s
+    for s, o in triples[:, [0, 2]].tolist():
+        sumNode2orgNode_dict[terms[s]].append(terms[o])
+        orgNode2sumNode_dict[terms[o]] = terms[s]
     sumNode2orgNode_dict = dict(sorted(sumNode2orgNode_dict.items()))
     orgNode2sumNode_dict = dict(sorted(orgNode2sumNode_dict.items()))
     return orgNode2sumNode_dict, sumNode2orgNode_dict
 
+def map_new_nodes(sum_graphs: List[Graph], graph_triples: List[str], new_nodes: List[str]) -> List[Graph]:
+    '''Map new (unseen) nodes to the summary nodes of the attribute summary graphs, based on their properties in graph_triples.
+    Returns (shallow) copies of the summary graphs with the extended node mappings, the summary graphs themselves are not changed.
+    New nodes are not mapped in other (e.g. bisimulation) summary graphs.
+    '''
+    state = new_state()
+    for triple in graph_triples:
+        triple_list = split_triple(triple)
+        if triple_list is not None:
+            count_triple(state, *triple_list)
+    update_hashes(state, set(new_nodes))
+
+    mapped_graphs = []
+    for sum_graph in sum_graphs:
+        mapped_graph = copy(sum_graph)
+        mapped_graph.orgNode2sumNode_dict = dict(sum_graph.orgNode2sumNode_dict)
+        summary = [summary for summary in SUMMARIES if sum_graph.name.endswith(f'_sum_{summary}.nt')]
+        if summary:
+            hashes = state['hashes'][summary[0]]
+            # all literals share one summary node, which depends on the whole graph: reuse the summary node of the known literals
+            literal_sumNode = next((sumNode for orgNode, sumNode in sum_graph.orgNode2sumNode_dict.items() if orgNode.startswith('"')), None)
+            for node in new_nodes:
+                if node.startswith('"'):
+                    if literal_sumNode is not None:
+                        mapped_graph.orgNode2sumNode_dict[node] = literal_sumNode
+                else:
+                    mapped_graph.orgNode2sumNode_dict[node] = f'<{summary_node(node, hashes)}>'
+        mapped_graphs.append(mapped_graph)
+    return mapped_graphs
+
 def encode_org_node_labels(org2type_dict: defaultdict(list), labels_dict: dict, num_classes: int) -> Dict[str, List[float]]:
     org2type_enc = defaultdict()
     for node in org2type_dict.keys():
@@ -89,4 +138,33 @@ def get_idx_labels(graph: Graph, node2type: Dict[str, List[float]]) -> Tuple[Lis
         if sum(list(labs)) != 0.0 and graph.node_to_enum.get(node) is not None:
             train_indices.append(graph.node_to_enum[node])
             train_labels.append(list(labs))
-    return train_indices, train_labels
\ No newline at end of file
+    return train_indices, train_labels
+
+def disjoint_union(graphs: List[Graph], name: str) -> Tuple[Graph, List[int]]:
+    '''Pack graphs into one graph with a block-diagonal adjacency: node indices of each graph are shifted by an offset.
+    Edges, edge types (and edge norms) and training nodes/labels are concatenated. Returns the union graph and the node offset of every graph.
+    '''
+    union = Graph(name, dict())
+    offsets = []
+    edge_index, edge_type, edge_norm, x_train, y_train = [], [], [], [], []
+    offset = 0
+    for graph in graphs:
+        offsets.append(offset)
+        edge_index.append(graph.training_data.edge_index + offset)
+        edge_type.append(graph.training_data.edge_type)
+        edge_norm.append(getattr(graph.training_data, 'edge_norm', None))
+        x_train.append(graph.training_data.x_train + offset)
+        y_train.append(graph.training_data.y_train.to(torch.float32))
+        offset += graph.num_nodes
+
+    union.num_nodes = offset
+    union.num_edges = sum(graph.num_edges for graph in graphs)
+    union.relations = graphs[0].relations
+    union.training_data = Data(edge_index=torch.cat(edge_index, dim=1))
+    union.training_data.edge_type = torch.cat(edge_type)
+    # the blocks are disjoint, the normalization of every graph holds in the union
+    if all(norm is not None for norm in edge_norm):
+        union.training_data.edge_norm = torch.cat(edge_norm)
+    union.training_data.x_train = torch.cat(x_train)
+    union.training_data.y_train = torch.cat(y_train)
+    return union, offsets
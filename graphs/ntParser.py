@@ -0,0 +1,148 @@
+import bz2
+import gzip
+import io
+import os
+import numpy as np
+
+from multiprocessing import Pool
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""Reading of (large) N-Triples files.
+To encode triples to integer ids, uncompressed files are split into byte ranges that are aligned to line boundaries 
+and parsed by a process pool. .nt.gz, .nt.bz2 and .nt.zst files are streamed line by line (zst requires the zstandard package)
+by a single process, they are never decompressed into memory as a whole.
+Summary files contain every distinct summary triple once, followed by its multiplicity (the number of original triples
+it summarizes) as a comment: `<s> <p> <o> . # 12`. Triples without a count have multiplicity 1.
+"""
+
+COMPRESSED = ('.gz', '.bz2', '.zst')
+MIN_PARALLEL_BYTES = 64 * 1024 * 1024
+# workers if none are given, set from the thread profile (see helpers/threadTuner.py), None uses all cores
+DEFAULT_WORKERS: Optional[int] = None
+RDF_TYPE = '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>'
+# the short type predicate of the datasets is a type edge as well
+TYPE_PREDICATES = [RDF_TYPE, '<type>']
+
+def is_type_predicate(term: str) -> bool:
+    '''rdf:type in any case and with http or https, or <type>: the type edges are the labels, not relations of the graph'''
+    return term.lower().replace('<https://', '<http://', 1) in TYPE_PREDICATES
+
+def find_nt(path: str) -> str:
+    '''return path, or a compressed variant of path (path.gz, path.bz2, path.zst) if only that exists'''
+    if os.path.isfile(path):
+        return path
+    for suffix in COMPRESSED:
+        if os.path.isfile(f'{path}{suffix}'):
+            return f'{path}{suffix}'
+    return path
+
+def open_nt(path: str) -> TextIO:
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf8')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rt', encoding='utf8')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError(f'reading {path} requires the zstandard package: pip install zstandard')
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True), encoding='utf8')
+    return open(path, 'r', encoding='utf8')
+
+def split_count(line: str) -> Tuple[str, int]:
+    '''split a line in the triple and its multiplicity (see write_count)'''
+    if line[-1:].isdigit():
+        triple, sep, count = line.rpartition(' # ')
+        if sep and count.isdigit():
+            return triple, int(count)
+    return line, 1
+
+def write_count(triple: str, count: int) -> str:
+    '''a line of a (deduplicated) summary file, the multiplicity is omitted if it is 1'''
+    return f'{triple} # {count}\n' if count > 1 else f'{triple}\n'
+
+def byte_ranges(path: str, n: int) -> List[Tuple[int, int]]:
+    '''split a file in n byte ranges, every range starts at the beginning of a line'''
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, n):
+            f.seek(max(i * size // n, starts[-1]))
+            f.readline()
+            starts.append(min(f.tell(), size))
+    ends = starts[1:] + [size]
+    return [(start, end) for start, end in zip(starts, ends) if end > start]
+
+def get_workers(path: str, workers: Optional[int]) -> int:
+    if path.endswith(COMPRESSED) or os.path.getsize(path) < MIN_PARALLEL_BYTES:
+        return 1
+    if workers is not None:
+        return workers
+    return DEFAULT_WORKERS if DEFAULT_WORKERS is not None else os.cpu_count()
+
+def read_range(args: Tuple[str, int, int]) -> List[str]:
+    path, start, end = args
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start).decode('utf8').splitlines()
+
+def read_lines(path: str) -> Iterator[str]:
+    '''The lines of an (optionally compressed) N-Triples file, streamed by a single process.'''
+    with open_nt(path) as file:
+        for line in file:
+            yield line.rstrip('\r\n')
+
+def encode_counted(lines: Iterable[str], lower: bool=True) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    '''encode triples to integer ids. Returns the terms (id -> term), an array (num_triples, 3) of subject, predicate, object ids
+    and the multiplicity of every triple (see split_count)'''
+    term_to_id: Dict[str, int] = dict()
+    ids: List[int] = []
+    counts: List[int] = []
+    for line in lines:
+        triple, count = split_count(line)
+        triple_list = triple[:-2].split(" ", maxsplit=2)
+        if triple_list != ['']:
+            s, p, o = triple_list
+            for term in [s, p, o]:
+                term = term.lower() if lower else term
+                ids.append(term_to_id.setdefault(term, len(term_to_id)))
+            counts.append(count)
+    return list(term_to_id.keys()), np.array(ids, dtype=np.int64).reshape(-1, 3), np.array(counts, dtype=np.int64)
+
+def encode_lines(lines: Iterable[str], lower: bool=True) -> Tuple[List[str], np.ndarray]:
+    '''encode triples to integer ids. Returns the terms (id -> term) and an array (num_triples, 3) of subject, predicate, object ids'''
+    terms, triples, _ = encode_counted(lines, lower)
+    return terms, triples
+
+def encode_range(args: Tuple[str, int, int, bool]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    path, start, end, lower = args
+    return encode_counted(read_range((path, start, end)), lower)
+
+def encode_nt(path: str, workers: Optional[int]=None, lower: bool=True) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    '''Parse an (optionally compressed) N-Triples file into one term dictionary, integer triples and their multiplicities.
+    Every worker encodes its byte range with a local dictionary, the local dictionaries are merged afterwards.
+    Term ids are in the order of the first occurrence of the terms in the file.
+    Returns the terms (id -> term), an array (num_triples, 3) of subject, predicate, object ids and an array (num_triples,) of multiplicities.
+    '''
+    workers = get_workers(path, workers)
+    if workers == 1:
+        return encode_counted(read_lines(path), lower)
+
+    with Pool(workers) as pool:
+        chunks = pool.map(encode_range, [(path, start, end, lower) for start, end in byte_ranges(path, workers)])
+
+    term_to_id: Dict[str, int] = dict()
+    triples = []
+    for local_terms, local_triples, _ in chunks:
+        remap = np.array([term_to_id.setdefault(term, len(term_to_id)) for term in local_terms], dtype=np.int64)
+        triples.append(remap[local_triples] if len(local_terms) else local_triples)
+    return list(term_to_id.keys()), np.concatenate(triples), np.concatenate([counts for _, _, counts in chunks])
+
+def encode_graph_nt(path: str, workers: Optional[int]=None, lower: bool=True) -> Tuple[List[str], np.ndarray]:
+    '''Parse an (optionally compressed) N-Triples file, see encode_nt. Returns the terms (id -> term) and an array (num_triples, 3)
+    of subject, predicate, object ids.'''
+    terms, triples, _ = encode_nt(path, workers, lower)
+    return terms, triples
@@ -0,0 +1,112 @@
+import argparse
+import mmh3
+import os
+import numpy as np
+
+from typing import Callable, Dict, List, Tuple
+
+from graphs.ntParser import encode_graph_nt, find_nt, is_type_predicate, write_count
+from helpers.args import strtobool
+from helpers.threadTuner import set_parse_workers, stage_settings
+
+"""Registry of (cheap) graph summarizers that work on integer triples, see graphs/ntParser.py.
+A summarizer maps every term of the graph to a summary node:
+    summarizer(terms, triples, n, seed) -> np.ndarray of shape (num_terms,)
+Only the entries of nodes (subjects and objects) are used. Summary and map files are written in the standard layout
+({dataset}/{out}/sum/ and {dataset}/{out}/map/), so they can be used with Dataset directly. Every distinct summary triple
+is written once with its multiplicity (see graphs/ntParser.py):
+    python -m graphs.summarizers -dataset AIFB -summarizer random hash degree -n 100 -out dummy
+"""
+
+# name -> (summarizer, whether n (number of summary nodes) is part of the file name)
+SUMMARIZERS: Dict[str, Tuple[Callable, bool]] = dict()
+# summarizers that use the types, the prediction targets in main.py (also of the validation and test entities)
+LABEL_SUMMARIZERS = ['type']
+
+def register(name: str, sized: bool=True) -> Callable:
+    def decorator(summarizer: Callable) -> Callable:
+        SUMMARIZERS[name] = (summarizer, sized)
+        return summarizer
+    return decorator
+
+@register('random')
+def random_summary(terms: List[str], triples: np.ndarray, n: int, seed: int) -> np.ndarray:
+    '''every node is mapped to one of n+1 random summary nodes'''
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, n + 1, size=len(terms))
+
+@register('hash')
+def hash_summary(terms: List[str], triples: np.ndarray, n: int, seed: int) -> np.ndarray:
+    '''every node is mapped to one of n summary nodes by hashing its term, stable across graphs'''
+    hashes = np.fromiter((mmh3.hash(term, seed, signed=False) for term in terms), dtype=np.int64, count=len(terms))
+    return hashes % n
+
+@register('degree')
+def degree_summary(terms: List[str], triples: np.ndarray, n: int, seed: int) -> np.ndarray:
+    '''nodes with the same (log2) outgoing and incoming degree bucket share a summary node, buckets are capped at n-1'''
+    out_degree = np.bincount(triples[:, 0], minlength=len(terms))
+    in_degree = np.bincount(triples[:, 2], minlength=len(terms))
+    out_bucket = np.minimum(np.floor(np.log2(1 + out_degree)).astype(np.int64), n - 1)
+    in_bucket = np.minimum(np.floor(np.log2(1 + in_degree)).astype(np.int64), n - 1)
+    return out_bucket * n + in_bucket
+
+@register('type', sized=False)
+def type_summary(terms: List[str], triples: np.ndarray, n: int, seed: int) -> np.ndarray:
+    '''Nodes with the same set of rdf:type classes share a summary node, untyped nodes share one summary node.
+    The types of all variants of the type predicate (see is_type_predicate) are used.
+    Note: in main.py the types are the prediction targets, so this summary contains label information of the test nodes
+    (see LABEL_SUMMARIZERS).
+    '''
+    type_ids = [i for i, term in enumerate(terms) if is_type_predicate(term)]
+    signature = np.zeros(len(terms), dtype=np.uint64)
+    if type_ids:
+        # the types of all variants of rdf:type
+        typed = np.unique(triples[np.isin(triples[:, 1], type_ids)][:, [0, 2]], axis=0)
+        # a random 64 bit key per class, the (wrapping) sum of the keys identifies the set of classes
+        class_keys = np.random.default_rng(seed).integers(1, np.iinfo(np.int64).max, size=len(terms)).astype(np.uint64)
+        np.add.at(signature, typed[:, 0], class_keys[typed[:, 1]])
+    _, sum_nodes = np.unique(signature, return_inverse=True)
+    return sum_nodes
+
+def write_sum_map_files(terms: List[str], triples: np.ndarray, sum_nodes: np.ndarray, sum_path: str, map_path: str) -> None:
+    for file_path in [sum_path, map_path]:
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    # every distinct summary triple is written once with its multiplicity
+    sum_triples, counts = np.unique(np.stack([sum_nodes[triples[:, 0]], triples[:, 1], sum_nodes[triples[:, 2]]], axis=1), axis=0, return_counts=True)
+    with open(sum_path, 'w') as f:
+        f.writelines(write_count(f'<{s}> {terms[p]} <{o}> .', n) for (s, p, o), n in zip(sum_triples.tolist(), counts.tolist()))
+
+    nodes = np.unique(triples[:, [0, 2]])
+    with open(map_path, 'w') as m:
+        m.writelines(f'<{sumNode}> <isSummaryOf> {terms[node]} .\n' for node, sumNode in zip(nodes.tolist(), sum_nodes[nodes].tolist()))
+
+def create_summaries(path: str, sum_path: str, map_path: str, dataset: str, names: List[str], n: int, seed: int=0, allow_labels: bool=False) -> None:
+    leaking = [name for name in names if name in LABEL_SUMMARIZERS]
+    if leaking and not allow_labels:
+        raise ValueError(f'the {", ".join(leaking)} summary contains the labels of the validation and test entities, pass -allow_labels True to create it anyway')
+    terms, triples = encode_graph_nt(path, lower=False)
+    for name in names:
+        summarizer, sized = SUMMARIZERS[name]
+        sum_nodes = summarizer(terms, triples, n, seed)
+        file_name = f'{name}{n}' if sized else name
+        write_sum_map_files(terms, triples, sum_nodes, f'{sum_path}{dataset}_sum_{file_name}.nt', f'{map_path}{dataset}_map_{file_name}.nt')
+        print(f'{name} summary: {len(np.unique(sum_nodes[np.unique(triples[:, [0, 2]])]))} summary nodes')
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='summarizer arguments')
+    parser.add_argument('-dataset', type=str, choices=['AIFB', 'AM', 'BGS', 'MUTAG', 'TEST'], help='inidcate dataset name')
+    parser.add_argument('-summarizer', type=str, nargs='+', choices=list(SUMMARIZERS.keys()), default=['random'], help='summarizer(s) to run')
+    parser.add_argument('-n', type=int, default=100, help='number of summary nodes (random, hash) or degree buckets (degree)')
+    parser.add_argument('-seed', type=int, default=0)
+    parser.add_argument('-out', type=str, default='dummy', help='summaries are saved to ./graphs/{dataset}/{out}/sum and /map')
+    parser.add_argument('-allow_labels', type=lambda a:bool(strtobool(a)), default=False, help='allow summaries that use the labels of the evaluation entities (type) True/False')
+    args = vars(parser.parse_args())
+    dataset = args['dataset']
+
+    set_parse_workers(stage_settings(dataset).get('parse'))
+    path = find_nt(f'./graphs/{dataset}/{dataset}_complete.nt')
+    sum_path = f'./graphs/{dataset}/{args["out"]}/sum/'
+    map_path = f'./graphs/{dataset}/{args["out"]}/map/'
+
+    create_summaries(path, sum_path, map_path, dataset, args['summarizer'], args['n'], args['seed'], args['allow_labels'])
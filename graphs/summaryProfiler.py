@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+from typing import Dict, List, Optional, Set
+
+from graphs.ntParser import encode_graph_nt, is_type_predicate
+
+"""Profiling of candidate summary graphs before they are loaded and pre-trained.
+For every summary (sum and map file) the profile contains
+    node_ratio: summary nodes / original nodes (1.0 means no compression)
+    edge_ratio: distinct summary triples / original triples (the cost of pre-training relative to training on the original graph)
+    coverage: fraction of the relations of the original graph that occur in the summary
+    purity: fraction of the labelled training entities whose summary node has their (majority) class,
+            entities that are not in the map file have no summary node and are counted as impure
+    lift: purity improvement over predicting the majority class, (purity - prior) / (1 - prior)
+    score: lift * coverage * (1 - node_ratio)
+Profiles are cached in {sum}/sum_profile.json and recomputed when a file, the training labels or the relation mapping change.
+"""
+
+# part of the cache key, cached profiles of an older version are recomputed
+PROFILE_VERSION = 4
+
+def file_key(path: str) -> str:
+    stat = os.stat(path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+def labels_key(org2type: Dict[str, Set[str]], relation_map: Dict[str, str]) -> str:
+    sha = hashlib.sha1()
+    for node in sorted(org2type):
+        if org2type[node]:
+            sha.update(f'{node} {",".join(sorted(org2type[node]))}\n'.encode('utf8'))
+    sha.update(json.dumps(relation_map, sort_keys=True).encode('utf8'))
+    return sha.hexdigest()
+
+def profile_summary(sum_path: str, map_path: str, org2type: Dict[str, Set[str]], relations: Set[str],
+                    relation_map: Dict[str, str], num_org_nodes: int, num_org_triples: int) -> Dict[str, float]:
+    '''profile of one summary graph, org2type contains the training labels only (evaluation entities have no types)'''
+    sum_terms, sum_triples = encode_graph_nt(sum_path)
+    predicates = {relation_map.get(sum_terms[p], sum_terms[p]) for p in np.unique(sum_triples[:, 1]).tolist()}
+    predicates = {rel for rel in predicates if not is_type_predicate(rel)}
+
+    map_terms, map_triples = encode_graph_nt(map_path)
+    term_to_id = {term: i for i, term in enumerate(map_terms)}
+    # summary node of every org node (term id)
+    sum_node = np.full(len(map_terms), -1, dtype=np.int64)
+    sum_node[map_triples[:, 2]] = map_triples[:, 0]
+
+    classes = sorted({c for types in org2type.values() for c in types})
+    class_to_id = {c: i for i, c in enumerate(classes)}
+    labelled = [(term_to_id.get(node, -1), types) for node, types in org2type.items() if types]
+    pairs = np.array([(node, class_to_id[c]) for node, types in labelled for c in types], dtype=np.int64).reshape(-1, 2)
+    num_labelled = len(labelled)
+
+    purity, prior = 0.0, 0.0
+    if num_labelled > 0:
+        prior = np.bincount(pairs[:, 1], minlength=len(classes)).max() / num_labelled
+        # labelled nodes without a summary node (missing from the map) are impure, they do not count for any summary node
+        mapped = pairs[pairs[:, 0] >= 0]
+        mapped = mapped[sum_node[mapped[:, 0]] >= 0]
+        # count (summary node, class) pairs and take the majority class count per summary node
+        sum_class, counts = np.unique(np.stack([sum_node[mapped[:, 0]], mapped[:, 1]], axis=1), axis=0, return_counts=True)
+        majority = np.zeros(len(map_terms), dtype=np.int64)
+        np.maximum.at(majority, sum_class[:, 0], counts)
+        purity = majority.sum() / num_labelled
+    lift = max(0.0, (purity - prior) / (1 - prior)) if prior < 1 else 0.0
+
+    node_ratio = len(np.unique(map_triples[:, 0])) / max(num_org_nodes, 1)
+    coverage = len(predicates & relations) / max(len(relations), 1)
+    return {'node_ratio': float(node_ratio),
+            'edge_ratio': float(len(np.unique(sum_triples, axis=0)) / max(num_org_triples, 1)),
+            'coverage': float(coverage),
+            'purity': float(purity),
+            'lift': float(lift),
+            'score': float(lift * coverage * max(0.0, 1 - node_ratio))}
+
+def profile_summaries(sum_dir: str, map_dir: str, sum_files: List[str], map_files: List[str], org2type: Dict[str, Set[str]],
+                      relations: Set[str], relation_map: Dict[str, str], num_org_nodes: int, num_org_triples: int) -> Dict[str, Dict[str, float]]:
+    cache_path = os.path.join(os.path.dirname(os.path.normpath(sum_dir)), 'sum_profile.json')
+    cache = dict()
+    if os.path.isfile(cache_path):
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+
+    labels = labels_key(org2type, relation_map)
+    profiles = dict()
+    for sum_file, map_file in zip(sum_files, map_files):
+        sum_path, map_path = os.path.join(sum_dir, sum_file), os.path.join(map_dir, map_file)
+        key = f'v{PROFILE_VERSION}/{file_key(sum_path)}/{file_key(map_path)}/{num_org_nodes}-{num_org_triples}/{labels}'
+        if sum_file not in cache or cache[sum_file]['key'] != key:
+            profile = profile_summary(sum_path, map_path, org2type, relations, relation_map, num_org_nodes, num_org_triples)
+            cache[sum_file] = {'key': key, 'profile': profile}
+        profiles[sum_file] = cache[sum_file]['profile']
+
+    with open(cache_path, 'w') as f:
+        json.dump(cache, f, indent=1)
+    return profiles
+
+def select_summaries(profiles: Dict[str, Dict[str, float]], top_k: Optional[int]=None, min_score: Optional[float]=None,
+                     max_ratio: Optional[float]=None, budget: Optional[float]=None) -> List[str]:
+    '''Select summaries by score. Summaries below min_score or above max_ratio (node ratio) are skipped, at most top_k
+    summaries are selected and their summed edge_ratio stays within budget. At least the best summary is selected.
+    '''
+    ranked = sorted(profiles, key=lambda f: profiles[f]['score'], reverse=True)
+    selected = []
+    cost = 0.0
+    for sum_file in ranked:
+        profile = profiles[sum_file]
+        if min_score is not None and profile['score'] < min_score:
+            continue
+        if max_ratio is not None and profile['node_ratio'] > max_ratio:
+            continue
+        if budget is not None and cost + profile['edge_ratio'] > budget:
+            continue
+        if top_k is not None and len(selected) >= top_k:
+            break
+        selected.append(sum_file)
+        cost += profile['edge_ratio']
+    if not selected and ranked:
+        print(f'no summary graph satisfies the selection policy, using the best one: {ranked[0]}')
+        selected = ranked[:1]
+    return sorted(selected)
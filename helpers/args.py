@@ -0,0 +1,10 @@
+"""Helpers for the argument parsers of the scripts, without heavy imports (the parser (-h) is built before torch is imported)."""
+
+def strtobool(value: str) -> bool:
+    '''distutils.util.strtobool, importing distutils takes longer than parsing the arguments'''
+    value = value.lower()
+    if value in ['y', 'yes', 't', 'true', 'on', '1']:
+        return True
+    if value in ['n', 'no', 'f', 'false', 'off', '0']:
+        return False
+    raise ValueError(f'invalid truth value {value}')
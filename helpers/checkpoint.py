@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import torch
+
+from torch import nn
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+"""Checkpoints of multi-iteration experiment runs.
+A run consists of units: the summary graph pre-training of an iteration (one unit per summary graph) and the training
+of every experiment on the original graph (one unit per iteration and experiment).
+    - a completed unit is stored together with the (partial) Results, so a resumed run skips it
+    - the pre-trained summary model and embeddings of an iteration are stored, so the experiments of the iteration can resume without pre-training again
+    - every `every` epochs, the model state (including frozen parameters and buffers), optimizer states and metrics of the running unit are stored, so it continues mid-training
+The checkpoint directory is removed when the run is finished.
+"""
+
+# configs that may differ between a run and its resumed run
+RUN_CONFIGS = ['resume', 'checkpoint', 'ckpt_every', 'plot', 'profile', 'profile_epochs', 'profile_top', 'memory plan', 'tuned_threads', 'threads']
+
+class Checkpoint:
+    def __init__(self, path: str, configs: Dict[str, Union[bool, str, int, float]], every: int=10, resume: bool=False) -> None:
+        self.path: str = path
+        self.every: int = every
+        run_configs = json.dumps({k: v for k, v in configs.items() if k not in RUN_CONFIGS}, sort_keys=True, default=str)
+
+        config_path = os.path.join(path, 'configs.json')
+        if resume and os.path.isfile(config_path):
+            with open(config_path, 'r') as f:
+                assert f.read() == run_configs, f'the checkpoint in {path} belongs to a run with other configs, start without -resume or remove it'
+            print(f'resuming run from {path}')
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+            with open(config_path, 'w') as f:
+                f.write(run_configs)
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, f'{name}.pt')
+
+    def save(self, name: str, obj: object) -> None:
+        # write to a temporary file first, an interrupted save never corrupts the previous checkpoint
+        torch.save(obj, f'{self.file(name)}.tmp')
+        os.replace(f'{self.file(name)}.tmp', self.file(name))
+
+    def load(self, name: str) -> Optional[object]:
+        if not os.path.isfile(self.file(name)):
+            return None
+        return torch.load(self.file(name), map_location='cpu')
+
+    def remove(self, name: str) -> None:
+        if os.path.isfile(self.file(name)):
+            os.remove(self.file(name))
+
+    def load_progress(self) -> Tuple[Optional[object], Set[str]]:
+        '''the (partial) Results and the completed units'''
+        progress = self.load('progress')
+        if progress is None:
+            return None, set()
+        return progress['results'], set(progress['completed'])
+
+    def complete(self, unit: str, results: object, completed: Set[str]) -> None:
+        completed.add(unit)
+        self.save('progress', {'results': results, 'completed': sorted(completed)})
+        self.remove(f'{unit}_train')
+
+    def save_training(self, unit: str, epoch: int, model: nn.Module, optimizers: List[torch.optim.Optimizer], metrics: Tuple[List[float]]) -> None:
+        '''The whole state dict is stored: frozen parameters and buffers (e.g. a transferred embedding) are not rebuilt
+        on resume, the embedding trick initializes unmapped nodes randomly and would give a different model.'''
+        state = {name: t.detach().cpu() for name, t in model.state_dict().items()}
+        self.save(f'{unit}_train', {'epoch': epoch, 'model': state, 'optimizers': [o.state_dict() for o in optimizers],
+                                    'metrics': metrics, 'rng': torch.get_rng_state()})
+
+    def load_training(self, unit: str, model: nn.Module, optimizers: List[torch.optim.Optimizer]) -> Tuple[int, Optional[Tuple[List[float]]]]:
+        '''restore a running unit, returns the epoch to continue with and the metrics so far'''
+        state = self.load(f'{unit}_train')
+        if state is None:
+            return 0, None
+        model.load_state_dict(state['model'], strict=False)
+        for optimizer, optimizer_state in zip(optimizers, state['optimizers']):
+            optimizer.load_state_dict(optimizer_state)
+        torch.set_rng_state(state['rng'])
+        print(f'resuming {unit} at epoch {state["epoch"] + 1}')
+        return state['epoch'] + 1, state['metrics']
+
+    def finish(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
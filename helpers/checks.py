@@ -1,4 +1,4 @@
-from typing import Dict, Union, Tuple, List
+from typing import Dict, Union, Tuple, List, Optional
 from os import listdir
 from os.path import isfile, join
 
@@ -24,8 +24,15 @@ def check_e_trans(configs: Dict[str, Union[int, str, float, bool]], num_sum_file
         configs['num_sums'] = num_sum_files
     return configs
 
-def do_checks(configs: Dict[str, Union[int, str]], sum_path: str, map_path: str) -> Tuple[Dict[str, Union[int, str]], List[str]]:
-    sum_files = check_sum_map_files(sum_path, map_path)
+def check_e_sparse(configs: Dict[str, Union[int, str, float, bool]]) -> None:
+    if configs['e_sparse']:
+        print('warning: -e_sparse True saves no memory, training is full-graph and every embedding row gets a gradient in every epoch')
+
+def do_checks(configs: Dict[str, Union[int, str]], sum_path: str, map_path: str, sum_files: Optional[List[str]]=None) -> Tuple[Dict[str, Union[int, str]], List[str]]:
+    # sum_files: the summary graphs that are used (e.g. after summary selection), by default all summary graphs
+    all_sum_files = check_sum_map_files(sum_path, map_path)
+    sum_files = all_sum_files if sum_files is None else sum_files
     updated_configs = check_emb_dim(configs, len(sum_files))
     updated_configs = check_e_trans(updated_configs, len(sum_files))
+    check_e_sparse(updated_configs)
     return updated_configs, sum_files
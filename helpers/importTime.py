@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from datetime import datetime
+from typing import Dict, List, Union
+
+"""Run this file from the root directory: python -m helpers.importTime
+Benchmark the import time of the entry points (scripts and modules that are run with python -m). Every entry point is imported
+in a fresh interpreter with -X importtime, the best of -repeat runs is reported, together with the heavy dependencies
+it imports and the modules with the highest cumulative import time. The results are appended to a JSONL log, to track the import
+time over changes. With -budget the exit status is 1 if an entry point takes longer (seconds, interpreter startup excluded).
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = ['main', 'sweep', 'graphs.createAttributeSum', 'graphs.createBisimMapping', 'graphs.createDummySum', 'graphs.summarizers',
+                'helpers.results', 'helpers.vizEmb', 'helpers.importTime', 'model.inference', 'model.export']
+
+# dependencies that should only be imported on the paths that use them
+HEAVY = ['torch', 'torch_geometric', 'sklearn', 'scipy', 'matplotlib']
+
+def import_time(module: str) -> Dict[str, Union[float, List[str], Dict[str, float]]]:
+    '''import a module in a fresh interpreter, returns the seconds of the import, the heavy dependencies and the cumulative seconds of the imported modules'''
+    command = f'import {module}' if module else 'pass'
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', command], cwd=ROOT, capture_output=True, text=True)
+    assert process.returncode == 0, f'{command} failed:\n{process.stderr[-2000:]}'
+    modules = dict()
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative) / 1e6
+    return {'seconds': modules.get(module, 0.0), 'heavy': [name for name in HEAVY if name in modules], 'modules': modules}
+
+def benchmark(entry_points: List[str], repeat: int=3, top: int=5) -> Dict[str, Dict[str, Union[float, List[str], Dict[str, float]]]]:
+    results = dict()
+    # modules that are imported by the interpreter startup
+    startup = set(import_time('')['modules'].keys())
+    for module in entry_points:
+        runs = [import_time(module) for _ in range(repeat)]
+        best = min(runs, key=lambda run: run['seconds'])
+        # top level modules (no dotted names) that are imported by the entry point
+        external = {name: seconds for name, seconds in best['modules'].items() if '.' not in name and name != module and name not in startup}
+        results[module] = {'seconds': round(best['seconds'], 3), 'heavy': best['heavy'],
+                           'top': {name: round(seconds, 3) for name, seconds in sorted(external.items(), key=lambda item: item[1], reverse=True)[:top]}}
+    return results
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='import time benchmark arguments')
+    parser.add_argument('-modules', type=str, nargs='+', default=ENTRY_POINTS, help='entry points to benchmark')
+    parser.add_argument('-repeat', type=int, default=3, help='imports per entry point, the fastest is reported')
+    parser.add_argument('-top', type=int, default=5, help='number of slowest imported modules per entry point')
+    parser.add_argument('-budget', type=float, default=None, help='max import seconds per entry point')
+    parser.add_argument('-log', type=str, default='./results/import_times.jsonl', help='JSONL log the results are appended to')
+    args = vars(parser.parse_args())
+
+    results = benchmark(args['modules'], args['repeat'], args['top'])
+    for module, result in results.items():
+        print(f'{module:<28} {result["seconds"]:>7.3f} s  heavy: {", ".join(result["heavy"]) or "-"}  slowest: {result["top"]}')
+
+    os.makedirs(os.path.dirname(os.path.abspath(args['log'])), exist_ok=True)
+    with open(args['log'], 'a') as f:
+        f.write(json.dumps({'date': datetime.now().isoformat(timespec='seconds'), 'python': sys.version.split()[0], 'results': results}) + '\n')
+
+    if args['budget'] is not None:
+        over = [module for module, result in results.items() if result['seconds'] > args['budget']]
+        if over:
+            print(f'over the import budget of {args["budget"]} s: {", ".join(over)}')
+            sys.exit(1)
@@ -0,0 +1,194 @@
+import ctypes
+import resource
+import torch
+
+from typing import Dict, List, Optional, Tuple, Union
+
+from graphs.dataset import Dataset
+from graphs.graph import Graph
+
+"""Estimate the peak memory of the training stages from the graph statistics and pick a training strategy that fits a budget.
+The estimate of a stage is the resident memory when planning (interpreter, torch and the loaded dataset), the copy of the
+dataset of an iteration and the memory of the stage itself: parameters (with gradients and Adam states), the activations
+that are stored for the backward pass and the largest temporary tensor of the forward and backward pass.
+The summary stage is estimated for every summary graph (or the disjoint union with -sum_batch) and the original stage for every experiment.
+The stacked embedding of the attention experiment and the concatenated embedding of the mlp experiment are num_sums times
+bigger than the embedding of the summation experiment.
+
+Without a budget the configured strategy is estimated only. With a budget the strategies are tried from the cheapest (in runtime)
+to the most memory saving one, every strategy keeps the options of the previous ones:
+    full                    the configured run
+    sequential summaries    pre-train the summary graphs one after another instead of as one disjoint-union graph
+    lean aggregation        aggregate the original graph edge-wise (like the weighted summary graphs), instead of storing
+                            the aggregated features of every node for every relation
+    gradient checkpointing  recompute the activations of every layer during the backward pass
+    bfloat16                run the forward pass in bfloat16 autocast, the stored inputs of the matrix products are half the size
+                            (except for the attention of the attention experiment, that stays in float32)
+The measured peaks of the stages are added to the plan (see measure), to validate the estimate.
+
+The estimate counts tensors. glibc raises its mmap threshold when a large (mmapped) block is freed, after that the
+tensors of the relation loops are served from the heap and freed heap memory stays resident: on graphs with many
+relations the peak is then several times the estimate (AIFB: 2.7 GB instead of 0.8 GB). With a budget, the threshold
+is pinned (see pin_mmap_threshold), the freed tensors are returned to the OS and the peak follows the estimate, but
+every large tensor is mapped anew (AIFB: about 1.8 times the epoch time).
+"""
+
+MB = 2**20
+# mallopt parameter, see malloc.h
+M_MMAP_THRESHOLD = -3
+FLOAT = 4
+INDEX = 8
+# freed memory that is kept by the allocator and temporaries that are not modelled
+HEADROOM = 1.15
+
+# the options of a strategy are added to the options of the previous strategies
+STRATEGIES = [('full', dict()),
+              ('sequential summaries', {'sum_batch': False}),
+              ('lean aggregation', {'lean_agg': True}),
+              ('gradient checkpointing', {'grad_ckpt': True}),
+              ('bfloat16', {'bf16': True})]
+
+Options = Dict[str, bool]
+Configs = Dict[str, Union[bool, str, int, float]]
+
+def pin_mmap_threshold(threshold: int=128*1024) -> bool:
+    '''serve allocations above threshold with mmap, also after large blocks were freed (glibc only), return if it was set'''
+    try:
+        return ctypes.CDLL('libc.so.6').mallopt(M_MMAP_THRESHOLD, threshold) == 1
+    except (OSError, AttributeError):
+        return False
+
+def current_rss() -> int:
+    '''resident memory of the process in bytes'''
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+def reset_peak() -> None:
+    '''reset the peak resident memory of the process to the current resident memory (Linux only)'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_rss() -> int:
+    '''peak resident memory of the process in bytes (since the last reset_peak)'''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def graph_stats(graph: Graph) -> Dict[str, int]:
+    edge_type = graph.training_data.edge_type
+    return {'nodes': graph.num_nodes, 'edges': edge_type.size(0), 'relations': 2*len(graph.relations.keys())+1,
+            'largest relation': int(torch.bincount(edge_type).max()) if edge_type.numel() > 0 else 0}
+
+def union_stats(stats: List[Dict[str, int]]) -> Dict[str, int]:
+    return {'nodes': sum(s['nodes'] for s in stats), 'edges': sum(s['edges'] for s in stats), 'relations': stats[0]['relations'],
+            'largest relation': sum(s['largest relation'] for s in stats)}
+
+def conv_bytes(stats: Dict[str, int], d_in: int, d_out: int, weighted: bool, bf16: bool) -> Tuple[int, int, int]:
+    '''parameters (with gradient and Adam states), stored activations and the largest temporary tensor of a WeightedRGCNConv layer'''
+    n, e, r, e_max = stats['nodes'], stats['edges'], stats['relations'], stats['largest relation']
+    params = 4 * ((r + 1) * d_in * d_out + d_out) * FLOAT
+    act = 2 if bf16 else FLOAT
+    if weighted:
+        # the indices and edge weights of every relation and the (autocast) input of the transformations are stored
+        stored = e * (2 * INDEX + FLOAT) + (n * d_in * act if bf16 else 0) + n * d_out * FLOAT
+        temporary = 2 * e_max * d_out * FLOAT + 2 * n * d_out * FLOAT + e
+    else:
+        # the mean aggregated features of every node are stored for every relation (see torch_geometric RGCNConv)
+        stored = r * n * d_in * act + e * INDEX + n * d_out * FLOAT
+        temporary = e_max * d_in * FLOAT + 2 * n * d_in * FLOAT + n * d_out * FLOAT
+    return params, stored, temporary
+
+def unit_bytes(stats: Dict[str, int], configs: Configs, num_classes: int, exp: str, trainable: bool, weighted: bool, options: Options) -> int:
+    '''peak memory of training one model on one graph'''
+    n, d, h, s = stats['nodes'], configs['emb'], configs['hl'], configs['num_sums']
+    act = 2 if options['bf16'] else FLOAT
+    # the embedding (with gradient and Adam states if it is trained) and the layers before the R-GCN layers
+    embedding = n * d * (s if exp in ['mlp', 'attention'] else 1)
+    params = embedding * FLOAT * (4 if trainable else 1)
+    if not trainable and configs['e_quant'] != 'none':
+        # the quantized embedding is dequantized in every forward pass
+        params = embedding * (1 if configs['e_quant'] == 'int8' else 2) + embedding * FLOAT
+    front_stored, front_out = 0, 0
+    if exp == 'mlp':
+        out_f = round(s * d * 2/3 + num_classes)
+        params += 4 * (s * d * out_f + out_f * d) * FLOAT
+        front_stored = 2 * n * out_f * FLOAT + n * out_f * act + (embedding * act if options['bf16'] else 0) + n * d * FLOAT
+        front_out = n * d * FLOAT
+    elif exp == 'attention':
+        params += 4 * 4 * d * d * FLOAT
+        # projections, attention weights (with dropout) of the heads and the attention output, in float32 also with bf16 (see Emb_ATT_Layers.attend)
+        front_stored = 6 * s * n * d * FLOAT + 3 * n * s**3 * FLOAT
+        front_out = n * d * FLOAT
+    layers = [conv_bytes(stats, d, h, weighted, options['bf16']), conv_bytes(stats, h, num_classes, weighted, options['bf16'])]
+    params += sum(layer[0] for layer in layers)
+    outputs = n * h * FLOAT + n * num_classes * FLOAT
+    stored = [front_stored] + [layer[1] for layer in layers]
+    if options['grad_ckpt']:
+        # only the outputs of the layers are kept, the activations of one layer are recomputed at a time
+        activations = front_out + outputs + max(stored)
+    else:
+        activations = sum(stored) + outputs
+    return params + activations + max(layer[2] for layer in layers)
+
+def summary_bytes(data: Dataset, configs: Configs, options: Options) -> int:
+    stats = [graph_stats(graph) for graph in data.sumGraphs]
+    if options['sum_batch']:
+        stats = [union_stats(stats)]
+    peak = max(unit_bytes(s, configs, data.num_classes, 'summary', True, True, options) for s in stats)
+    # the embeddings of the pre-trained summary graphs are kept
+    return peak + sum(s['nodes'] for s in stats) * configs['emb'] * FLOAT
+
+def original_bytes(data: Dataset, configs: Configs, exp: str, options: Options) -> int:
+    stats = graph_stats(data.orgGraph)
+    n, d, s = stats['nodes'], configs['emb'], configs['num_sums']
+    transfer = exp != 'baseline' and configs['e_trans']
+    trainable = not (transfer and configs['e_freeze'])
+    weighted = options['lean_agg'] or getattr(data.orgGraph.training_data, 'edge_norm', None) is not None
+    peak = unit_bytes(stats, configs, data.num_classes, exp if transfer else 'baseline', trainable, weighted, options)
+    if weighted:
+        peak += stats['edges'] * FLOAT
+    if transfer:
+        # the embedding trick constructs a tensor per summary graph before they are combined
+        construction = (s + 1) * n * d * FLOAT if exp == 'summation' else 2 * s * n * d * FLOAT
+        peak = max(peak, construction)
+    summaries = sum(graph.num_nodes for graph in data.sumGraphs) * d * FLOAT
+    return peak + summaries
+
+def estimate(data: Dataset, configs: Configs, experiments: List[str], options: Options, base: int) -> Dict[str, float]:
+    '''estimated peak memory (MB) of the stages'''
+    stages = {'summary': summary_bytes(data, configs, options)}
+    stages.update({exp: original_bytes(data, configs, exp, options) for exp in experiments})
+    return {stage: round((base + peak * HEADROOM) / MB, 1) for stage, peak in stages.items()}
+
+def plan_memory(data: Dataset, configs: Configs, experiments: List[str], data_bytes: int) -> Tuple[Options, Dict[str, Union[str, float, dict]]]:
+    '''Pick the first strategy whose estimated peak fits configs['mem_budget'] (GB). Without a budget the configured run is estimated.
+    data_bytes is the memory of the dataset, that is copied for every iteration.
+    Return:
+        options of the strategy (sum_batch, lean_agg, grad_ckpt, bf16), plan with the decision and the estimates
+    '''
+    base = current_rss() + data_bytes
+    options = {key: configs[key] for key in ['sum_batch', 'lean_agg', 'grad_ckpt', 'bf16']}
+    budget = configs['mem_budget']
+    plan = {'budget MB': None if budget is None else round(budget * 1024, 1), 'base MB': round(base / MB, 1), 'estimates MB': dict()}
+    for strategy, strategy_options in STRATEGIES:
+        options.update(strategy_options)
+        stages = estimate(data, configs, experiments, options, base)
+        plan['estimates MB'][strategy] = stages
+        if budget is None or max(stages.values()) <= budget * 1024:
+            plan.update({'strategy': strategy, 'options': dict(options), 'estimated peak MB': max(stages.values())})
+            return options, plan
+    raise ValueError(f'the estimated peak memory does not fit the memory budget of {budget} GB with any strategy: {plan["estimates MB"]}')
+
+def measure(plan: Dict[str, Union[str, float, dict]], stage: str, peak: Optional[int]=None) -> None:
+    '''add the measured peak (MB, the maximum over the iterations) of a stage to the plan'''
+    peak = round((peak_rss() if peak is None else peak) / MB, 1)
+    measured = plan.setdefault('measured peak MB', dict())
+    measured[stage] = max(measured.get(stage, 0), peak)
@@ -0,0 +1,37 @@
+import json
+import os
+
+from typing import Dict, List, Union
+
+"""Append-only JSON lines log of a run. Every record is written (and flushed) immediately, so the log can be followed
+while a run is in progress, e.g. with `tail -f results/{run}/metrics.jsonl`, and survives a crash of the run.
+Records:
+    {"type": "epoch", "stage": "summary" | "original", "unit": "i0_mlp", "graph": ..., "iteration": 0, "epoch": 0,
+     "loss": ..., "accuracy": ..., "f1 weighted": ..., "f1 macro": ..., "epoch seconds": ..., "edges/sec": ...}
+    {"type": "test", "exp": "mlp", "iteration": 0, "Test acc": ..., "Test F1 weighted": ..., "Test F1 macro": ...}
+    {"type": "memory", "exp": "mlp", "bytes": ..., "float32 bytes": ..., "saved %": ...}
+Validation metrics are only logged for the original graph.
+"""
+
+Record = Dict[str, Union[str, int, float]]
+
+class MetricsLog:
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+
+    def write(self, record: Record) -> None:
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+def read_log(path: str) -> List[Record]:
+    if not os.path.isfile(path):
+        return []
+    with open(path, 'r') as f:
+        # the last line can be incomplete if the run was killed while writing
+        records = []
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass
+        return records
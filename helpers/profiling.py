@@ -0,0 +1,70 @@
+import os
+import torch
+
+from collections import defaultdict
+from torch.profiler import profile, ProfilerActivity
+from typing import Dict, List, Optional
+
+"""Operator level profiling of training epochs with torch.profiler.
+The selected epochs of every training unit (every summary graph and every experiment on the original graph) are profiled.
+For every profiled epoch a Chrome trace (open in chrome://tracing or https://ui.perfetto.dev) and a table of the operators
+(CPU time and memory) are saved to {run}/profile/. The epochs are split into the regions evaluate, forward, backward
+and optimizer step (see Trainer.train). The CPU time of these regions and the hottest operators per stage
+(summary or original) are added to the run report.
+"""
+
+# record_function regions of Trainer.train, their self time is the Python overhead of the region
+REGIONS = ['evaluate', 'forward', 'backward', 'optimizer step']
+
+class EpochProfiler:
+    def __init__(self, path: str, epochs: List[int], top: int=15) -> None:
+        self.path: str = os.path.join(path, 'profile')
+        self.epochs: set = set(epochs)
+        self.top: int = top
+        self.activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if torch.cuda.is_available() else [])
+        # stage -> operator -> [self cpu time (us), self cpu memory (bytes), calls], without the regions
+        self.operators: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(lambda: [0.0, 0.0, 0]))
+        self.total: Dict[str, float] = defaultdict(float)
+        # stage -> region -> cpu time (us) including the operators of the region
+        self.regions: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        os.makedirs(self.path, exist_ok=True)
+
+    def start(self, epoch: int) -> Optional[profile]:
+        if epoch not in self.epochs:
+            return None
+        prof = profile(activities=self.activities, profile_memory=True)
+        prof.start()
+        return prof
+
+    def stop(self, prof: Optional[profile], unit: str, stage: str, epoch: int) -> None:
+        if prof is None:
+            return
+        prof.stop()
+        name = f'{unit}_epoch{epoch}'
+        prof.export_chrome_trace(os.path.join(self.path, f'{name}.json'))
+        averages = prof.key_averages()
+        with open(os.path.join(self.path, f'{name}.txt'), 'w') as f:
+            f.write(averages.table(sort_by='self_cpu_time_total', row_limit=-1))
+        for event in averages:
+            self.total[stage] += event.self_cpu_time_total
+            if event.key in REGIONS:
+                self.regions[stage][event.key] += event.cpu_time_total
+                continue
+            operator = self.operators[stage][event.key]
+            operator[0] += event.self_cpu_time_total
+            operator[1] += event.self_cpu_memory_usage
+            operator[2] += event.count
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        '''the CPU time of the regions and the top operators (by self CPU time) of the profiled epochs per stage'''
+        summary = dict()
+        for stage, operators in self.operators.items():
+            total = max(self.total[stage], 1e-9)
+            top = sorted(operators.items(), key=lambda item: item[1][0], reverse=True)[:self.top]
+            summary[f'Profile {stage}'] = {
+                'profiled cpu ms': round(total / 1000, 3),
+                'regions': {key: {'cpu ms': round(cpu / 1000, 3), 'cpu %': round(cpu / total * 100, 2)} for key, cpu in self.regions[stage].items()},
+                'operators': {key: {'self cpu ms': round(cpu / 1000, 3), 'self cpu %': round(cpu / total * 100, 2),
+                                    'self cpu memory MB': round(memory / 2**20, 3), 'calls': calls}
+                              for key, (cpu, memory, calls) in top}}
+        return summary
@@ -1,14 +1,20 @@
+import argparse
 import json
-import matplotlib.pyplot as plt
+import multiprocessing
 import numpy as np
 import os
 
 from collections import defaultdict
 from datetime import datetime
-from typing import Dict, Union
-from torch import nn
+from typing import TYPE_CHECKING, Dict, Union
 
-from model.modelTrainer import Trainer
+from helpers.metricsLog import read_log
+
+if TYPE_CHECKING:
+    from torch import nn
+    from model.modelTrainer import Trainer
+
+# matplotlib and the model (torch) are imported on first use, rebuilding a report from a metrics log needs neither
 
 
 class Results:
@@ -17,6 +23,48 @@ class Results:
         self.test_accs = defaultdict(list)
         self.test_f1_weighted = defaultdict(list)
         self.test_f1_macro = defaultdict(list)
+        self.embedding_memory = dict()
+        # top operators of the profiled epochs (see helpers/profiling.py)
+        self.profile = dict()
+        self.path: str = None
+
+    def make_run_dir(self, configs: Dict[str, Union[str, int]]) -> str:
+        """create the result directory of a run (with its configs), the metrics log of the run is written to it"""
+        dt = datetime.now()
+        str_date = dt.strftime('%d%B%Y-%H%M')
+        self.path = f'./results/{configs["dataset"]}_{configs["exp"]}_{configs["sum"]}_i={configs["i"]}_{str_date}'
+        os.makedirs(self.path, exist_ok=True)
+        with open(f'{self.path}/configs.json', 'w') as write_file:
+            json.dump(configs, write_file, indent=4, default=str)
+        return self.path
+
+    @staticmethod
+    def from_log(path: str) -> 'Results':
+        """rebuild the results of a (finished or running) run from its metrics log"""
+        epochs = defaultdict(dict)
+        tested = set()
+        results = Results()
+        for record in read_log(path):
+            if record['type'] == 'epoch' and record['stage'] == 'original':
+                # a resumed run repeats the epochs after its last checkpoint, the last record of an epoch is kept
+                epochs[(record['unit'], record['iteration'])][record['epoch']] = record
+            elif record['type'] == 'test':
+                exp = record['exp']
+                tested.add((exp, record['iteration']))
+                results.test_accs[f'Test acc {exp}'].append(record['Test acc'])
+                results.test_f1_weighted[f'Test F1 weighted {exp}'].append(record['Test F1 weighted'])
+                results.test_f1_macro[f'Test F1 macro {exp}'].append(record['Test F1 macro'])
+            elif record['type'] == 'memory':
+                results.embedding_memory[f'Embedding memory {record["exp"]}'] = {k: v for k, v in record.items() if k not in ['type', 'exp']}
+        for (unit, iteration), unit_epochs in sorted(epochs.items()):
+            exp = unit.split('_', 1)[1]
+            # experiments without test results are still running
+            if (exp, iteration) not in tested:
+                continue
+            records = [unit_epochs[epoch] for epoch in sorted(unit_epochs)]
+            results.add_key(exp)
+            results.update_run_results({metric: [r[metric] for r in records] for metric in ['accuracy', 'loss', 'f1 weighted', 'f1 macro']}, exp)
+        return results
 
     def add_key(self, key: str) -> None:
         if key  not in self.run_results.keys():
@@ -26,7 +74,18 @@ class Results:
         for key, value in new_results.items():
             self.run_results[exp][key].append(np.array(value))
 
-    def print_trainable_parameters(self, model: nn.Module, exp: str, trainer: Trainer) -> int:
+    def merge(self, other: 'Results') -> None:
+        """add the (not yet averaged) results of another Results object, e.g. of a parallel run"""
+        for exp, metrics in other.run_results.items():
+            self.add_key(exp)
+            for metric, values in metrics.items():
+                self.run_results[exp][metric].extend(values)
+        for test_dict, other_dict in [(self.test_accs, other.test_accs), (self.test_f1_weighted, other.test_f1_weighted), (self.test_f1_macro, other.test_f1_macro)]:
+            for key, values in other_dict.items():
+                test_dict[key].extend(values)
+        self.embedding_memory.update(other.embedding_memory)
+
+    def print_trainable_parameters(self, model: 'nn.Module', exp: str, trainer: 'Trainer') -> int:
         """calculate and print trainable parameters of the models"""
 
         trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
@@ -36,6 +95,17 @@ class Results:
         print(f'number of trainable parameters for {exp.upper()} model: {trainable_params}')
         return trainable_params
 
+    def add_embedding_memory(self, model: 'nn.Module', exp: str) -> None:
+        """store the memory of the (transferred) embedding, to report the saving of a quantized embedding"""
+        from model.layers import embedding_nbytes
+        stored, float32 = embedding_nbytes(model.embedding)
+        if float32 == 0:
+            print(f'no embedding in the {exp.upper()} model')
+            return
+        saved = round((1 - stored/float32)*100, 2)
+        self.embedding_memory[f'Embedding memory {exp}'] = {'bytes': stored, 'float32 bytes': float32, 'saved %': saved}
+        print(f'embedding memory for {exp.upper()} model: {stored} bytes ({saved}% saved compared to float32)')
+
     def make_av_run_results(self) -> None:
         for exp, value in self.run_results.items():
             for metric, array_list in value.items():
@@ -45,90 +115,131 @@ class Results:
                 mean_up = list(np.around(mean_arr + np.std(np.array(array_list), axis=0), 4))
                 self.run_results[exp][metric] = [mean_list, mean_low, mean_up]
 
-    def create_run_report(self, path: str, configs: Dict[str, Union[str, int]]) -> None:
-        "with this function we save a statistics report of the experiments"
-
-        report = defaultdict(dict)
-        report.update(configs)
-
+    def max_run_results(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """best (averaged) validation metrics and their epoch, call make_av_run_results first"""
+        max_results = defaultdict(dict)
         for experiment, metric_retsults in self.run_results.items():
             for metric, results in metric_retsults.items():
                 max_metric = max(results[0])
                 epoch = int(results[0].index(max_metric)) - 1 
                 percentage_max = max_metric *100
-                report[experiment][metric] = {'epoch': epoch, 'max': round(percentage_max, 2)}
-        
+                max_results[experiment][metric] = {'epoch': epoch, 'max': round(percentage_max, 2)}
+        return max_results
+
+    def test_results(self) -> Dict[str, Dict[str, float]]:
+        """mean and std (in %) of the test metrics over the iterations"""
+        test_results = dict()
         for test_dict in [self.test_accs, self.test_f1_weighted, self.test_f1_macro]:
             for experiment, results in test_dict.items():
                 avg  = round(float((sum(results)/len(results))*100), 2)
                 std = round(float(np.std((np.array(results)*100))), 2)
-                report[experiment] = {'mean': avg, 'std': std}
+                test_results[experiment] = {'mean': avg, 'std': std}
+        return test_results
+
+    def create_run_report(self, path: str, configs: Dict[str, Union[str, int]]) -> None:
+        "with this function we save a statistics report of the experiments"
+
+        report = defaultdict(dict)
+        report.update(configs)
+        report.update(self.max_run_results())
+        report.update(self.test_results())
+        report.update(self.embedding_memory)
+        report.update(self.profile)
 
         with open(f'{path}/report_{configs["exp"]}_{configs["sum"]}_i={configs["i"]}.json', 'w') as write_file:
                 json.dump(report, write_file, indent=4)
 
     def plot_results(self, path: str, configs: Dict[str, Union[str, int]]) -> None:
         """"function to plot and save results and different metrics in seperate figures"""
+        import matplotlib.pyplot as plt
 
         epoch_list = [j for j in range(configs['epochs'])]
         colors: dict = {'attention': '#FF0000', 'summation': '#069AF3', 'mlp': '#15B01A'}
         exps = self.run_results.keys()
-    
-        with open(f'./baselines/{configs["dataset"]}_baseline/run_results_baseline_i=5.json') as baseline_results_file:
-            b_results  = json.load(baseline_results_file)
-
-            for metric, result in b_results['baseline'].items():
-                y_base = result[0][:51]
-                y1_base = result[1][:51]
-                y2_base = result[2][:51]
-                x = epoch_list 
-                ylim = 1.1
-                step = 0.1
-
-                for exp in exps:
-                    if exp != 'baseline':                            
-                        y = self.run_results[exp][metric][0]
-                        y1 = self.run_results[exp][metric][1]
-                        y2 = self.run_results[exp][metric][2]
-                        x = epoch_list 
-                        plt.fill_between(x, y1, y2, color=colors[exp], interpolate=True, alpha=0.2)
-                        plt.plot(x, y, color=colors[exp], label=f'{exp} {metric}')
-
-                    plt.fill_between(x, y1_base, y2_base, color='#FAC205', interpolate=True, alpha=0.45)
-                    plt.plot(x, y_base, color='#FAC205', label = f'baseline {metric}')    
-                    plt.title(f'{exp} {metric} on {configs["dataset"]} dataset during training epochs ({configs["sum"]})')
-                    plt.xlabel('Epochs')
-                    plt.ylabel(f'{metric}')
-                    plt.grid(color='b', linestyle='-', linewidth=0.1)
-                    plt.margins(x=0)
-                    plt.legend(loc='best')
-                    plt.xticks(np.arange(0, len(epoch_list), 5))
-                    plt.xlim(xmin=0)
-
-                    if max(y2_base) > 1:
-                        ylim = round(max(y2_base)+1.0)
-                        step = 0.5
-                
-                    plt.yticks(np.arange(0, ylim, step))
-                    plt.ylim(ymin=0)
-                    plt.savefig(f'{path}/{configs["dataset"]}_{exp}_{metric}_{configs["sum"]}_i={configs["i"]}.pdf', format='pdf')
-                    plt.show()
-                    plt.close()
-                    plt.clf()
+
+        # without stored baseline results, the baseline of this run (if any) is plotted
+        baseline_path = f'./baselines/{configs["dataset"]}_baseline/run_results_baseline_i=5.json'
+        b_results = {'baseline': self.run_results.get('baseline', dict())}
+        if os.path.isfile(baseline_path):
+            with open(baseline_path) as baseline_results_file:
+                b_results  = json.load(baseline_results_file)
+        metrics = next(iter(self.run_results.values())).keys() if self.run_results else []
+
+        for metric in metrics:
+            result = b_results['baseline'].get(metric)
+            ylim = 1.1
+            step = 0.1
+
+            for exp in exps:
+                upper = []
+                if exp != 'baseline':                            
+                    y = self.run_results[exp][metric][0]
+                    y1 = self.run_results[exp][metric][1]
+                    y2 = self.run_results[exp][metric][2]
+                    x = epoch_list 
+                    plt.fill_between(x, y1, y2, color=colors[exp], interpolate=True, alpha=0.2)
+                    plt.plot(x, y, color=colors[exp], label=f'{exp} {metric}')
+                    upper = y2
+
+                if result is not None:
+                    y_base = result[0][:len(epoch_list)]
+                    y1_base = result[1][:len(epoch_list)]
+                    y2_base = result[2][:len(epoch_list)]
+                    x_base = epoch_list[:len(y_base)]
+                    plt.fill_between(x_base, y1_base, y2_base, color='#FAC205', interpolate=True, alpha=0.45)
+                    plt.plot(x_base, y_base, color='#FAC205', label = f'baseline {metric}')    
+                    upper = y2_base
+                plt.title(f'{exp} {metric} on {configs["dataset"]} dataset during training epochs ({configs["sum"]})')
+                plt.xlabel('Epochs')
+                plt.ylabel(f'{metric}')
+                plt.grid(color='b', linestyle='-', linewidth=0.1)
+                plt.margins(x=0)
+                plt.legend(loc='best')
+                plt.xticks(np.arange(0, len(epoch_list), 5))
+                plt.xlim(xmin=0)
+
+                if len(upper) > 0 and max(upper) > 1:
+                    ylim = round(max(upper)+1.0)
+                    step = 0.5
+            
+                plt.yticks(np.arange(0, ylim, step))
+                plt.ylim(ymin=0)
+                plt.savefig(f'{path}/{configs["dataset"]}_{exp}_{metric}_{configs["sum"]}_i={configs["i"]}.pdf', format='pdf')
+                plt.close()
+                plt.clf()
+
+    def plot_in_background(self, path: str, configs: Dict[str, Union[str, int]]) -> None:
+        import matplotlib
+        matplotlib.use('Agg')
+        self.plot_results(path, configs)
            
     def save_to_json(self, path: str, configs) -> None:
         with open(f'{path}/run_results_{configs["exp"]}_{configs["sum"]}_i={configs["i"]}.json', 'w') as write_file:
                 json.dump(self.run_results, write_file, indent=4)
 
-    def process_results(self, configs: Dict[str, Union[str, int]]) -> None:
-        dt = datetime.now()
-        str_date = dt.strftime('%d%B%Y-%H%M')
-        path=f'./results/{configs["dataset"]}_{configs["exp"]}_{configs["sum"]}_i={configs["i"]}_{str_date}'
-        os.mkdir(path)
+    def process_results(self, configs: Dict[str, Union[str, int]], background: bool=True) -> None:
+        path = self.path if self.path is not None else self.make_run_dir(configs)
 
         self.make_av_run_results()
         self.save_to_json(path, configs)
         self.create_run_report(path, configs)
-        self.plot_results(path, configs)
-
-        
\ No newline at end of file
+        if not configs.get('plot', True):
+            return
+        if background:
+            # the plots are rendered by a child process with a headless backend, the run does not wait for matplotlib
+            multiprocessing.get_context('fork').Process(target=self.plot_in_background, args=(path, configs)).start()
+        else:
+            self.plot_results(path, configs)
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='report arguments')
+    parser.add_argument('-path', type=str, required=True, help='result directory of a (running) run, e.g. ./results/AIFB_attention_attr_i=5_01January2024-1200')
+    args = vars(parser.parse_args())
+
+    # (re)create the run results, report and plots of the completed experiments from the metrics log
+    with open(f'{args["path"]}/configs.json', 'r') as configs_file:
+        configs = json.load(configs_file)
+    results = Results.from_log(f'{args["path"]}/metrics.jsonl')
+    results.path = args['path']
+    results.process_results(configs, background=False)
@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import platform
+import time
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+"""Run this file from the root directory: python -m helpers.threadTuner -dataset AIFB -sum attr
+Benchmark the stages of a dataset with different numbers of CPU threads (or worker processes) and save the fastest settings
+in ./graphs/{dataset}/thread_profile.json:
+    summary     torch threads of a training epoch on the summary graphs (every -sum folder is tuned separately)
+    original    torch threads of a training epoch on the original graph
+    parse       worker processes that encode an N-Triples file (graphs/ntParser.py), files below 64 MB are parsed by one process
+Small summary graph epochs spend more time on synchronizing threads than they gain, big original graph epochs use more cores.
+If a setting is at most -tolerance slower than the fastest, the fewer threads are kept.
+The profile is applied automatically by main.py, sweep.py (the Trainer sets the threads of every stage) and the preprocessing scripts
+in graphs/, if it was tuned on a machine with the same number of available cores. The threads are limited to the cores
+a process may use, so concurrent (sweep) workers that are pinned to their own cores (see pin_worker) do not oversubscribe the CPU.
+"""
+
+PROFILE = 'thread_profile.json'
+
+def available_cores() -> int:
+    '''the cores this process may run on (its CPU affinity)'''
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+def candidates(cores: int) -> List[int]:
+    '''powers of two up to (and) the number of cores'''
+    return sorted(set([2**i for i in range(cores.bit_length()) if 2**i <= cores] + [cores]))
+
+def profile_path(dataset: str) -> str:
+    return f'./graphs/{dataset}/{PROFILE}'
+
+def load_profile(dataset: str) -> Optional[Dict[str, dict]]:
+    '''the thread profile of the dataset, None if it is missing or was tuned for another number of cores'''
+    path = profile_path(dataset)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as f:
+        profile = json.load(f)
+    if profile['cores'] != available_cores():
+        print(f'{path} was tuned for {profile["cores"]} cores ({profile["host"]}), not applied on {available_cores()} cores')
+        return None
+    return profile
+
+def stage_settings(dataset: str, sum: Optional[str]=None) -> Dict[str, int]:
+    '''threads (or workers) per stage (summary, original, parse) from the thread profile, empty without a profile'''
+    profile = load_profile(dataset)
+    if profile is None:
+        return dict()
+    stages = profile['stages']
+    settings = {stage: stages[stage]['best'] for stage in ['original', 'parse'] if stage in stages}
+    if f'summary {sum}' in stages:
+        settings['summary'] = stages[f'summary {sum}']['best']
+    return settings
+
+def set_parse_workers(workers: Optional[int]) -> None:
+    '''set the default number of parse workers (graphs/ntParser.py), limited to the available cores'''
+    from graphs import ntParser
+    if workers is not None:
+        ntParser.DEFAULT_WORKERS = max(1, min(workers, available_cores()))
+
+def set_threads(threads: Optional[int]) -> None:
+    '''set the torch (OpenMP) threads, limited to the available cores'''
+    import torch
+    if threads is not None:
+        torch.set_num_threads(max(1, min(threads, available_cores())))
+
+def pin_worker(counter, workers: int) -> None:
+    '''pin a pool worker to its own slice of the available cores (the workers count themselves with the shared counter)'''
+    with counter.get_lock():
+        slot = counter.value % workers
+        counter.value += 1
+    if not hasattr(os, 'sched_setaffinity'):
+        return
+    cores = sorted(os.sched_getaffinity(0))
+    size = max(1, len(cores) // workers)
+    os.sched_setaffinity(0, cores[slot * size % len(cores):][:size])
+
+def pick(seconds: Dict[int, float], tolerance: float) -> int:
+    '''the fewest threads that are at most tolerance slower than the fastest'''
+    fastest = min(seconds.values())
+    return min(threads for threads, s in seconds.items() if s <= fastest * (1 + tolerance))
+
+def time_epochs(graphs: list, dataset: str, num_classes: int, hl: int, emb: int, epochs: int, sum_graph: bool) -> float:
+    '''seconds of one training epoch (forward, backward, optimizer step) over the graphs, the first epoch is warm-up'''
+    import torch
+    from model.evaluation import get_losst
+    from model.layers import Emb_Layers
+    loss_f, activation = get_losst(dataset, sumModel=sum_graph)
+    seconds = 0.0
+    for graph in graphs:
+        training_data = graph.training_data
+        model = Emb_Layers(2*len(graph.relations.keys())+1, hl, num_classes, graph.num_nodes, emb, len(graphs))
+        optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+        for epoch in range(epochs + 1):
+            start = time.perf_counter()
+            optimizer.zero_grad()
+            out = model(training_data, activation)
+            loss_f(out[training_data.x_train], training_data.y_train.to(torch.float32)).backward()
+            optimizer.step()
+            if epoch > 0:
+                seconds += time.perf_counter() - start
+    return seconds / epochs
+
+def tune_threads(graphs: list, dataset: str, num_classes: int, hl: int, emb: int, epochs: int, sum_graph: bool,
+                 threads: List[int], tolerance: float) -> Dict[str, object]:
+    import torch
+    default = torch.get_num_threads()
+    seconds = dict()
+    for t in threads:
+        torch.set_num_threads(t)
+        seconds[t] = time_epochs(graphs, dataset, num_classes, hl, emb, epochs, sum_graph)
+        print(f'{"summary" if sum_graph else "original"} graph epoch with {t} thread(s): {seconds[t]:.4f} s')
+    torch.set_num_threads(default)
+    return {'best': pick(seconds, tolerance), 'epoch seconds': {str(t): round(s, 5) for t, s in seconds.items()}}
+
+def tune_parse(path: str, workers: List[int], tolerance: float) -> Optional[Dict[str, object]]:
+    from graphs.ntParser import MIN_PARALLEL_BYTES, COMPRESSED, encode_graph_nt
+    if path.endswith(COMPRESSED) or os.path.getsize(path) < MIN_PARALLEL_BYTES:
+        print(f'{path} is parsed by one process, parse workers are not tuned')
+        return None
+    seconds = dict()
+    for w in workers:
+        start = time.perf_counter()
+        encode_graph_nt(path, workers=w)
+        seconds[w] = time.perf_counter() - start
+        print(f'parsing with {w} worker(s): {seconds[w]:.3f} s')
+    return {'best': pick(seconds, tolerance), 'seconds': {str(w): round(s, 3) for w, s in seconds.items()}}
+
+def tune(dataset: str, sum: str, hl: int, emb: int, epochs: int, threads: Optional[List[int]], tolerance: float) -> Dict[str, dict]:
+    '''benchmark the stages and update the thread profile of the dataset'''
+    from graphs.dataset import Dataset
+    from graphs.ntParser import find_nt
+    threads = threads if threads is not None else candidates(available_cores())
+    org_path = find_nt(f'./graphs/{dataset}/{dataset}_complete.nt')
+    data = Dataset(org_path, f'./graphs/{dataset}/{sum}/sum/', f'./graphs/{dataset}/{sum}/map/')
+    data.init_dataset()
+
+    path = profile_path(dataset)
+    profile = load_profile(dataset) or {'stages': dict()}
+    profile.update({'host': platform.node(), 'cores': available_cores(), 'date': datetime.now().isoformat(timespec='seconds')})
+    profile['stages'][f'summary {sum}'] = tune_threads(data.sumGraphs, dataset, data.num_classes, hl, emb, epochs, True, threads, tolerance)
+    profile['stages']['original'] = tune_threads([data.orgGraph], dataset, data.num_classes, hl, emb, epochs, False, threads, tolerance)
+    parse = tune_parse(org_path, threads, tolerance)
+    if parse is not None:
+        profile['stages']['parse'] = parse
+    with open(path, 'w') as f:
+        json.dump(profile, f, indent=4)
+    print(f'thread profile saved to {path}: {json.dumps({stage: s["best"] for stage, s in profile["stages"].items()})}')
+    return profile
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='thread tuning arguments')
+    parser.add_argument('-dataset', type=str, choices=['AIFB', 'BGS', 'MUTAG', 'AM', 'TEST'], help='inidcate dataset name', default='AIFB')
+    parser.add_argument('-sum', type=str, choices=['attr', 'bisim', 'mix', 'dummy', 'one'], default='attr', help='summarization technique')
+    parser.add_argument('-hl', type=int, default=16, help='hidden layer size')
+    parser.add_argument('-emb', type=int, default=63, help='Node embediding dimension')
+    parser.add_argument('-epochs', type=int, default=3, help='timed epochs per setting (after one warm-up epoch)')
+    parser.add_argument('-threads', type=int, nargs='+', default=None, help='thread (and worker) counts to benchmark (default: powers of two up to the available cores)')
+    parser.add_argument('-tolerance', type=float, default=0.05, help='keep fewer threads if they are at most this fraction slower')
+    args = vars(parser.parse_args())
+
+    tune(args['dataset'], args['sum'], args['hl'], args['emb'], args['epochs'], args['threads'], args['tolerance'])
@@ -24,6 +24,11 @@ def endlog() -> None:
     elapsed = end-start
     log("End Program", secondsToStr(elapsed))
 
-start = time()
-atexit.register(endlog)
-log("Start Program")
\ No newline at end of file
+def begin() -> None:
+    '''log the start of the program and its elapsed time at exit, called by the entry points (importing this module has no side effects)'''
+    global start
+    start = time()
+    atexit.register(endlog)
+    log("Start Program")
+
+start = time()
\ No newline at end of file
@@ -1,35 +1,137 @@
+import argparse
+import hashlib
+import os
+import subprocess
+import sys
 import torch
-import matplotlib.pyplot as plt
 import numpy as np
-import argparse
 
-from sklearn.manifold import TSNE
+from typing import List, Optional, Tuple
+from torch import Tensor
+
+"""Run this file from the root directory: python -m helpers.vizEmb -dataset AIFB -sum attr
+The transferred (summation) embedding is visualized with t-SNE in a separate stage. With -e_viz, train_original saves
+the embedding (with the label and the summary node of every node) and starts this file in a separate process, training does not wait for it.
+At most -n nodes are projected, sampled stratified by label or summary node: every stratum keeps its share of the sample
+(and at least one node). The sampled embedding can be reduced with PCA before t-SNE. The 2-D projection is cached in
+./results/embeddings/cache, keyed by the hash of the embedding file and the settings, so a repeated visualization only plots.
+"""
+
+# matplotlib and sklearn (PCA, t-SNE) are imported on first use, the Trainer imports this module for every run
+
+EMBEDDING_DIR = './results/embeddings'
+
+def embedding_path(dataset: str, sum: str) -> str:
+    return f'{EMBEDDING_DIR}/{dataset}_{sum}_embedding.pt'
+
+def node_strata(org_graph, sum_graph) -> Tuple[Tensor, Tensor]:
+    '''the (first) label and the summary node (of sum_graph) of every node of org_graph, -1 if it has none'''
+    labels = torch.full((org_graph.num_nodes,), -1, dtype=torch.long)
+    sum_nodes = torch.full((org_graph.num_nodes,), -1, dtype=torch.long)
+    for node, idx in org_graph.node_to_enum.items():
+        types = org_graph.org2type.get(node) if org_graph.org2type is not None else None
+        if types is not None and sum(types) > 0:
+            labels[idx] = int(np.argmax(types))
+        sum_node = sum_graph.orgNode2sumNode_dict.get(node)
+        if sum_node is not None and sum_node in sum_graph.node_to_enum:
+            sum_nodes[idx] = sum_graph.node_to_enum[sum_node]
+    return labels, sum_nodes
+
+def save_embedding(embedding: Tensor, org_graph, sum_graphs: list, path: str) -> None:
+    labels, sum_nodes = node_strata(org_graph, sum_graphs[0])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.save({'embedding': embedding.detach(), 'label': labels, 'summary': sum_nodes}, path)
+
+def start_viz_emb(dataset: str, sum: str, args: Optional[List[str]]=None) -> subprocess.Popen:
+    '''visualize the saved embedding in a separate process (without waiting for it)'''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, MPLBACKEND='Agg', PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    return subprocess.Popen([sys.executable, '-m', 'helpers.vizEmb', '-dataset', dataset, '-sum', sum] + (args or []), env=env)
+
+def file_hash(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def stratified_sample(groups: np.ndarray, n: int, seed: int=0) -> np.ndarray:
+    '''indices of at most n nodes, every group keeps its share of the sample and at least one node.
+    With more groups than n, n groups are drawn (weighted by their size) with one node each.
+    '''
+    if len(groups) <= n:
+        return np.arange(len(groups))
+    rng = np.random.default_rng(seed)
+    _, inverse, counts = np.unique(groups, return_inverse=True, return_counts=True)
+    if len(counts) > n:
+        quota = np.zeros(len(counts), dtype=np.int64)
+        quota[rng.choice(len(counts), size=n, replace=False, p=counts / counts.sum())] = 1
+    else:
+        # one node per group, the rest of the sample is split proportionally to the other nodes of the groups (largest remainder)
+        share = (counts - 1) / (len(groups) - len(counts)) * (n - len(counts))
+        quota = 1 + np.floor(share).astype(np.int64)
+        quota[np.argsort(np.floor(share) - share, kind='stable')[:n - quota.sum()]] += 1
+    # a random order within every group, the first quota nodes of a group are sampled
+    order = np.lexsort((rng.random(len(groups)), inverse))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.arange(len(groups)) - starts[inverse[order]]
+    return np.sort(order[rank < quota[inverse[order]]])
+
+def project(embedding: np.ndarray, pca: Optional[int], seed: int=0) -> np.ndarray:
+    from sklearn.manifold import TSNE
+    if pca is not None and pca < embedding.shape[1]:
+        from sklearn.decomposition import PCA
+        embedding = PCA(n_components=pca, random_state=seed).fit_transform(embedding)
+    return TSNE(init='pca', random_state=seed).fit_transform(embedding)
 
+def load_projection(path: str, n: int, stratify: str, pca: Optional[int], seed: int=0) -> Tuple[np.ndarray, np.ndarray]:
+    '''the 2-D projection of the sampled nodes and their stratum, from the cache if the embedding file and settings are unchanged'''
+    cache = f'{os.path.dirname(path)}/cache/{file_hash(path)[:16]}_n={n}_{stratify}_pca={pca}_seed={seed}.npz'
+    if os.path.isfile(cache):
+        print(f'loaded the projection from {cache}')
+        cached = np.load(cache)
+        return cached['projection'], cached['groups']
+    saved = torch.load(path)
+    # embeddings saved by earlier runs are a plain tensor, without strata
+    if isinstance(saved, Tensor) or stratify == 'none':
+        embedding = saved if isinstance(saved, Tensor) else saved['embedding']
+        groups = np.zeros(embedding.shape[0], dtype=np.int64)
+    else:
+        embedding, groups = saved['embedding'], saved[stratify].numpy()
+    sample = stratified_sample(groups, n, seed)
+    projection = project(embedding.numpy()[sample], pca, seed)
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    np.savez(cache, projection=projection, groups=groups[sample])
+    return projection, groups[sample]
 
 def viz_embedding(x: np.array, y: np.array, z: np.array, dataset: str, sum: str) -> None:
+    import matplotlib.pyplot as plt
     sum_type = {'attr': 'Attribute', 'bisim': '(k)-f. bisim.'}
     plt.scatter(x, y, c=z, cmap='viridis_r', s=0.8)
-    plt.title(f't-SNE transformed entity embedding ({dataset} {sum_type[sum]} summaries)')
-    plt.savefig(f'./results/embeddings/{dataset}_{sum}_embedding.pdf', format='pdf')
+    plt.title(f't-SNE transformed entity embedding ({dataset} {sum_type.get(sum, sum)} summaries)')
+    plt.savefig(f'{EMBEDDING_DIR}/{dataset}_{sum}_embedding.pdf', format='pdf')
     plt.show()
     plt.close()
     plt.clf()
 
-def main_viz_emb(dataset: str, sum: str) -> None:
-    embedding = torch.load(f'./results/embeddings/{dataset}_{sum}_embedding.pt')
-    trans_emb = TSNE(init='pca').fit_transform(embedding)
-    trans_emb_x, trans_emb_y = zip(*trans_emb)
-    x, y = np.array(trans_emb_x), np.array(trans_emb_y)
-    z = np.subtract(x, y)
+def main_viz_emb(dataset: str, sum: str, n: int=5000, stratify: str='label', pca: Optional[int]=50, seed: int=0) -> None:
+    projection, groups = load_projection(embedding_path(dataset, sum), n, stratify, pca, seed)
+    x, y = projection[:, 0], projection[:, 1]
+    # nodes are colored by stratum, without strata by their position
+    z = groups if len(np.unique(groups)) > 1 else np.subtract(x, y)
     viz_embedding(x, y, z, dataset, sum)
 
 
 if __name__=='__main__':
     parser = argparse.ArgumentParser(description='experiment arguments')
     parser.add_argument('-dataset', type=str, choices=['AIFB', 'BGS', 'MUTAG', 'AM', 'TEST'], help='inidcate dataset name', default='AIFB')
-    parser.add_argument('-sum', type=str, choices=['attr', 'bisim'], help='summation type', default='attr')
+    parser.add_argument('-sum', type=str, choices=['attr', 'bisim', 'mix', 'dummy', 'one'], help='summation type', default='attr')
+    parser.add_argument('-n', type=int, default=5000, help='max number of visualized nodes')
+    parser.add_argument('-stratify', type=str, choices=['label', 'summary', 'none'], default='label', help='stratum of the sampled nodes')
+    parser.add_argument('-pca', type=int, default=50, help='PCA dimension before t-SNE, 0 for none')
+    parser.add_argument('-seed', type=int, default=0, help='seed of the sample, PCA and t-SNE')
 
     configs = vars(parser.parse_args())
     dataset = configs['dataset']
     sum = configs['sum']
-    main_viz_emb(dataset, sum)
+    main_viz_emb(dataset, sum, configs['n'], configs['stratify'], configs['pca'] or None, configs['seed'])
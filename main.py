@@ -1,18 +1,14 @@
 import argparse
+import os
 
-from copy import deepcopy
-from distutils.util import strtobool
-from typing import Dict, Union
-from torch import nn
+from typing import TYPE_CHECKING, Callable, Dict, Union
 
-from graphs.dataset import Dataset
-from graphs.createAttributeSum import create_sum_map
-from helpers.results import Results
+from graphs.ntParser import find_nt
 from helpers import timing
-from helpers.checks import do_checks
-from model.embeddingTricks import stack_embeddings, sum_embeddings, concat_embeddings
-from model.layers import Emb_Layers, Emb_MLP_Layers, Emb_ATT_Layers
-from model.modelTrainer import Trainer
+from helpers.args import strtobool
+
+if TYPE_CHECKING:
+    from torch import nn
 
 """This file executes experiments to scale RGCN training with summary graphs. 
 After training on summary graphs, the weights and node embeddings of 
@@ -20,16 +16,35 @@ the summary model will be transferd to a new model for training on the
 full original graph.
 """
 
+def get_experiments() -> Dict[str, Dict[str, Union['nn.Module', Callable]]]:
+    from model.embeddingTricks import stack_embeddings, sum_embeddings, concat_embeddings
+    from model.layers import Emb_Layers, Emb_MLP_Layers, Emb_ATT_Layers
+    return {'summation': {'org_layers': Emb_Layers, 'embedding_trick': sum_embeddings},
+            'mlp': {'org_layers': Emb_MLP_Layers, 'embedding_trick': concat_embeddings},
+            'attention': {'org_layers': Emb_ATT_Layers, 'embedding_trick': stack_embeddings},
+            'baseline':{'org_layers': Emb_Layers, 'embedding_trick': None}}
+
 def run_expirements(configs: Dict[str, Union[bool, str, int, float]], 
-                    experiments: Dict[str, Dict[str, nn.Module]], 
+                    experiments: Dict[str, Dict[str, Union['nn.Module', Callable]]], 
                     org_path: str, 
                     sum_path: str, 
                     map_path: str) -> None:
-
-    # before running program, do some check and assert or adjust configs if needed
-    configs, sum_files = do_checks(configs, sum_path, map_path)
-
-    results = Results()
+    # torch, torch_geometric and sklearn are imported here, the parser (-h) does not need them
+    import torch
+    from copy import deepcopy
+    from graphs.dataset import Dataset
+    from graphs.createAttributeSum import create_sum_map
+    from graphs.graphProcessing import parse_graph_nt
+    from helpers.checkpoint import Checkpoint
+    from helpers.memoryPlanner import current_rss, pin_mmap_threshold, plan_memory, reset_peak, measure
+    from helpers.metricsLog import MetricsLog
+    from helpers.profiling import EpochProfiler
+    from helpers.results import Results
+    from helpers.threadTuner import set_parse_workers, stage_settings
+    from helpers.checks import do_checks
+    from model.evaluation import get_losst, predict_types
+    from model.inference import save_model
+    from model.modelTrainer import Trainer
 
     experiment_names = [configs['exp']]
     if configs['exp'] == None:
@@ -38,24 +53,72 @@ def run_expirements(configs: Dict[str, Union[bool, str, int, float]],
     # create attribute summaries if needed
     if configs['create_attr_sum']:
         timing.log('Creating graph summaries...')
-        create_sum_map(org_path, sum_path, map_path, dataset)
+        create_sum_map(org_path, sum_path, map_path, configs['dataset'])
         timing.log('Attribtue summaries done')
     
+    # threads and parse workers per stage from the thread profile of the dataset
+    threads = stage_settings(configs['dataset'], configs['sum']) if configs['tuned_threads'] else dict()
+    set_parse_workers(threads.get('parse'))
+    configs['threads'] = threads
+
     # initialzie the data and use deepcopy when using data to keep original data unchanged.
     timing.log('Making Graph data...')
-    data = Dataset(org_path, sum_path, map_path)
+    sum_select = None
+    if any(configs[k] is not None for k in ['sum_topk', 'sum_min_score', 'sum_max_ratio', 'sum_budget']):
+        sum_select = {'top_k': configs['sum_topk'], 'min_score': configs['sum_min_score'], 'max_ratio': configs['sum_max_ratio'], 'budget': configs['sum_budget']}
+    # with a budget, freed tensors are returned to the OS, so the peaks follow the estimate (see helpers/memoryPlanner.py)
+    pinned = configs['mem_budget'] is not None and pin_mmap_threshold()
+    rss = current_rss()
+    data = Dataset(org_path, sum_path, map_path, configs['rel_min'], configs['rel_topk'], sum_select)
     data.init_dataset()
+    data_bytes = current_rss() - rss
+
+    # before training, do some check and assert or adjust configs if needed (for the selected summary graphs)
+    configs, sum_files = do_checks(configs, sum_path, map_path, data.sum_files)
+    configs['sum files'] = sum_files
+    if data.sum_profiles is not None:
+        configs['sum profiles'] = data.sum_profiles
+
+    # estimate the peak memory of the stages and pick a training strategy that fits the memory budget
+    options, plan = plan_memory(data, configs, experiment_names, data_bytes)
+    configs.update(options)
+    plan['mmap threshold pinned'] = pinned
+    configs['memory plan'] = plan
+    print(f'memory plan: {plan["strategy"]} ({", ".join(f"{k}={v}" for k, v in options.items())}), estimated peak {plan["estimated peak MB"]} MB, budget {plan["budget MB"]} MB')
+
+    results = Results()
+    checkpoint, completed = None, set()
+    if configs['checkpoint'] or configs['resume']:
+        checkpoint = Checkpoint(f'./results/checkpoints/{configs["dataset"]}_{configs["exp"]}_{configs["sum"]}_i={configs["i"]}', configs, configs['ckpt_every'], configs['resume'])
+        partial_results, completed = checkpoint.load_progress()
+        if partial_results is not None:
+            results = partial_results
+    # a resumed run continues the metrics log of the interrupted run
+    if results.path is None:
+        results.make_run_dir(configs)
+    metrics_log = MetricsLog(f'{results.path}/metrics.jsonl')
+    profiler = EpochProfiler(results.path, configs['profile_epochs'], configs['profile_top']) if configs['profile'] else None
 
     for j in range(configs['i']):
+        # skip iterations that are completed in a previous (interrupted) run
+        if all(f'i{j}_{exp}' in completed for exp in experiment_names):
+            continue
     
         # run experiment(s)
-        trainer = Trainer(deepcopy(data), configs['hl'], configs['epochs'], configs['emb'], configs['lr'], weight_d=0.00005)
+        trainer = Trainer(deepcopy(data), configs['hl'], configs['epochs'], configs['emb'], configs['lr'], weight_d=0.00005, sparse_emb=configs['e_sparse'], checkpoint=checkpoint, iteration=j, metrics_log=metrics_log, profiler=profiler,
+                          grad_ckpt=configs['grad_ckpt'], lean_agg=configs['lean_agg'], bf16=configs['bf16'], threads=threads)
+        reset_peak()
         trainer.train_summaries(configs)
+        measure(plan, 'summary')
         for exp in experiment_names:
+            if f'i{j}_{exp}' in completed:
+                continue
             exp_settings = experiments[exp]
             results.add_key(exp)
             timing.log(f'Start {exp} Experiment')
+            reset_peak()
             results_acc, results_loss, results_f1_w, results_f1_m, test_acc, test_micro, test_macro, orgModel = trainer.train_original(exp_settings['org_layers'], exp_settings['embedding_trick'], configs, exp)
+            measure(plan, exp)
             
             for result in [results_acc, results_loss, results_f1_w, results_f1_m]:
                 results.update_run_results(result, exp)
@@ -66,11 +129,36 @@ def run_expirements(configs: Dict[str, Union[bool, str, int, float]],
 
             timing.log(f'{exp} experiment done')
             results.print_trainable_parameters(orgModel, exp, trainer)
-    configs['sum files'] = sum_files
+            results.add_embedding_memory(orgModel, exp)
+            metrics_log.write({'type': 'memory', 'exp': exp, **results.embedding_memory[f'Embedding memory {exp}']})
+
+            if configs['save_model']:
+                os.makedirs('./results/models', exist_ok=True)
+                save_model(f'./results/models/{configs["dataset"]}_{exp}_{configs["sum"]}.pt', orgModel, trainer.data.orgGraph, configs['dataset'], list(trainer.data.enum_classes.keys()))
+
+            # predict the types of new entities, without retraining
+            if configs['new_entities'] is not None:
+                timing.log(f'Adding new entities to {exp} model')
+                graph, new_nodes = trainer.add_entities(orgModel, parse_graph_nt(configs['new_entities']), exp_settings['embedding_trick'], configs, exp)
+                _, activation = get_losst(configs['dataset'])
+                x = torch.tensor([graph.node_to_enum[node] for node in new_nodes], dtype=torch.long)
+                predictions = predict_types(orgModel, activation, graph.training_data, x, list(trainer.data.enum_classes.keys()))
+                for node, types in zip(new_nodes, predictions):
+                    print(f'{node}: {types}')
+                timing.log('New entities done')
+
+            if checkpoint is not None:
+                checkpoint.complete(f'i{j}_{exp}', results, completed)
+        if checkpoint is not None:
+            checkpoint.remove(f'i{j}_sum')
+    if profiler is not None:
+        results.profile = profiler.summary()
     results.process_results(configs)
+    if checkpoint is not None:
+        checkpoint.finish()
 
 
-if __name__=='__main__':
+def get_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description='experiment arguments')
     parser.add_argument('-dataset', type=str, choices=['AIFB', 'BGS', 'MUTAG', 'AM', 'TEST'], help='inidcate dataset name', default='AIFB')
     parser.add_argument('-sum', type=str, choices=['attr', 'bisim', 'mix', 'dummy', 'one'], default='attr', help='summarization technique')
@@ -80,24 +168,47 @@ if __name__=='__main__':
     parser.add_argument('-i', type=int, default=1, help='experiment iterations')
     parser.add_argument('-lr', type=float, default=0.01, help='learning rate')
     parser.add_argument('-hl', type=int, default=16, help='hidden layer size')
+    parser.add_argument('-rel_min', type=int, default=0, help='merge predicates occurring less often into shared relation buckets')
+    parser.add_argument('-rel_topk', type=int, default=None, help='keep only the k most frequent predicates as separate relations')
+    parser.add_argument('-sum_topk', type=int, default=None, help='pre-train only the k summary graphs with the highest profile score')
+    parser.add_argument('-sum_min_score', type=float, default=None, help='skip summary graphs with a lower profile score')
+    parser.add_argument('-sum_max_ratio', type=float, default=None, help='skip summary graphs with more summary nodes per original node')
+    parser.add_argument('-sum_budget', type=float, default=None, help='max pre-training cost (summed summary triples relative to the original triples)')
+    parser.add_argument('-sum_batch', type=lambda b:bool(strtobool(b)), default=False, help='pre-train on all summary graphs jointly as one disjoint-union graph True/False')
     parser.add_argument('-e_trans', type=lambda x:bool(strtobool(x)), default=True, help='embedding transfer True/False')
     parser.add_argument('-e_freeze', type=lambda z:bool(strtobool(z)), default=True, help='freeze emebdding after summary training True/False')
+    parser.add_argument('-e_sparse', type=lambda s:bool(strtobool(s)), default=False, help='sparse gradients (and SparseAdam) for trainable embeddings True/False')
+    parser.add_argument('-e_quant', type=str, choices=['none', 'fp16', 'int8'], default='none', help='storage precision of the frozen transferred embedding')
     parser.add_argument('-w_trans', type=lambda y:bool(strtobool(y)), default=True, help='RGCN weight transfer True/False')
     parser.add_argument('-w_grad', type=lambda g:bool(strtobool(g)), default=True, help='Weight grad after transfer True/False')
-    parser.add_argument('-e_viz', type=lambda h:bool(strtobool(h)), default=False, help='viz embedding tensor')
+    parser.add_argument('-e_viz', type=lambda h:bool(strtobool(h)), default=False, help='visualize the transferred (summation) embedding with t-SNE in a separate process, see helpers/vizEmb.py True/False')
+    parser.add_argument('-save_model', type=lambda m:bool(strtobool(m)), default=False, help='save the trained model (with its node index) for inference True/False')
+    parser.add_argument('-new_entities', type=str, default=None, help='.nt file with triples of new entities to predict after training (without retraining)')
+    parser.add_argument('-new_epochs', type=int, default=0, help='fine-tune epochs for the embedding rows of the new entities')
+    parser.add_argument('-plot', type=lambda p:bool(strtobool(p)), default=True, help='plot the results (in a background process) True/False')
+    parser.add_argument('-checkpoint', type=lambda c:bool(strtobool(c)), default=False, help='checkpoint the run to ./results/checkpoints True/False')
+    parser.add_argument('-resume', type=lambda r:bool(strtobool(r)), default=False, help='resume an interrupted (checkpointed) run with the same configs True/False')
+    parser.add_argument('-ckpt_every', type=int, default=10, help='epochs between training checkpoints, 0 checkpoints completed units only')
+    parser.add_argument('-profile', type=lambda f:bool(strtobool(f)), default=False, help='profile training epochs with torch.profiler, traces are saved to {run}/profile True/False')
+    parser.add_argument('-profile_epochs', type=int, nargs='+', default=[1, 2], help='epochs of every training unit to profile')
+    parser.add_argument('-profile_top', type=int, default=15, help='number of hot operators per stage in the run report')
+    parser.add_argument('-mem_budget', type=float, default=None, help='memory budget in GB, the training strategy is picked to fit it (see helpers/memoryPlanner.py)')
+    parser.add_argument('-lean_agg', type=lambda a:bool(strtobool(a)), default=False, help='aggregate the original graph edge-wise to store less activations True/False')
+    parser.add_argument('-grad_ckpt', type=lambda k:bool(strtobool(k)), default=False, help='recompute the activations in the backward pass (gradient checkpointing) True/False')
+    parser.add_argument('-bf16', type=lambda v:bool(strtobool(v)), default=False, help='run the forward pass in bfloat16 autocast True/False')
+    parser.add_argument('-tuned_threads', type=lambda t:bool(strtobool(t)), default=True, help='apply the thread profile of the dataset (see helpers/threadTuner.py) True/False')
     parser.add_argument('-create_attr_sum', type=lambda w:bool(strtobool(w)), default=False, help='create attribute summaries before conducting the experiments')
-    
-    configs = vars(parser.parse_args())
+    return parser
 
-    experiments = {'summation': {'org_layers': Emb_Layers, 'embedding_trick': sum_embeddings},
-                    'mlp': {'org_layers': Emb_MLP_Layers, 'embedding_trick': concat_embeddings},
-                    'attention': {'org_layers': Emb_ATT_Layers, 'embedding_trick': stack_embeddings},
-                    'baseline':{'org_layers': Emb_Layers, 'embedding_trick': None}}
+
+if __name__=='__main__':
+    configs = vars(get_parser().parse_args())
+    timing.begin()
 
     dataset = configs['dataset']
     sum = configs['sum']
-    path = f'graphs/{dataset}/{dataset}_complete.nt'
+    path = find_nt(f'graphs/{dataset}/{dataset}_complete.nt')
     sum_path = f'graphs/{dataset}/{sum}/sum/'
     map_path = f'graphs/{dataset}/{sum}/map/'
 
-    run_expirements(configs, experiments, path, sum_path, map_path)
+    run_expirements(configs, get_experiments(), path, sum_path, map_path)
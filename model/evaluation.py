@@ -1,17 +1,22 @@
 
 import torch
 from torch import Tensor, nn
-from typing import Tuple, Callable
-from torch_geometric.data import Data
-from sklearn.metrics import classification_report, f1_score, accuracy_score
+from typing import TYPE_CHECKING, Tuple, Callable, List
+
+if TYPE_CHECKING:
+    from torch_geometric.data import Data
+
+# the sklearn metrics (and scipy) are imported on first use, get_losst is used by the inference server without them
 
 def calc_acc(pred: Tensor, x: Tensor, y: Tensor) -> float:
+    from sklearn.metrics import accuracy_score
     return accuracy_score(y, pred[x])
 
 def calc_f1(pred: Tensor, x: Tensor, y: Tensor, avg: str='weighted') -> float:
+    from sklearn.metrics import f1_score
     return f1_score(y, pred[x], average=avg, zero_division=0)
 
-def evaluate(model: nn.Module, activation, traininig_data: Data, x: Tensor, y: Tensor, report=False) -> Tuple[float]:
+def evaluate(model: nn.Module, activation, traininig_data: 'Data', x: Tensor, y: Tensor, report=False) -> Tuple[float]:
     pred = model(traininig_data, activation)
     if activation != torch.sigmoid:
         softmax = nn.Softmax(dim=1)
@@ -26,10 +31,20 @@ def evaluate(model: nn.Module, activation, traininig_data: Data, x: Tensor, y: T
     f1_m = calc_f1(pred, x, y, avg='macro')
 
     if report:
+        from sklearn.metrics import classification_report
         skl_pred = pred[x].detach().numpy()
         print(classification_report(y, skl_pred, zero_division=0))
     return acc, f1_w, f1_m
 
+def predict_types(model: nn.Module, activation, traininig_data: 'Data', x: Tensor, classes: List[str]) -> List[List[str]]:
+    '''predict the types (class names) of the nodes x. Sigmoid models can predict multiple types per node.'''
+    model.eval()
+    with torch.no_grad():
+        pred = model(traininig_data, activation)[x]
+    if activation != torch.sigmoid:
+        return [[classes[i]] for i in pred.argmax(1).tolist()]
+    return [[classes[i] for i in torch.nonzero(torch.round(row)).flatten().tolist()] for row in pred]
+
 def ce_loss(pred: Tensor, targets: Tensor) -> Tensor:
     loss_f = nn.CrossEntropyLoss()
     targets = targets.argmax(-1)
@@ -0,0 +1,91 @@
+import argparse
+import json
+import time
+import torch
+
+from torch import nn, Tensor
+from typing import Callable, Dict, List, Tuple
+
+from helpers.args import strtobool
+from model.evaluation import get_losst
+
+"""This file exports a trained R-GCN model (Emb_Layers, Emb_MLP_Layers or Emb_ATT_Layers), saved with -save_model True,
+to a self-contained TorchScript file. The (transferred) embedding, the edges of the graph and the activation of the
+dataset (see get_losst) are baked into the traced model, which maps node indices to predictions:
+    python -m model.export -model ./results/models/AIFB_summation_attr.pt -onnx True
+The TorchScript file can be loaded with torch.jit.load only, without torch_geometric, sklearn and matplotlib.
+The node index and classes are stored in the TorchScript file as extra files (node_to_enum.json, classes.json).
+"""
+
+class GraphInput:
+    # stands in for the torch_geometric Data object the models expect
+    def __init__(self, edge_index: Tensor, edge_type: Tensor) -> None:
+        self.edge_index = edge_index
+        self.edge_type = edge_type
+
+
+class FrozenGraphModel(nn.Module):
+    def __init__(self, model: nn.Module, edge_index: Tensor, edge_type: Tensor, activation: Callable) -> None:
+        super(FrozenGraphModel, self).__init__()
+        self.model = model
+        self.activation = activation
+        self.register_buffer('edge_index', edge_index)
+        self.register_buffer('edge_type', edge_type)
+
+    def forward(self, nodes: Tensor) -> Tensor:
+        pred = self.model(GraphInput(self.edge_index, self.edge_type), self.activation)
+        return pred[nodes]
+
+def benchmark(f: Callable, x: Tensor, runs: int) -> float:
+    '''average time (s) of a forward pass'''
+    with torch.no_grad():
+        f(x)
+        start = time.perf_counter()
+        for _ in range(runs):
+            f(x)
+    return (time.perf_counter() - start) / runs
+
+def export_model(artifact: Dict, path: str, onnx: bool=False, runs: int=10) -> Dict[str, float]:
+    _, activation = get_losst(artifact['dataset'])
+    model = artifact['model'].cpu().eval()
+    frozen = FrozenGraphModel(model, artifact['edge_index'].cpu(), artifact['edge_type'].cpu(), activation).eval()
+    nodes = torch.arange(len(artifact['node_to_enum']))
+
+    with torch.no_grad():
+        traced = torch.jit.trace(frozen, nodes, check_trace=False)
+        traced = torch.jit.freeze(traced)
+        assert torch.allclose(traced(nodes), frozen(nodes), atol=1e-5), 'traced model output differs from eager model output'
+    extra_files = {'node_to_enum.json': json.dumps(artifact['node_to_enum']), 'classes.json': json.dumps(artifact['classes'])}
+    torch.jit.save(traced, f'{path}.ts', _extra_files=extra_files)
+    print(f'TorchScript model saved to {path}.ts')
+
+    timings = {'eager': benchmark(frozen, nodes, runs), 'torchscript': benchmark(traced, nodes, runs)}
+
+    if onnx:
+        try:
+            torch.onnx.export(frozen, (nodes,), f'{path}.onnx', input_names=['nodes'], output_names=['pred'],
+                              dynamic_axes={'nodes': {0: 'batch'}, 'pred': {0: 'batch'}}, opset_version=17)
+            print(f'ONNX model saved to {path}.onnx')
+        except Exception as e:
+            print(f'ONNX export not possible for this model: {e}')
+
+    for runtime, seconds in timings.items():
+        print(f'{runtime} forward pass: {seconds*1000:.2f} ms')
+    return timings
+
+def load_exported(path: str) -> Tuple[torch.jit.ScriptModule, Dict[str, int], List[str]]:
+    '''load a TorchScript model with its node index and classes, works without the rest of this repository'''
+    extra_files = {'node_to_enum.json': '', 'classes.json': ''}
+    model = torch.jit.load(path, _extra_files=extra_files)
+    return model, json.loads(extra_files['node_to_enum.json']), json.loads(extra_files['classes.json'])
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='export arguments')
+    parser.add_argument('-model', type=str, required=True, help='model file saved with -save_model True')
+    parser.add_argument('-onnx', type=lambda o:bool(strtobool(o)), default=False, help='also export to ONNX True/False')
+    parser.add_argument('-runs', type=int, default=10, help='forward passes for the eager/TorchScript benchmark')
+    args = vars(parser.parse_args())
+
+    artifact = torch.load(args['model'], map_location='cpu')
+    export_model(artifact, args['model'].rsplit('.pt', 1)[0], args['onnx'], args['runs'])
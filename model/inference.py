@@ -0,0 +1,216 @@
+import argparse
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import torch
+
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from torch import nn, Tensor
+from torch_geometric.data import Data
+from typing import Dict, List, Optional, Tuple
+
+from graphs.graph import Graph
+from model.evaluation import get_losst
+
+"""This file serves entity type predictions of a trained R-GCN model.
+A model is saved together with the node index and edges of its graph (save_model). The predictions of the model
+for all nodes are computed once and cached next to the model file. The cache is recomputed when the model file changes.
+Batched lookups are served over a local HTTP endpoint, concurrent requests are micro-batched:
+    python -m model.inference -model ./results/models/AIFB_summation_attr.pt -port 8000
+    curl -X POST localhost:8000/predict -d '{"entities": ["<http://...>"]}'
+"""
+
+def save_model(path: str, model: nn.Module, graph: Graph, dataset: str, classes: List[str]) -> None:
+    artifact = {'model': model,
+                'dataset': dataset,
+                'classes': classes,
+                'node_to_enum': graph.node_to_enum,
+                'edge_index': graph.training_data.edge_index,
+                'edge_type': graph.training_data.edge_type}
+    torch.save(artifact, path)
+    print(f'model saved to {path}')
+
+def file_hash(path: str) -> str:
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class TypePredictor:
+    def __init__(self, model_path: str, cache_path: Optional[str]=None) -> None:
+        self.model_path: str = model_path
+        self.cache_path: str = cache_path if cache_path is not None else f'{model_path}.cache'
+        self.mtime: int = None
+        self.key: str = None
+        self.classes: List[str] = None
+        self.node_to_enum: Dict[str, int] = None
+        self.pred: Tensor = None
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        '''Load the model and its cached predictions, (re)compute the cache if it belongs to another model file.'''
+        mtime = os.stat(self.model_path).st_mtime_ns
+        key = file_hash(self.model_path)
+        artifact = torch.load(self.model_path, map_location='cpu')
+
+        pred = None
+        if os.path.isfile(self.cache_path):
+            cache = torch.load(self.cache_path)
+            if cache['key'] == key:
+                pred = cache['pred']
+        if pred is None:
+            pred = self.compute_predictions(artifact)
+            torch.save({'key': key, 'pred': pred}, self.cache_path)
+            print(f'prediction cache saved to {self.cache_path}')
+
+        with self.lock:
+            self.mtime, self.key = mtime, key
+            self.classes, self.node_to_enum, self.pred = artifact['classes'], artifact['node_to_enum'], pred
+
+    def compute_predictions(self, artifact: dict) -> Tensor:
+        '''one full-graph forward pass, stored as 0/1 type indicators per node'''
+        model = artifact['model']
+        _, activation = get_losst(artifact['dataset'])
+        model.eval()
+        training_data = Data(edge_index=artifact['edge_index'])
+        training_data.edge_type = artifact['edge_type']
+        with torch.no_grad():
+            pred = model(training_data, activation)
+        if activation != torch.sigmoid:
+            return torch.zeros(pred.shape, dtype=torch.bool).scatter(1, pred.argmax(1).unsqueeze(1), True)
+        return torch.round(pred).to(torch.bool)
+
+    def refresh_if_changed(self) -> None:
+        try:
+            if os.stat(self.model_path).st_mtime_ns != self.mtime:
+                print('model file changed, reloading')
+                self.load()
+        except FileNotFoundError:
+            pass
+
+    def predict(self, entities: List[str]) -> List[Optional[List[str]]]:
+        '''predicted types per entity, None for entities that are not in the graph'''
+        with self.lock:
+            idx = [self.node_to_enum.get(entity.lower()) for entity in entities]
+            known = [i for i in idx if i is not None]
+            rows = self.pred[torch.tensor(known, dtype=torch.long)].tolist() if known else []
+            classes = self.classes
+        rows = iter(rows)
+        predictions = []
+        for i in idx:
+            if i is None:
+                predictions.append(None)
+            else:
+                predictions.append([classes[j] for j, hit in enumerate(next(rows)) if hit])
+        return predictions
+
+
+class MicroBatcher:
+    '''Collects concurrent requests for max_wait seconds (or until max_batch entities) and answers them after one model refresh check.'''
+    def __init__(self, predictor: TypePredictor, max_batch: int=4096, max_wait: float=0.005) -> None:
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests: queue.Queue = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, entities: List[str]) -> Future:
+        future: Future = Future()
+        self.requests.put((entities, future))
+        return future
+
+    def run(self) -> None:
+        while True:
+            batch: List[Tuple[List[str], Future]] = [self.requests.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request[0])
+
+            try:
+                self.predictor.refresh_if_changed()
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            # one lookup per request, so a failing request does not fail the others of the micro-batch
+            for entities, future in batch:
+                try:
+                    future.set_result(self.predictor.predict(entities))
+                except Exception as e:
+                    future.set_exception(e)
+
+
+def make_handler(batcher: MicroBatcher) -> type:
+    class PredictionHandler(BaseHTTPRequestHandler):
+        def send_json(self, status: int, body: dict) -> None:
+            data = json.dumps(body).encode('utf8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            if self.path != '/health':
+                self.send_json(404, {'error': 'not found'})
+                return
+            self.send_json(200, {'nodes': len(batcher.predictor.node_to_enum), 'model': batcher.predictor.key})
+
+        def do_POST(self) -> None:
+            if self.path != '/predict':
+                self.send_json(404, {'error': 'not found'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                entities = body['entities']
+                # a string would be split into its characters
+                if not isinstance(entities, list) or not all(isinstance(e, str) for e in entities):
+                    raise TypeError('entities is not a list of strings')
+            except (ValueError, KeyError, TypeError):
+                self.send_json(400, {'error': 'expected a json body like {"entities": ["<http://...>", ...]}'})
+                return
+            try:
+                predictions = batcher.submit(entities).result()
+            except Exception as e:
+                self.send_json(500, {'error': f'prediction failed: {e}'})
+                return
+            self.send_json(200, {'predictions': [{'entity': e, 'types': p} for e, p in zip(entities, predictions)]})
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    return PredictionHandler
+
+def serve(model_path: str, host: str, port: int, max_batch: int, max_wait: float) -> None:
+    batcher = MicroBatcher(TypePredictor(model_path), max_batch, max_wait)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher))
+    print(f'serving type predictions of {model_path} on http://{host}:{port}/predict')
+    server.serve_forever()
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='inference arguments')
+    parser.add_argument('-model', type=str, required=True, help='model file saved with -save_model True')
+    parser.add_argument('-host', type=str, default='127.0.0.1')
+    parser.add_argument('-port', type=int, default=8000)
+    parser.add_argument('-max_batch', type=int, default=4096, help='max entities per micro-batch')
+    parser.add_argument('-max_wait', type=float, default=5, help='max time (ms) to collect a micro-batch')
+    args = vars(parser.parse_args())
+
+    serve(args['model'], args['host'], args['port'], args['max_batch'], args['max_wait']/1000)
@@ -1,34 +1,138 @@
-from typing import Callable
+from typing import Callable, Optional, Tuple
 import torch
 import torch.nn.functional as F
 
 from torch import nn
 from torch import Tensor
+from torch.utils.checkpoint import checkpoint
 from torch_geometric.nn import RGCNConv
 from torch_geometric.data import Data 
 
 
+class QuantizedEmbedding(nn.Module):
+    '''Frozen (transferred) embedding stored in reduced precision and dequantized on the fly.
+    int8 storage uses a symmetric scale per row (over the last dimension), so it also works for the 
+    stacked (3d) embedding of the attention model. fp16 storage is a plain cast.
+    '''
+    sparse = False
+
+    def __init__(self, embedding: Tensor, quant: str) -> None:
+        super(QuantizedEmbedding, self).__init__()
+        embedding = embedding.detach().to(torch.float32)
+        self.quant = quant
+        self.num_embeddings = embedding.shape[-2]
+        if quant == 'int8':
+            scale = embedding.abs().amax(dim=-1, keepdim=True).clamp(min=1e-8) / 127
+            self.register_buffer('q_weight', torch.round(embedding / scale).clamp(-127, 127).to(torch.int8))
+            self.register_buffer('scale', scale)
+        elif quant == 'fp16':
+            self.register_buffer('q_weight', embedding.to(torch.float16))
+            self.register_buffer('scale', None)
+        else:
+            raise ValueError(f'unknown embedding quantization: {quant}')
+
+    @property
+    def weight(self) -> Tensor:
+        if self.scale is None:
+            return self.q_weight.to(torch.float32)
+        return self.q_weight.to(torch.float32) * self.scale
+
+
+def embed(embedding: nn.Module) -> Tensor:
+    '''Return the node features of an embedding layer.
+    A sparse embedding is looked up by node index, so its gradient becomes a sparse tensor
+    instead of the dense gradient of embedding.weight. All nodes are looked up, the sparse gradient covers every row.
+    '''
+    if isinstance(embedding, Tensor):
+        return embedding
+    if embedding.sparse:
+        return embedding(torch.arange(embedding.num_embeddings, device=embedding.weight.device))
+    return embedding.weight
+
+def embedding_nbytes(embedding: Optional[nn.Module]) -> Tuple[int, int]:
+    '''Return the storage size in bytes of an embedding and the size it would have in float32, (0, 0) without an embedding
+    (e.g. Emb_ATT_Layers without a transferred embedding).'''
+    if embedding is None:
+        return 0, 0
+    if isinstance(embedding, QuantizedEmbedding):
+        stored = [embedding.q_weight] if embedding.scale is None else [embedding.q_weight, embedding.scale]
+        return sum(t.numel() * t.element_size() for t in stored), embedding.q_weight.numel() * 4
+    weight = embedding if isinstance(embedding, Tensor) else embedding.weight
+    return weight.numel() * weight.element_size(), weight.numel() * 4
+
+def extend_embedding(embedding: nn.Module, rows: Tensor) -> nn.Module:
+    '''Append rows (for new nodes) to an embedding, keeping its type, storage and trainability. 
+    Works for the 2d embeddings and for the stacked (3d) embedding, where rows are appended along the node dimension.
+    '''
+    if isinstance(embedding, QuantizedEmbedding):
+        return QuantizedEmbedding(torch.cat([embedding.weight, rows.to(embedding.q_weight.device)], dim=-2), embedding.quant)
+    if isinstance(embedding, Tensor):
+        return nn.Parameter(torch.cat([embedding.detach(), rows.to(embedding.device)], dim=-2), requires_grad=embedding.requires_grad)
+    weight = torch.cat([embedding.weight.detach(), rows.to(embedding.weight.device)], dim=-2)
+    return nn.Embedding.from_pretrained(weight, freeze=not embedding.weight.requires_grad, sparse=embedding.sparse)
+
+
+class WeightedRGCNConv(RGCNConv):
+    '''RGCNConv that aggregates the messages per relation with the weighted mean sum(edge_norm * x_j) if edge_norm
+    (see Graph.init_graph) is given, e.g. for deduplicated summary graphs. Without edge_norm it is a plain RGCNConv.
+    The parameters are the ones of RGCNConv, so the weights can be transferred between both.
+    '''
+    def forward(self, x: Tensor, edge_index: Tensor, edge_type: Tensor, edge_norm: Optional[Tensor]=None) -> Tensor:
+        if edge_norm is None:
+            return super().forward(x, edge_index, edge_type)
+        out = x @ self.root + self.bias
+        for i in range(self.num_relations):
+            mask = edge_type == i
+            if not mask.any():
+                continue
+            src, dst = edge_index[:, mask]
+            # the aggregation is linear, the (usually smaller) transformed features are aggregated
+            h = x @ self.weight[i]
+            out = out.index_add(0, dst, h[src] * edge_norm[mask].unsqueeze(1))
+        return out
+
+
+def run(f: Callable, *args, grad_ckpt: bool=False) -> Tensor:
+    '''With grad_ckpt the activations of f are not stored, but recomputed during the backward pass.'''
+    if grad_ckpt and torch.is_grad_enabled():
+        return checkpoint(f, *args, use_reentrant=False)
+    return f(*args)
+
+def rgcn(conv: WeightedRGCNConv, x: Tensor, training_data: Data, grad_ckpt: bool=False) -> Tensor:
+    return run(conv, x, training_data.edge_index, training_data.edge_type, getattr(training_data, 'edge_norm', None), grad_ckpt=grad_ckpt)
+
+def make_embedding(embedding: Tensor, freeze: bool, quant: str, sparse: bool=False) -> nn.Module:
+    '''Frozen embeddings can be stored quantized, trainable embeddings are always kept in float32.'''
+    if freeze and quant != 'none':
+        return QuantizedEmbedding(embedding, quant)
+    return nn.Embedding.from_pretrained(embedding, freeze=freeze, sparse=sparse)
+
+
 class Emb_Layers(nn.Module):
-    def __init__(self, num_relations: int, hidden_l: int, num_labels: int, num_nodes: int, emb_dim: int, _) -> None:
+    # recompute the activations during the backward pass (set by the Trainer)
+    grad_ckpt = False
+
+    def __init__(self, num_relations: int, hidden_l: int, num_labels: int, num_nodes: int, emb_dim: int, _, sparse: bool=False) -> None:
         super(Emb_Layers, self).__init__()
-        self.embedding = nn.Embedding(num_nodes, emb_dim)
-        self.rgcn1 = RGCNConv(in_channels=emb_dim, out_channels=hidden_l, num_relations=num_relations, num_bases=None)
-        self.rgcn2 = RGCNConv(hidden_l, num_labels, num_relations, num_bases=None)
+        self.sparse = sparse
+        self.embedding = nn.Embedding(num_nodes, emb_dim, sparse=sparse)
+        self.rgcn1 = WeightedRGCNConv(in_channels=emb_dim, out_channels=hidden_l, num_relations=num_relations, num_bases=None)
+        self.rgcn2 = WeightedRGCNConv(hidden_l, num_labels, num_relations, num_bases=None)
         nn.init.kaiming_uniform_(self.rgcn1.weight, mode='fan_in')
         nn.init.kaiming_uniform_(self.rgcn2.weight, mode='fan_in')
 
     def forward(self, training_data: Data, activation: Callable) -> Tensor:
-        x = self.rgcn1(self.embedding.weight, training_data.edge_index, training_data.edge_type)
+        x = rgcn(self.rgcn1, embed(self.embedding), training_data, self.grad_ckpt)
         x = F.relu(x)
-        x = self.rgcn2(x, training_data.edge_index, training_data.edge_type)
+        x = rgcn(self.rgcn2, x, training_data, self.grad_ckpt)
         x = activation(x)
         return x
     
     def reset_embedding(self, num_nodes: int, emb_dim: int) -> None:
-        self.embedding = nn.Embedding(num_nodes, emb_dim)
+        self.embedding = nn.Embedding(num_nodes, emb_dim, sparse=self.sparse)
 
-    def load_embedding(self, embedding: Tensor, freeze: bool=True) -> None:
-        self.embedding = nn.Embedding.from_pretrained(embedding, freeze=freeze)
+    def load_embedding(self, embedding: Tensor, freeze: bool=True, quant: str='none') -> None:
+        self.embedding = make_embedding(embedding, freeze, quant, sparse=self.sparse)
 
     def override_params(self, weight_1: Tensor, bias_1: Tensor, root_1: Tensor, weight_2: Tensor, bias_2: Tensor, root_2: Tensor, grad: bool = True) -> None:
         self.rgcn1.weight = torch.nn.Parameter(weight_1)
@@ -47,28 +151,42 @@ class Emb_Layers(nn.Module):
 
 
 class Emb_ATT_Layers(nn.Module):
-    def __init__(self, num_relations: int, hidden_l: int, num_labels: int, _, emb_dim: int, num_embs: int) -> None:
+    # recompute the activations during the backward pass (set by the Trainer)
+    grad_ckpt = False
+
+    def __init__(self, num_relations: int, hidden_l: int, num_labels: int, _, emb_dim: int, num_embs: int, sparse: bool=False) -> None:
+        # the stacked embedding is a plain (dense) parameter, sparse is accepted for a uniform interface only
         super(Emb_ATT_Layers, self).__init__()
         self.embedding = None
         self.att = nn.MultiheadAttention(embed_dim=emb_dim, num_heads=num_embs, dropout=0.2)
-        self.rgcn1 = RGCNConv(in_channels=emb_dim, out_channels=hidden_l, num_relations=num_relations, num_bases=None)
-        self.rgcn2 = RGCNConv(hidden_l, num_labels, num_relations, num_bases=None)
+        self.rgcn1 = WeightedRGCNConv(in_channels=emb_dim, out_channels=hidden_l, num_relations=num_relations, num_bases=None)
+        self.rgcn2 = WeightedRGCNConv(hidden_l, num_labels, num_relations, num_bases=None)
         nn.init.kaiming_uniform_(self.rgcn1.weight, mode='fan_in')
         nn.init.kaiming_uniform_(self.rgcn2.weight, mode='fan_in')
 
     def forward(self, training_data: Data, activation: Callable) -> Tensor:
-        attn_output, att_weights = self.att(self.embedding, self.embedding, self.embedding, average_attn_weights=True)
-        x = attn_output[0]
-        x = self.rgcn1(x, training_data.edge_index, training_data.edge_type)
+        x = run(self.attend, embed(self.embedding), grad_ckpt=self.grad_ckpt)
+        x = rgcn(self.rgcn1, x, training_data, self.grad_ckpt)
         x = F.relu(x)
-        x = self.rgcn2(x, training_data.edge_index, training_data.edge_type)
+        x = rgcn(self.rgcn2, x, training_data, self.grad_ckpt)
         x = activation(x)
         return x
+
+    def attend(self, embedding: Tensor) -> Tensor:
+        # the attention runs in float32 under bfloat16 autocast, the bfloat16 multi_head_attention_forward of torch 2.0
+        # crashes (SIGILL) on CPUs without bfloat16 support
+        with torch.autocast(embedding.device.type, enabled=False):
+            embedding = embedding.float()
+            attn_output, att_weights = self.att(embedding, embedding, embedding, average_attn_weights=True)
+        return attn_output[0]
     
-    def load_embedding(self, embedding: Tensor, freeze: bool=True) -> None:
+    def load_embedding(self, embedding: Tensor, freeze: bool=True, quant: str='none') -> None:
         grad = True
         if freeze == True:
             grad = False
+            if quant != 'none':
+                self.embedding = QuantizedEmbedding(embedding, quant)
+                return
         self.embedding = nn.Parameter(embedding, requires_grad=grad)
 
     def override_params(self, weight_1: Tensor, bias_1: Tensor, root_1: Tensor, weight_2: Tensor, bias_2: Tensor, root_2: Tensor, grad: bool = True) -> None:
@@ -88,31 +206,37 @@ class Emb_ATT_Layers(nn.Module):
 
 
 class Emb_MLP_Layers(nn.Module):
-    def __init__(self, num_relations: int, hidden_l: int, num_labels: int, num_nodes: int, emb_dim: int, num_sums: int):
+    # recompute the activations during the backward pass (set by the Trainer)
+    grad_ckpt = False
+
+    def __init__(self, num_relations: int, hidden_l: int, num_labels: int, num_nodes: int, emb_dim: int, num_sums: int, sparse: bool=False):
         in_f = num_sums * emb_dim
         out_f = round((in_f*(2/3)) + num_labels)
         super(Emb_MLP_Layers, self).__init__()
-        self.embedding = nn.Embedding(num_nodes, emb_dim)
+        self.sparse = sparse
+        self.embedding = nn.Embedding(num_nodes, emb_dim, sparse=sparse)
         self.lin1 = nn.Linear(in_features=in_f, out_features=out_f)
         self.lin2 = nn.Linear(in_features=out_f, out_features=emb_dim)
-        self.rgcn1 = RGCNConv(in_channels=emb_dim, out_channels=hidden_l, num_relations=num_relations, num_bases=None)
-        self.rgcn2 = RGCNConv(hidden_l, num_labels, num_relations, num_bases=None)
+        self.rgcn1 = WeightedRGCNConv(in_channels=emb_dim, out_channels=hidden_l, num_relations=num_relations, num_bases=None)
+        self.rgcn2 = WeightedRGCNConv(hidden_l, num_labels, num_relations, num_bases=None)
         nn.init.kaiming_uniform_(self.lin1.weight, mode='fan_in')
         nn.init.kaiming_uniform_(self.lin2.weight, mode='fan_in')
         nn.init.kaiming_uniform_(self.rgcn1.weight, mode='fan_in')
         nn.init.kaiming_uniform_(self.rgcn2.weight, mode='fan_in')
 
     def forward(self, training_data: Data, activation: Callable, save=False) -> Tensor:
-        x = torch.tanh(self.lin1(self.embedding.weight))
-        x = self.lin2(x)
-        x = self.rgcn1(x, training_data.edge_index, training_data.edge_type)
+        x = run(self.project, embed(self.embedding), grad_ckpt=self.grad_ckpt)
+        x = rgcn(self.rgcn1, x, training_data, self.grad_ckpt)
         x = F.relu(x)
-        x = self.rgcn2(x, training_data.edge_index, training_data.edge_type)
+        x = rgcn(self.rgcn2, x, training_data, self.grad_ckpt)
         x = activation(x)
         return x
+
+    def project(self, embedding: Tensor) -> Tensor:
+        return self.lin2(torch.tanh(self.lin1(embedding)))
     
-    def load_embedding(self, embedding: Tensor, freeze: bool=True) -> None:
-        self.embedding = nn.Embedding.from_pretrained(embedding, freeze=freeze)
+    def load_embedding(self, embedding: Tensor, freeze: bool=True, quant: str='none') -> None:
+        self.embedding = make_embedding(embedding, freeze, quant, sparse=self.sparse)
 
     def override_params(self, weight_1: Tensor, bias_1: Tensor, root_1: Tensor, weight_2: Tensor, bias_2: Tensor, root_2: Tensor, grad: bool = True) -> None:
         self.rgcn1.weight = torch.nn.Parameter(weight_1)
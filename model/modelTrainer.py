@@ -1,27 +1,75 @@
+import time
 import torch
 
 from collections import defaultdict
-from torch import nn
-from typing import List, Tuple, Callable, Union, Dict
+from copy import deepcopy
+from torch import nn, Tensor
+from torch.profiler import record_function
+from typing import List, Tuple, Callable, Union, Dict, Optional
 
-from graphs.graph import Graph
+from graphs.graph import Graph, edge_norm
 from graphs.dataset import Dataset
-from model.layers import Emb_Layers
+from graphs.ntParser import encode_lines
+from graphs.graphProcessing import map_new_nodes, nodes2type_mapping, encode_org_node_labels, disjoint_union
+from model.layers import Emb_Layers, QuantizedEmbedding, extend_embedding
 from model.evaluation import evaluate, get_losst
 from model.embeddingTricks import sum_embeddings
-from helpers.vizEmb import main_viz_emb
+from helpers.vizEmb import embedding_path, save_embedding, start_viz_emb
+from helpers.checkpoint import Checkpoint
+from helpers.metricsLog import MetricsLog
+from helpers.profiling import EpochProfiler
+from helpers.threadTuner import set_threads
+
+
+class DecayedSparseAdam(torch.optim.SparseAdam):
+    '''SparseAdam with the (L2) weight decay of Adam, applied to the rows that are in the sparse gradient.'''
+    def __init__(self, params: List[Tensor], lr: float, weight_decay: float=0.0) -> None:
+        super().__init__(params, lr=lr)
+        for group in self.param_groups:
+            group['weight_decay'] = weight_decay
+
+    @torch.no_grad()
+    def step(self, closure: Optional[Callable]=None) -> Optional[float]:
+        for group in self.param_groups:
+            if group['weight_decay'] == 0:
+                continue
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                grad = p.grad.coalesce()
+                rows = grad.indices()[0]
+                p.grad = torch.sparse_coo_tensor(grad.indices(), grad.values() + group['weight_decay'] * p[rows], grad.shape)
+        return super().step(closure)
 
 
 class Trainer:
     device = torch.device(str('cuda:0') if torch.cuda.is_available() else 'cpu')
-    def __init__(self, data: Dataset, hidden_l: int, epochs: int, emb_dim: int, lr: float, weight_d: float):
+    def __init__(self, data: Dataset, hidden_l: int, epochs: int, emb_dim: int, lr: float, weight_d: float, sparse_emb: bool=False,
+                 checkpoint: Optional[Checkpoint]=None, iteration: int=0, metrics_log: Optional[MetricsLog]=None, profiler: Optional[EpochProfiler]=None,
+                 grad_ckpt: bool=False, lean_agg: bool=False, bf16: bool=False, threads: Optional[Dict[str, int]]=None):
         self.data: Dataset = data
         self.hidden_l: int = hidden_l
         self.epochs: int = epochs
         self.emb_dim: int = emb_dim
         self.lr: float = lr
         self.weight_d: float = weight_d
+        self.sparse_emb: bool = sparse_emb
         self.sumModel: nn.Module = None
+        # with a checkpoint, training units of this iteration are stored and resumed
+        self.checkpoint: Optional[Checkpoint] = checkpoint
+        self.iteration: int = iteration
+        # per epoch metrics are streamed to the metrics log
+        self.metrics_log: Optional[MetricsLog] = metrics_log
+        # the selected epochs of every training unit are profiled on operator level
+        self.profiler: Optional[EpochProfiler] = profiler
+        # memory saving execution (see helpers/memoryPlanner.py): the original graph is aggregated edge-wise (like the weighted 
+        # summary graphs) instead of per relation and node, activations are recomputed in the backward pass and the forward pass 
+        # runs in bfloat16 autocast (the stored activations of the matrix products are half the size)
+        self.lean_agg: bool = lean_agg
+        self.grad_ckpt: bool = grad_ckpt
+        self.bf16: bool = bf16
+        # torch threads per stage (summary, original) from the thread profile (see helpers/threadTuner.py)
+        self.threads: Dict[str, int] = threads if threads is not None else dict()
 
     def transfer_weights(self, orgModel: nn.Module, grad: bool) -> None:
         # rgcn1 
@@ -37,49 +85,145 @@ class Trainer:
         # transfer
         orgModel.override_params(weight_sg_1, bias_sg_1, root_sg_1, weight_sg_2, bias_sg_2, root_sg_2, grad)
         print('weight transfer done')
+
+    def get_optimizers(self, model: nn.Module) -> List[torch.optim.Optimizer]:
+        '''Trainable sparse embeddings are updated with SparseAdam (with the weight decay of Adam), all other parameters with Adam.
+        SparseAdam keeps dense optimizer states for the whole embedding and every row is touched in a (full-graph) epoch,
+        so this saves no memory.
+        '''
+        sparse_params = [p for m in model.modules() if isinstance(m, nn.Embedding) and m.sparse for p in m.parameters() if p.requires_grad]
+        sparse_ids = {id(p) for p in sparse_params}
+        dense_params = [p for p in model.parameters() if id(p) not in sparse_ids]
+        optimizers = [torch.optim.Adam(dense_params, lr=self.lr, weight_decay=self.weight_d)]
+        if sparse_params:
+            optimizers.append(DecayedSparseAdam(sparse_params, lr=self.lr, weight_decay=self.weight_d))
+        return optimizers
     
-    def train(self, model: nn.Module, graph: Graph, loss_f: Callable, activation: Callable, sum_graph: bool=True) -> Tuple[List[float]]:
+    def train(self, model: nn.Module, graph: Graph, loss_f: Callable, activation: Callable, sum_graph: bool=True, unit: Optional[str]=None) -> Tuple[List[float]]:
         model = model.to(self.device)
+        model.grad_ckpt = self.grad_ckpt
+        set_threads(self.threads.get('summary' if sum_graph else 'original'))
         training_data = graph.training_data.to(self.device)
-        optimizer = torch.optim.Adam(model.parameters(), lr=self.lr, weight_decay=self.weight_d)
+        optimizers = self.get_optimizers(model)
 
         accuracies: list = []
         losses: list = []
         f1_ws: list = []
         f1_ms: list = []
+
+        checkpoint = self.checkpoint if unit is not None else None
+        start = 0
+        if checkpoint is not None:
+            start, metrics = checkpoint.load_training(unit, model, optimizers)
+            if metrics is not None:
+                accuracies, losses, f1_ws, f1_ms = metrics
         
-        for epoch in range(self.epochs):
+        for epoch in range(start, self.epochs):
+            epoch_start = time.perf_counter()
+            record = dict()
+            prof = self.profiler.start(epoch) if self.profiler is not None else None
 
             if not sum_graph:
                 model.eval()
-                acc, f1_w, f1_m = evaluate(model, activation, training_data, training_data.x_val, training_data.y_val)
+                with record_function('evaluate'):
+                    acc, f1_w, f1_m = evaluate(model, activation, training_data, training_data.x_val, training_data.y_val)
                 print(f'Accuracy on validation set = {acc}')  
                 accuracies.append(acc)
                 f1_ws.append(f1_w)
                 f1_ms.append(f1_m)
+                record = {'accuracy': float(acc), 'f1 weighted': float(f1_w), 'f1 macro': float(f1_m)}
             
+            step_start = time.perf_counter()
             model.train()
-            optimizer.zero_grad()
-            out = model(training_data, activation)
-            targets = training_data.y_train.to(torch.float32)
-            output = loss_f(out[training_data.x_train], targets)
-            output.backward()
-            optimizer.step()
+            for optimizer in optimizers:
+                optimizer.zero_grad()
+            with record_function('forward'), torch.autocast(self.device.type, dtype=torch.bfloat16, enabled=self.bf16):
+                out = model(training_data, activation)
+                targets = training_data.y_train.to(torch.float32)
+                output = loss_f(out[training_data.x_train], targets)
+            with record_function('backward'):
+                output.backward()
+            with record_function('optimizer step'):
+                for optimizer in optimizers:
+                    optimizer.step()
             l = output.item()
             losses.append(l)
+            if self.metrics_log is not None:
+                end = time.perf_counter()
+                self.metrics_log.write({'type': 'epoch', 'stage': 'summary' if sum_graph else 'original', 'unit': unit, 'graph': graph.name,
+                                        'iteration': self.iteration, 'epoch': epoch, 'loss': l, **record, 'epoch seconds': end - epoch_start,
+                                        'edges/sec': training_data.edge_index.size(1) / max(end - step_start, 1e-9)})
+            # stopped after the epoch is timed, exporting the trace is not part of the epoch seconds
+            if prof is not None:
+                self.profiler.stop(prof, unit if unit is not None else graph.name, 'summary' if sum_graph else 'original', epoch)
             if epoch%10==0:
                 l = output.item()
                 print(f'Epoch: {epoch}, Loss: {l:.4f}')
+            if checkpoint is not None and checkpoint.every > 0 and (epoch+1)%checkpoint.every==0 and epoch+1 < self.epochs:
+                checkpoint.save_training(unit, epoch, model, optimizers, (accuracies, losses, f1_ws, f1_ms))
     
         return accuracies, losses, f1_ws, f1_ms
 
+    def summary_state(self, done: Optional[int]=None) -> Dict[str, Union[Dict[str, Tensor], List[Tensor]]]:
+        '''the summary model and the embeddings of the (first done) pre-trained summary graphs'''
+        return {'model': self.sumModel.state_dict(), 'embeddings': [g.embedding.detach() for g in self.data.sumGraphs[:done]]}
+
+    def load_summary_state(self, state: Dict[str, Union[Dict[str, Tensor], List[Tensor]]]) -> int:
+        '''restore the summary model and embeddings (see summary_state), returns the number of pre-trained summary graphs'''
+        num_nodes = state['model']['embedding.weight'].shape[0]
+        self.sumModel = Emb_Layers(2*len(self.data.sumGraphs[0].relations.keys())+1, self.hidden_l, self.data.num_classes, num_nodes, self.emb_dim, len(self.data.sumGraphs), sparse=self.sparse_emb)
+        self.sumModel.load_state_dict(state['model'])
+        self.sumModel = self.sumModel.to(self.device)
+        for sumGraph, embedding in zip(self.data.sumGraphs, state['embeddings']):
+            sumGraph.embedding = embedding.to(self.device)
+        return len(state['embeddings'])
+
+    def save_summaries(self, unit: str, done: int) -> None:
+        if self.checkpoint is None:
+            return
+        self.checkpoint.save(unit, self.summary_state(done))
+        for k in range(done):
+            self.checkpoint.remove(f'{unit}{k}_train')
+
+    def restore_summaries(self, unit: str) -> int:
+        '''restore the summary model and embeddings of a previous (interrupted) run, returns the number of pre-trained summary graphs'''
+        state = self.checkpoint.load(unit) if self.checkpoint is not None else None
+        if state is None:
+            return 0
+        done = self.load_summary_state(state)
+        print(f'restored {done} pre-trained summary graph(s) from the checkpoint')
+        return done
+
     def train_summaries(self, configs: Dict[str, Union[bool, str, int, float]]) -> None:
+        if configs['sum_batch']:
+            self.train_summaries_batched(configs)
+            return
         loss_f, activation = get_losst(configs['dataset'], sumModel=True)
-        self.sumModel = Emb_Layers(2*len(self.data.sumGraphs[0].relations.keys())+1, self.hidden_l, self.data.num_classes, self.data.sumGraphs[0].num_nodes, self.emb_dim, len(self.data.sumGraphs))
-        for sumGraph in self.data.sumGraphs:
+        self.sumModel = Emb_Layers(2*len(self.data.sumGraphs[0].relations.keys())+1, self.hidden_l, self.data.num_classes, self.data.sumGraphs[0].num_nodes, self.emb_dim, len(self.data.sumGraphs), sparse=self.sparse_emb)
+        unit = f'i{self.iteration}_sum'
+        done = self.restore_summaries(unit)
+        for k, sumGraph in enumerate(self.data.sumGraphs[done:], done):
             self.sumModel.reset_embedding(sumGraph.num_nodes, self.emb_dim)
-            _, _, _, _ = self.train(self.sumModel, sumGraph, loss_f, activation, sum_graph=True)
+            _, _, _, _ = self.train(self.sumModel, sumGraph, loss_f, activation, sum_graph=True, unit=f'{unit}{k}')
             sumGraph.embedding = self.sumModel.embedding.weight.clone()
+            self.save_summaries(unit, k+1)
+
+    def train_summaries_batched(self, configs: Dict[str, Union[bool, str, int, float]]) -> None:
+        '''Train on all summary graphs jointly, packed as one disjoint-union graph. 
+        Every summary graph has its own block of rows in the embedding, the R-GCN weights are shared.
+        Afterwards the embedding of every summary graph is stored in sumGraph.embedding.
+        '''
+        loss_f, activation = get_losst(configs['dataset'], sumModel=True)
+        union, offsets = disjoint_union(self.data.sumGraphs, 'summary graphs')
+        self.sumModel = Emb_Layers(2*len(self.data.sumGraphs[0].relations.keys())+1, self.hidden_l, self.data.num_classes, union.num_nodes, self.emb_dim, len(self.data.sumGraphs), sparse=self.sparse_emb)
+        unit = f'i{self.iteration}_sum'
+        if self.restore_summaries(unit) == len(self.data.sumGraphs):
+            return
+        _, _, _, _ = self.train(self.sumModel, union, loss_f, activation, sum_graph=True, unit=f'{unit}0')
+        weight = self.sumModel.embedding.weight
+        for sumGraph, offset in zip(self.data.sumGraphs, offsets):
+            sumGraph.embedding = weight[offset:offset+sumGraph.num_nodes].clone()
+        self.save_summaries(unit, len(self.data.sumGraphs))
     
     def train_original(self, org_layers: nn.Module, embedding_trick: Callable,
                         configs: Dict[str, Union[bool, str, int, float]], exp: str) -> Tuple[Union[List[float], float,  nn.Module]]:
@@ -89,15 +233,16 @@ class Trainer:
         f1_w = defaultdict(list)
         f1_m = defaultdict(list)
 
-        orgModel = org_layers(2*len(self.data.orgGraph.relations.keys())+1, self.hidden_l, self.data.num_classes, self.data.orgGraph.num_nodes, self.emb_dim, configs['num_sums'])
+        orgModel = org_layers(2*len(self.data.orgGraph.relations.keys())+1, self.hidden_l, self.data.num_classes, self.data.orgGraph.num_nodes, self.emb_dim, configs['num_sums'], sparse=self.sparse_emb)
         
         if exp != 'baseline' and configs['e_trans'] == True:
             embedding = embedding_trick(self.data.orgGraph, self.data.sumGraphs, self.emb_dim)
-            orgModel.load_embedding(embedding, freeze=configs["e_freeze"])
+            orgModel.load_embedding(embedding, freeze=configs["e_freeze"], quant=configs['e_quant'])
 
             if embedding_trick == sum_embeddings and configs["e_viz"]:
-                torch.save(embedding, f'./results/embeddings/{configs["dataset"]}_{configs["sum"]}_embedding.pt')
-                main_viz_emb(configs["dataset"], configs["sum"])
+                # visualized by a separate process, training continues
+                save_embedding(embedding, self.data.orgGraph, self.data.sumGraphs, embedding_path(configs["dataset"], configs["sum"]))
+                start_viz_emb(configs["dataset"], configs["sum"])
         
             print('Loaded pre trained embedding')
 
@@ -105,12 +250,105 @@ class Trainer:
             self.transfer_weights(orgModel, configs['w_grad'])
 
         loss_f, activation = get_losst(configs['dataset'], sumModel=False)
-        
-        print('Training on Orginal Graph...')
-        acc[f'accuracy'], loss[f'loss'], f1_w[f'f1 weighted'], f1_m[f'f1 macro'] = self.train(orgModel, self.data.orgGraph, loss_f, activation, sum_graph=False)
+        training_data = self.data.orgGraph.training_data
+        lean = self.lean_agg and getattr(training_data, 'edge_norm', None) is None
+        if lean:
+            # every edge of the original graph has multiplicity 1, the weighted mean is the mean
+            training_data.edge_norm = edge_norm(training_data.edge_index, training_data.edge_type, torch.ones(training_data.edge_type.size(0)))
+        try:
+            print('Training on Orginal Graph...')
+            acc[f'accuracy'], loss[f'loss'], f1_w[f'f1 weighted'], f1_m[f'f1 macro'] = self.train(orgModel, self.data.orgGraph, loss_f, activation, sum_graph=False, unit=f'i{self.iteration}_{exp}')
 
-        # evaluate on Test set
-        test_acc, test_f1_weighted, test_f1_macro = evaluate(orgModel, activation, self.data.orgGraph.training_data, self.data.orgGraph.training_data.x_test, self.data.orgGraph.training_data.y_test, report=True)
+            # evaluate on Test set
+            test_acc, test_f1_weighted, test_f1_macro = evaluate(orgModel, activation, self.data.orgGraph.training_data, self.data.orgGraph.training_data.x_test, self.data.orgGraph.training_data.y_test, report=True)
+        finally:
+            if lean:
+                # the dataset is shared by the experiments, iterations and sweep points, only this run aggregates edge-wise
+                del training_data.edge_norm
         print('ACC ON TEST SET = ',  test_acc)
+        if self.metrics_log is not None:
+            self.metrics_log.write({'type': 'test', 'exp': exp, 'iteration': self.iteration, 'Test acc': float(test_acc),
+                                    'Test F1 weighted': float(test_f1_weighted), 'Test F1 macro': float(test_f1_macro)})
     
         return acc, loss, f1_w, f1_m, test_acc, test_f1_weighted, test_f1_macro, orgModel
+
+    def add_entities(self, orgModel: nn.Module, graph_triples: List[str], embedding_trick: Callable,
+                        configs: Dict[str, Union[bool, str, int, float]], exp: str) -> Tuple[Graph, List[str]]:
+        '''Inductive path for entities that are not in the original graph, without retraining.
+        The new entities and their edges are added to a copy of the original graph. The new entities are mapped
+        to the attribute summary nodes that match their properties and the embedding rows are constructed from the
+        trained summary embeddings with the embedding trick of the experiment. The embedding of orgModel is extended with these rows.
+        With configs['new_epochs'] > 0 only the new rows are fine-tuned afterwards.
+        Return:
+            graph with the new entities, new entities
+        '''
+        graph = deepcopy(self.data.orgGraph)
+        new_nodes = graph.add_nodes(graph_triples, self.data.relation_map)
+        new_graph = Graph('new entities', dict())
+        new_graph.num_nodes = len(new_nodes)
+        new_graph.node_to_enum = {node: i for i, node in enumerate(new_nodes)}
+
+        if exp != 'baseline' and configs['e_trans'] == True:
+            sum_graphs = map_new_nodes(self.data.sumGraphs, graph_triples, new_nodes)
+            rows = embedding_trick(new_graph, sum_graphs, self.emb_dim)
+        else:
+            rows = torch.randn(len(new_nodes), self.emb_dim)
+        orgModel.embedding = extend_embedding(orgModel.embedding, rows)
+        graph.training_data = graph.training_data.to(self.device)
+        print(f'added {len(new_nodes)} new entities to the {exp} model')
+
+        if configs['new_epochs'] > 0:
+            # new entities with a known type are added to the training nodes
+            classes = list(self.data.enum_classes.keys())
+            new_types = nodes2type_mapping(*encode_lines(graph_triples), classes)
+            new_labels = encode_org_node_labels({node: new_types[node] for node in new_nodes if new_types[node]}, self.data.enum_classes, self.data.num_classes)
+            x = torch.tensor([graph.node_to_enum[node] for node in new_labels.keys()], dtype=torch.long)
+            y = torch.tensor(list(new_labels.values()), dtype=torch.long).reshape(-1, self.data.num_classes)
+            graph.training_data.x_train = torch.cat([graph.training_data.x_train, x.to(self.device)])
+            graph.training_data.y_train = torch.cat([graph.training_data.y_train, y.to(self.device)])
+            self.finetune_new_rows(orgModel, graph, len(new_nodes), configs)
+        return graph, new_nodes
+
+    def finetune_new_rows(self, model: nn.Module, graph: Graph, num_new: int, configs: Dict[str, Union[bool, str, int, float]]) -> None:
+        '''Train only the last num_new rows of the embedding, all other parameters (and embedding rows) are kept fixed.'''
+        if isinstance(model.embedding, QuantizedEmbedding):
+            print('a quantized embedding can not be fine-tuned, skipping fine-tuning of the new entities')
+            return
+        weight = model.embedding if isinstance(model.embedding, Tensor) else model.embedding.weight
+        requires_grad = {name: p.requires_grad for name, p in model.named_parameters()}
+        for p in model.parameters():
+            p.requires_grad = False
+        weight.requires_grad = True
+
+        first_new = weight.shape[-2] - num_new
+        mask = torch.zeros(weight.shape[-2], 1, device=weight.device)
+        mask[first_new:] = 1.0
+
+        def mask_grad(grad: Tensor) -> Tensor:
+            if grad.is_sparse:
+                grad = grad.coalesce()
+                keep = grad.indices()[0] >= first_new
+                return torch.sparse_coo_tensor(grad.indices()[:, keep], grad.values()[keep], grad.shape)
+            return grad * mask
+
+        hook = weight.register_hook(mask_grad)
+        if getattr(model.embedding, 'sparse', False):
+            optimizer = torch.optim.SparseAdam([weight], lr=self.lr)
+        else:
+            optimizer = torch.optim.Adam([weight], lr=self.lr)
+        loss_f, activation = get_losst(configs['dataset'], sumModel=False)
+        training_data = graph.training_data
+
+        for epoch in range(configs['new_epochs']):
+            model.train()
+            optimizer.zero_grad()
+            out = model(training_data, activation)
+            output = loss_f(out[training_data.x_train], training_data.y_train.to(torch.float32))
+            output.backward()
+            optimizer.step()
+            if epoch%10==0:
+                print(f'Fine-tune epoch: {epoch}, Loss: {output.item():.4f}')
+
+        hook.remove()
+        for name, p in model.named_parameters():
+            p.requires_grad = requires_grad[name]
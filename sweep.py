@@ -0,0 +1,207 @@
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+
+from graphs.dataset import Dataset
+from graphs.ntParser import find_nt
+from helpers import timing
+from helpers.checks import do_checks
+from helpers.results import Results
+from helpers.threadTuner import available_cores, pin_worker, set_parse_workers, set_threads, stage_settings
+from main import get_experiments, get_parser
+from model.modelTrainer import Trainer
+
+"""This file runs a hyperparameter sweep. The dataset is loaded once and shared with the (forked) workers.
+Summary graph pre-training depends on SUM_PARAMS only, sweep points that share these hyperparameters share the pre-trained
+summary models. The sweep is specified in a json file, either as a grid:
+    {"mode": "grid", "params": {"lr": [0.01, 0.001], "hl": [16, 32], "exp": ["summation", "attention"]}}
+or as a random search with n points:
+    {"mode": "random", "n": 20, "seed": 0, "params": {"lr": {"min": 0.0001, "max": 0.1, "log": true}, "hl": [8, 16, 32]}}
+Every other argument of main.py sets the value for all points, e.g. summary pre-training with a fixed learning rate:
+    python sweep.py -dataset AIFB -sum attr -spec sweep.json -sum_lr 0.01 -workers 2 -i 3
+A comparative report of all points (ranked by validation accuracy) is written to ./results/{dataset}_sweep_{sum}_{date}.
+"""
+
+# hyperparameters of summary graph pre-training
+SUM_PARAMS = ['hl', 'emb', 'sum_lr', 'sum_epochs', 'sum_batch', 'e_sparse', 'bf16']
+# the dataset (and the thread profile) is loaded once from these arguments, they are the same for all points
+LOAD_PARAMS = ['dataset', 'sum', 'i', 'rel_min', 'rel_topk', 'sum_topk', 'sum_min_score', 'sum_max_ratio', 'sum_budget', 'tuned_threads']
+# not supported in sweeps
+RUN_ONLY = ['save_model', 'new_entities', 'checkpoint', 'resume', 'e_viz', 'create_attr_sum', 'plot', 'profile', 'profile_epochs', 'profile_top', 'mem_budget']
+
+Configs = Dict[str, Union[bool, str, int, float]]
+
+# set before the worker pools are forked, so the workers share them without pickling
+DATA: Dataset = None
+EXPERIMENTS = get_experiments()
+SUM_STATES: Dict[Tuple, dict] = dict()
+# torch threads per stage from the thread profile of the dataset (see helpers/threadTuner.py)
+THREADS: Dict[str, int] = dict()
+
+def sample(space: Union[list, dict], rng: random.Random) -> Union[bool, str, int, float]:
+    if isinstance(space, list):
+        return rng.choice(space)
+    low, high = space['min'], space['max']
+    value = math.exp(rng.uniform(math.log(low), math.log(high))) if space.get('log', False) else rng.uniform(low, high)
+    return int(round(value)) if space.get('int', False) else value
+
+def make_points(spec: dict, base: Configs) -> List[Dict[str, Union[bool, str, int, float]]]:
+    params = spec['params']
+    for name in params:
+        assert name in base and name not in RUN_ONLY, f'{name} can not be swept'
+        assert name not in LOAD_PARAMS, f'{name} is used to load the dataset and can not be swept, run a sweep per value'
+    if spec.get('mode', 'grid') == 'grid':
+        names = list(params.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*[params[name] for name in names])]
+    rng = random.Random(spec.get('seed', 0))
+    return [{name: sample(space, rng) for name, space in params.items()} for _ in range(spec['n'])]
+
+def point_configs(base: Configs, point: Dict[str, Union[bool, str, int, float]], sum_path: str, map_path: str) -> Configs:
+    configs = {**base, **point}
+    configs['sum_lr'] = configs['lr'] if configs['sum_lr'] is None else configs['sum_lr']
+    configs['sum_epochs'] = configs['epochs'] if configs['sum_epochs'] is None else configs['sum_epochs']
+    configs, _ = do_checks(configs, sum_path, map_path, DATA.sum_files)
+    return configs
+
+def experiment_names(configs: Configs) -> List[str]:
+    return [configs['exp']] if configs['exp'] is not None else ['summation', 'mlp', 'attention']
+
+def sum_key(configs: Configs, iteration: int) -> Tuple:
+    return tuple(configs[name] for name in SUM_PARAMS) + (iteration,)
+
+def init_worker(counter, workers: int) -> None:
+    # every worker runs on its own cores, the threads of the Trainer stages are limited to them
+    pin_worker(counter, workers)
+    set_threads(available_cores())
+
+def pretrain(task: Tuple[Configs, int]) -> Tuple[Tuple, dict, float]:
+    configs, iteration = task
+    start = time.perf_counter()
+    trainer = Trainer(DATA, configs['hl'], configs['sum_epochs'], configs['emb'], configs['sum_lr'], weight_d=0.00005, sparse_emb=configs['e_sparse'],
+                      grad_ckpt=configs['grad_ckpt'], lean_agg=configs['lean_agg'], bf16=configs['bf16'], threads=THREADS)
+    trainer.train_summaries(configs)
+    return sum_key(configs, iteration), trainer.summary_state(), time.perf_counter() - start
+
+def train_point(task: Tuple[int, Configs, str, int]) -> Tuple[int, Results, float]:
+    point, configs, exp, iteration = task
+    start = time.perf_counter()
+    trainer = Trainer(DATA, configs['hl'], configs['epochs'], configs['emb'], configs['lr'], weight_d=0.00005, sparse_emb=configs['e_sparse'],
+                      grad_ckpt=configs['grad_ckpt'], lean_agg=configs['lean_agg'], bf16=configs['bf16'], threads=THREADS)
+    if exp != 'baseline':
+        trainer.load_summary_state(SUM_STATES[sum_key(configs, iteration)])
+    results = Results()
+    results.add_key(exp)
+    acc, loss, f1_w, f1_m, test_acc, test_f1_w, test_f1_m, orgModel = trainer.train_original(EXPERIMENTS[exp]['org_layers'], EXPERIMENTS[exp]['embedding_trick'], configs, exp)
+    for result in [acc, loss, f1_w, f1_m]:
+        results.update_run_results(result, exp)
+    results.test_accs[f'Test acc {exp}'].append(test_acc)
+    results.test_f1_weighted[f'Test F1 weighted {exp}'].append(test_f1_w)
+    results.test_f1_macro[f'Test F1 macro {exp}'].append(test_f1_m)
+    results.add_embedding_memory(orgModel, exp)
+    return point, results, time.perf_counter() - start
+
+def run_tasks(f, tasks: list, workers: int) -> list:
+    if workers == 1:
+        return [f(task) for task in tasks]
+    context = multiprocessing.get_context('fork')
+    with context.Pool(workers, initializer=init_worker, initargs=(context.Value('i', 0), workers)) as pool:
+        return list(pool.imap_unordered(f, tasks))
+
+def write_report(path: str, base: Configs, points: List[dict], results: List[Results], seconds: List[float], pretrain_seconds: List[float]) -> List[dict]:
+    rows = []
+    for point, point_results, point_seconds, point_pretrain_seconds in zip(points, results, seconds, pretrain_seconds):
+        point_results.make_av_run_results()
+        max_results, test_results = point_results.max_run_results(), point_results.test_results()
+        for exp in point_results.run_results.keys():
+            row = {**point, 'exp': exp,
+                   'val acc': max_results[exp]['accuracy']['max'], 'val acc epoch': max_results[exp]['accuracy']['epoch'],
+                   'test acc': test_results[f'Test acc {exp}']['mean'], 'test acc std': test_results[f'Test acc {exp}']['std'],
+                   'test f1 weighted': test_results[f'Test F1 weighted {exp}']['mean'], 'test f1 macro': test_results[f'Test F1 macro {exp}']['mean'],
+                   'train seconds': round(point_seconds, 2), 'pre-train seconds (shared)': round(point_pretrain_seconds, 2)}
+            rows.append(row)
+    # rank by validation accuracy, the test scores are reported only
+    rows.sort(key=lambda row: row['val acc'], reverse=True)
+
+    os.mkdir(path)
+    with open(f'{path}/sweep_report.json', 'w') as f:
+        json.dump({'configs': base, 'points': rows}, f, indent=4, default=str)
+    columns = list(dict.fromkeys(k for row in rows for k in row.keys()))
+    with open(f'{path}/sweep_report.csv', 'w') as f:
+        f.write(','.join(columns) + '\n')
+        for row in rows:
+            f.write(','.join(str(row.get(column, '')) for column in columns) + '\n')
+    return rows
+
+def run_sweep(base: Configs, spec: dict, org_path: str, sum_path: str, map_path: str, workers: int) -> List[dict]:
+    global DATA, SUM_STATES, THREADS
+    if base['tuned_threads']:
+        THREADS = stage_settings(base['dataset'], base['sum'])
+        set_parse_workers(THREADS.get('parse'))
+    timing.log('Making Graph data...')
+    sum_select = None
+    if any(base[k] is not None for k in ['sum_topk', 'sum_min_score', 'sum_max_ratio', 'sum_budget']):
+        sum_select = {'top_k': base['sum_topk'], 'min_score': base['sum_min_score'], 'max_ratio': base['sum_max_ratio'], 'budget': base['sum_budget']}
+    DATA = Dataset(org_path, sum_path, map_path, base['rel_min'], base['rel_topk'], sum_select)
+    DATA.init_dataset()
+
+    points = make_points(spec, base)
+    configs = [point_configs(base, point, sum_path, map_path) for point in points]
+
+    # one pre-training per distinct summary hyperparameters and iteration
+    pretrain_tasks = dict()
+    for point_config in configs:
+        if any(exp != 'baseline' for exp in experiment_names(point_config)):
+            for iteration in range(base['i']):
+                pretrain_tasks.setdefault(sum_key(point_config, iteration), (point_config, iteration))
+    train_tasks = [(p, point_config, exp, iteration) for p, point_config in enumerate(configs) for exp in experiment_names(point_config) for iteration in range(base['i'])]
+    print(f'{len(points)} sweep points: {len(pretrain_tasks)} summary pre-trainings and {len(train_tasks)} original graph trainings on {workers} worker(s)')
+
+    timing.log('Pre-training on summary graphs...')
+    pretrain_seconds = dict()
+    for key, state, seconds in run_tasks(pretrain, list(pretrain_tasks.values()), workers):
+        SUM_STATES[key] = state
+        pretrain_seconds[key] = seconds
+
+    timing.log('Training on original graph...')
+    results = [Results() for _ in points]
+    seconds = [0.0 for _ in points]
+    for p, point_results, train_seconds in run_tasks(train_point, train_tasks, workers):
+        results[p].merge(point_results)
+        seconds[p] += train_seconds
+
+    # report the values the points were trained with (e.g. emb is adjusted to the number of summary graphs)
+    points = [{name: point_config[name] for name in point} for point, point_config in zip(points, configs)]
+    point_pretrain_seconds = [sum(pretrain_seconds.get(sum_key(point_config, iteration), 0.0) for iteration in range(base['i'])) for point_config in configs]
+    path = f'./results/{base["dataset"]}_sweep_{base["sum"]}_{datetime.now().strftime("%d%B%Y-%H%M%S")}'
+    rows = write_report(path, base, points, results, seconds, point_pretrain_seconds)
+    timing.log(f'Sweep done, report saved to {path}')
+    for row in rows[:10]:
+        print(row)
+    return rows
+
+
+if __name__=='__main__':
+    parser = get_parser()
+    parser.add_argument('-spec', type=str, required=True, help='json file with the sweep specification (grid or random)')
+    parser.add_argument('-workers', type=int, default=1, help='max number of concurrent trainings')
+    parser.add_argument('-sum_lr', type=float, default=None, help='learning rate of summary graph pre-training (default: -lr of the point)')
+    parser.add_argument('-sum_epochs', type=int, default=None, help='epochs of summary graph pre-training (default: -epochs of the point)')
+    configs = vars(parser.parse_args())
+    timing.begin()
+    workers = configs.pop('workers')
+    with open(configs.pop('spec'), 'r') as f:
+        spec = json.load(f)
+
+    dataset = configs['dataset']
+    path = find_nt(f'graphs/{dataset}/{dataset}_complete.nt')
+    sum_path = f'graphs/{dataset}/{configs["sum"]}/sum/'
+    map_path = f'graphs/{dataset}/{configs["sum"]}/map/'
+
+    run_sweep(configs, spec, path, sum_path, map_path, workers)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import the packages of the repository root (graphs, helpers, model), like the scripts that are run from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
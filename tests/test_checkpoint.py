@@ -0,0 +1,87 @@
+import pytest
+import torch
+
+from graphs.graph import Graph
+from graphs.ntParser import encode_lines
+from helpers.checkpoint import Checkpoint
+from model.evaluation import get_losst
+from model.embeddingTricks import sum_embeddings
+from model.layers import Emb_ATT_Layers, Emb_Layers
+from model.modelTrainer import Trainer
+
+CONFIGS = {'dataset': 'TEST', 'hl': 4, 'emb': 6, 'epochs': 6}
+EPOCHS = 6
+EVERY = 2
+
+class Interrupted(Exception):
+    pass
+
+def make_graph():
+    graph = Graph('test', dict())
+    terms, triples = encode_lines(['<a> <p> <b> .', '<b> <p> <c> .', '<c> <q> <a> .', '<d> <q> <b> .', '<d> <p> <a> .'])
+    graph.init_graph(terms, triples)
+    graph.training_data.x_train = torch.tensor([0, 1, 3])
+    graph.training_data.y_train = torch.tensor([[1, 0], [0, 1], [1, 1]])
+    return graph
+
+def summary_graph():
+    # <a> and <b> are summarized, <c> and <d> are not mapped and get random rows in the transferred embedding
+    sum_graph = Graph('summary', dict())
+    sum_graph.node_to_enum = {'<s1>': 0, '<s2>': 1}
+    sum_graph.orgNode2sumNode_dict = {'<a>': '<s1>', '<b>': '<s2>'}
+    sum_graph.embedding = torch.arange(12, dtype=torch.float32).reshape(2, 6) / 12
+    return sum_graph
+
+def make_model(kind, graph, seed):
+    torch.manual_seed(seed)
+    num_relations = 2 * len(graph.relations) + 1
+    if kind == 'embedding':
+        return Emb_Layers(num_relations, 4, 2, graph.num_nodes, 6, 1)
+    if kind == 'frozen':
+        # the transferred embedding is built again by a resumed run, the rows of the unmapped nodes differ
+        model = Emb_Layers(num_relations, 4, 2, graph.num_nodes, 6, 1)
+        model.load_embedding(sum_embeddings(graph, [summary_graph()], 6), freeze=True)
+        return model
+    # the attention has dropout, a resumed run continues with the random state of the checkpoint
+    model = Emb_ATT_Layers(num_relations, 4, 2, graph.num_nodes, 6, 2)
+    model.load_embedding(torch.randn(2, graph.num_nodes, 6), freeze=False)
+    return model
+
+def train(kind, checkpoint=None, seed=0):
+    graph = make_graph()
+    model = make_model(kind, graph, seed)
+    loss_f, activation = get_losst('TEST', sumModel=True)
+    torch.manual_seed(seed + 1)
+    trainer = Trainer(None, 4, EPOCHS, 6, 0.01, weight_d=0.00005, checkpoint=checkpoint)
+    _, losses, _, _ = trainer.train(model, graph, loss_f, activation, sum_graph=True, unit='unit')
+    return losses, model.state_dict()
+
+@pytest.mark.parametrize('kind', ['embedding', 'frozen', 'attention'])
+def test_resumed_training_equals_uninterrupted_training(tmp_path, monkeypatch, kind):
+    expected_losses, expected_state = train(kind)
+
+    path = str(tmp_path / 'checkpoint')
+    save_training = Checkpoint.save_training
+    def interrupt(self, unit, epoch, *args):
+        save_training(self, unit, epoch, *args)
+        if epoch + 1 == 2 * EVERY:
+            raise Interrupted()
+    monkeypatch.setattr(Checkpoint, 'save_training', interrupt)
+    with pytest.raises(Interrupted):
+        train(kind, Checkpoint(path, CONFIGS, EVERY))
+    monkeypatch.setattr(Checkpoint, 'save_training', save_training)
+
+    # the resumed run starts from another random state and initialization, the checkpoint restores both
+    losses, state = train(kind, Checkpoint(path, CONFIGS, EVERY, resume=True), seed=2)
+    assert losses == pytest.approx(expected_losses, abs=0)
+    assert state.keys() == expected_state.keys()
+    for name in state:
+        assert torch.equal(state[name], expected_state[name]), name
+
+def test_resume_rejects_other_configs(tmp_path):
+    path = str(tmp_path / 'checkpoint')
+    Checkpoint(path, CONFIGS, EVERY)
+    # configs of the run only (e.g. the checkpoint interval) may differ
+    Checkpoint(path, {**CONFIGS, 'ckpt_every': 5}, EVERY, resume=True)
+    with pytest.raises(AssertionError):
+        Checkpoint(path, {**CONFIGS, 'hl': 8}, EVERY, resume=True)
@@ -0,0 +1,96 @@
+import os
+import pickle
+import pytest
+
+import graphs.createAttributeSum as createAttributeSum
+from graphs.createAttributeSum import SUMMARIES, create_sum_map, finish_update, read_sum_counts, update_files, update_sum_map
+
+GRAPH = ['<http://x/a> <http://x/p> <http://x/b> .',
+         '<http://x/a> <http://x/q> "literal" .',
+         '<http://x/b> <http://x/p> <http://x/c> .',
+         '<http://x/c> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://x/C> .',
+         '<http://x/d> <http://x/q> <http://x/a> .',
+         '<http://x/d> <http://x/p> <http://x/b> .']
+ADDED = ['<http://x/e> <http://x/p> <http://x/a> .',
+         '<http://x/c> <http://x/q> "other literal" .']
+# the last triple is not in the graph and is ignored
+REMOVED = ['<http://x/d> <http://x/q> <http://x/a> .',
+           '<http://x/b> <http://x/p> <http://x/c> .',
+           '<http://x/z> <http://x/p> <http://x/a> .']
+
+def write(path, lines):
+    path.write_text(''.join(f'{line}\n' for line in lines))
+    return str(path)
+
+def summarize(folder, graph):
+    for sub in ['sum', 'map']:
+        (folder / sub).mkdir(parents=True)
+    path = write(folder / 'g.nt', graph)
+    create_sum_map(path, f'{folder}/sum/', f'{folder}/map/', 'T', f'{folder}/state.pkl')
+    return path
+
+def outputs(folder):
+    sums = {summary: read_sum_counts(f'{folder}/sum/T_sum_{summary}.nt') for summary in SUMMARIES}
+    maps = {summary: sorted((folder / 'map' / f'T_map_{summary}.nt').read_text().splitlines()) for summary in SUMMARIES}
+    with open(folder / 'state.pkl', 'rb') as f:
+        state = pickle.load(f)
+    return sums, maps, state
+
+def test_incremental_update_equals_recreated_summaries(tmp_path):
+    path = summarize(tmp_path / 'incremental', GRAPH)
+    update_sum_map(path, f'{tmp_path}/incremental/sum/', f'{tmp_path}/incremental/map/', 'T', f'{tmp_path}/incremental/state.pkl',
+                   write(tmp_path / 'add.nt', ADDED), write(tmp_path / 'remove.nt', REMOVED))
+
+    updated = [triple for triple in GRAPH if triple not in REMOVED] + ADDED
+    assert sorted((tmp_path / 'incremental' / 'g.nt').read_text().splitlines()) == sorted(updated)
+    summarize(tmp_path / 'recreated', updated)
+
+    sums, maps, state = outputs(tmp_path / 'incremental')
+    expected_sums, expected_maps, expected_state = outputs(tmp_path / 'recreated')
+    assert sums == expected_sums
+    assert maps == expected_maps
+    assert state['hashes'] == expected_state['hashes']
+    assert dict(state['degree']) == dict(expected_state['degree'])
+
+class Interrupted(Exception):
+    pass
+
+def interrupted_update(monkeypatch, folder, replaced):
+    """update the summaries in folder, the process is interrupted after replaced files (-1: while writing the state)"""
+    path = summarize(folder, GRAPH)
+    calls = []
+    def replace(src, dst):
+        if len(calls) == replaced:
+            raise Interrupted()
+        calls.append(dst)
+        os.rename(src, dst)
+    def save_state(state, state_path):
+        with open(state_path, 'wb') as f:
+            f.write(pickle.dumps(state)[:10])
+        raise Interrupted()
+    monkeypatch.setattr(createAttributeSum.os, 'replace', replace)
+    if replaced < 0:
+        monkeypatch.setattr(createAttributeSum, 'save_state', save_state)
+    with pytest.raises(Interrupted):
+        update_sum_map(path, f'{folder}/sum/', f'{folder}/map/', 'T', f'{folder}/state.pkl',
+                       write(folder.parent / 'add.nt', ADDED), write(folder.parent / 'remove.nt', REMOVED))
+    monkeypatch.undo()
+    return path
+
+@pytest.mark.parametrize('replaced', [-1, 0, 3, 7])
+def test_interrupted_update_is_rolled_forward_or_discarded(tmp_path, monkeypatch, replaced):
+    folder = tmp_path / 'interrupted'
+    path = interrupted_update(monkeypatch, folder, replaced)
+    finish_update(update_files(path, f'{folder}/sum/', f'{folder}/map/', 'T'), f'{folder}/state.pkl')
+    assert not [f for sub in ['.', 'sum', 'map'] for f in os.listdir(folder / sub) if f.endswith('.tmp')]
+
+    # the state is written last: the update is complete once the .tmp state is, otherwise no file was replaced
+    updated = [triple for triple in GRAPH if triple not in REMOVED] + ADDED
+    expected = GRAPH if replaced < 0 else updated
+    assert sorted((folder / 'g.nt').read_text().splitlines()) == sorted(expected)
+    summarize(tmp_path / 'expected', expected)
+    sums, maps, state = outputs(folder)
+    expected_sums, expected_maps, expected_state = outputs(tmp_path / 'expected')
+    assert sums == expected_sums
+    assert maps == expected_maps
+    assert state['hashes'] == expected_state['hashes']
@@ -0,0 +1,18 @@
+from graphs.graph import Graph
+from graphs.graphProcessing import get_classes, get_relation_buckets
+from graphs.ntParser import encode_lines
+
+# the type edges of a graph are its labels, in every variant of the type predicate
+LINES = ['<a> <p> <b> .',
+         '<b> <q> <c> .',
+         '<a> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <x_a> .',
+         '<b> <HTTPS://www.w3.org/1999/02/22-rdf-syntax-ns#Type> <x_b> .',
+         '<c> <type> <x_c> .']
+
+def test_type_edges_are_labels_and_not_relations():
+    terms, triples = encode_lines(LINES)
+    assert get_classes(terms, triples) == ['<x_a>', '<x_b>', '<x_c>']
+    assert sorted(get_relation_buckets(terms, triples)) == ['<p>', '<q>']
+    graph = Graph('test', dict())
+    graph.init_graph(terms, triples)
+    assert sorted(graph.relations) == ['<p>', '<q>']
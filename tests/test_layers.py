@@ -0,0 +1,67 @@
+import torch
+
+from graphs.graph import Graph, edge_norm
+from graphs.ntParser import encode_counted
+from helpers.results import Results
+from model.layers import Emb_ATT_Layers, WeightedRGCNConv
+
+# a summary graph with duplicate triples, written once with their multiplicity or as repeated lines
+COUNTED = ['<a> <p> <b> . # 3',
+           '<c> <p> <b> .',
+           '<b> <q> <a> . # 2',
+           '<c> <q> <a> .',
+           '<a> <p> <c> .',
+           '<b> <p> <b> . # 4']
+
+def expanded(lines):
+    expanded_lines = []
+    for line in lines:
+        triple, _, count = line.partition(' # ')
+        expanded_lines += [triple] * int(count or 1)
+    return expanded_lines
+
+def graph(lines, weighted):
+    g = Graph('test', dict())
+    terms, triples, counts = encode_counted(lines)
+    g.init_graph(terms, triples, counts, weighted=weighted)
+    return g
+
+def conv_outputs(conv, x, data, norm):
+    x = x.clone().requires_grad_(True)
+    out = conv(x, data.edge_index, data.edge_type, norm)
+    out.pow(2).sum().backward()
+    return out, x.grad
+
+def test_weighted_aggregation_equals_rgcn_on_duplicate_edges():
+    weighted, plain = graph(COUNTED, True), graph(expanded(COUNTED), False)
+    assert weighted.nodes == plain.nodes and weighted.relations == plain.relations
+    # every distinct edge once (in both directions) instead of once per duplicate
+    assert weighted.training_data.edge_index.size(1) == 2 * len(COUNTED) < plain.training_data.edge_index.size(1)
+
+    torch.manual_seed(0)
+    conv = WeightedRGCNConv(4, 3, 2 * len(plain.relations) + 1, num_bases=None)
+    x = torch.randn(plain.num_nodes, 4)
+    out, grad = conv_outputs(conv, x, weighted.training_data, weighted.training_data.edge_norm)
+    expected, expected_grad = conv_outputs(conv, x, plain.training_data, None)
+    assert torch.allclose(out, expected, atol=1e-6)
+    assert torch.allclose(grad, expected_grad, atol=1e-6)
+
+def test_uniform_edge_norm_equals_rgcn_mean():
+    # the edge-wise aggregation of the original graph (lean_agg) uses a uniform edge weight
+    data = graph(expanded(COUNTED), False).training_data
+    norm = edge_norm(data.edge_index, data.edge_type, torch.ones(data.edge_type.size(0)))
+
+    torch.manual_seed(0)
+    conv = WeightedRGCNConv(4, 3, 5, num_bases=None)
+    x = torch.randn(3, 4)
+    out, grad = conv_outputs(conv, x, data, norm)
+    expected, expected_grad = conv_outputs(conv, x, data, None)
+    assert torch.allclose(out, expected, atol=1e-6)
+    assert torch.allclose(grad, expected_grad, atol=1e-6)
+
+def test_embedding_memory_without_embedding():
+    # the attention model has no embedding without embedding transfer (-e_trans False)
+    model = Emb_ATT_Layers(3, 4, 2, 5, 6, 1)
+    results = Results()
+    results.add_embedding_memory(model, 'attention')
+    assert results.embedding_memory == dict()
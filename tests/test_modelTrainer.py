@@ -0,0 +1,33 @@
+import torch
+
+from torch import nn
+
+from model.modelTrainer import DecayedSparseAdam
+
+def embedding_after_steps(sparse, weight_decay, rows=None):
+    torch.manual_seed(0)
+    embedding = nn.Embedding(10, 4, sparse=sparse)
+    if sparse:
+        optimizer = DecayedSparseAdam(list(embedding.parameters()), lr=0.01, weight_decay=weight_decay)
+    else:
+        optimizer = torch.optim.Adam(embedding.parameters(), lr=0.01, weight_decay=weight_decay)
+    idx = torch.arange(10) if rows is None else rows
+    for _ in range(5):
+        optimizer.zero_grad()
+        embedding(idx).sum().backward()
+        optimizer.step()
+    return embedding.weight.detach()
+
+def test_sparse_weight_decay_matches_adam_when_every_row_is_looked_up():
+    # full-graph training looks up every row in every epoch
+    dense = embedding_after_steps(False, 5.0)
+    sparse = embedding_after_steps(True, 5.0)
+    assert torch.allclose(sparse, dense, atol=1e-5)
+    assert not torch.allclose(sparse, embedding_after_steps(True, 0.0), atol=1e-5)
+
+def test_sparse_weight_decay_keeps_untouched_rows():
+    torch.manual_seed(0)
+    initial = nn.Embedding(10, 4).weight.detach()
+    weight = embedding_after_steps(True, 0.5, rows=torch.tensor([1, 3]))
+    untouched = [i for i in range(10) if i not in [1, 3]]
+    assert torch.equal(weight[untouched], initial[untouched])
@@ -0,0 +1,28 @@
+import pytest
+
+from graphs.summaryProfiler import profile_summary
+
+
+def write(path, lines):
+    path.write_text(''.join(f'{line}\n' for line in lines))
+    return str(path)
+
+def test_purity_counts_unmapped_labelled_nodes_as_impure(tmp_path):
+    sum_path = write(tmp_path / 'sum.nt', ['<http://x/a> <http://x/p> <http://x/b> .'])
+    map_path = write(tmp_path / 'map.nt', ['<http://x/a> <issummaryof> <http://x/n1> .',
+                                           '<http://x/a> <issummaryof> <http://x/n2> .',
+                                           '<http://x/a> <issummaryof> <http://x/n6> .',
+                                           '<http://x/b> <issummaryof> <http://x/n3> .',
+                                           # n5 is in the map file, but only as a summary node
+                                           '<http://x/n5> <issummaryof> <http://x/n7> .'])
+    org2type = {'<http://x/n1>': {'<c1>'}, '<http://x/n2>': {'<c1>'}, '<http://x/n6>': {'<c1>'}, '<http://x/n3>': {'<c2>'},
+                # labelled, but without a summary node
+                '<http://x/n4>': {'<c2>'}, '<http://x/n5>': {'<c2>'},
+                '<http://x/n7>': set()}
+    profile = profile_summary(sum_path, map_path, org2type, {'<http://x/p>'}, dict(), 7, 4)
+
+    # a: 3 of 3 majority, b: 1 of 1, n4 and n5 are impure
+    assert profile['purity'] == pytest.approx(4 / 6)
+    # prior 3 / 6
+    assert profile['lift'] == pytest.approx((4 / 6 - 0.5) / 0.5)
+    assert profile['coverage'] == 1.0